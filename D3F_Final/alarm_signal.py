@@ -0,0 +1,45 @@
+import time
+
+from instrumentation import metrics
+
+#Upper bounds in seconds of the read latency histogram, a read is a tuple unpacking
+READ_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.0001, 0.001, 0.01)
+
+
+class AlarmSignal:
+    """
+    Single-writer alarm flag shared between the video and audio callbacks.
+
+    The video callback publishes a new immutable snapshot by rebinding one
+    attribute, which is atomic in CPython, so the audio callback can read the
+    latest state without taking any lock. Nothing else (storage, charts) runs
+    on this path, so the audio callback can only ever be delayed by a GIL
+    switch, never by a slow consumer of the video callback. The time each
+    read takes is recorded in d3f_alarm_signal_read_seconds (admin page and
+    /metrics) to check that bound.
+    """
+
+    def __init__(self, session: str = "default"):
+        # (play_alarm, perf_counter time it was published)
+        self._snapshot = (False, time.perf_counter())
+        self._read_metric = metrics.histogram("d3f_alarm_signal_read_seconds", "Time the audio callback spent reading the alarm state",
+                                              buckets=READ_BUCKETS, session=session)
+
+    def publish(self, play_alarm: bool):
+        """Called by the single writer (the video callback)"""
+        self._snapshot = (play_alarm, time.perf_counter())
+
+    def read(self):
+        """
+        Read the latest published alarm state without blocking.
+
+        Returns:
+            play_alarm: (bool) Whether the alarm should be playing.
+            age: (float) Seconds since that state was published.
+        """
+        start = time.perf_counter()
+        play_alarm, published = self._snapshot
+        end = time.perf_counter()
+
+        self._read_metric.observe(end - start)
+        return play_alarm, end - published
@@ -0,0 +1,62 @@
+import time
+
+
+class FrameAgeGate:
+    """
+    Decides whether a frame is still fresh enough to be worth processing.
+
+    A frame's age is measured by comparing its media timestamp with the local
+    clock. The smallest (local time - media time) seen so far is the baseline
+    of a frame that arrived without any queueing; a frame whose offset exceeds
+    that baseline by more than the latency budget has waited too long and is
+    skipped before inference. The baseline creeps up slowly so a single
+    early outlier or clock drift cannot pin it forever.
+    """
+
+    def __init__(self, latency_budget: float = 0.3, drift_per_second: float = 0.001):
+        self.latency_budget = latency_budget
+        self.drift_per_second = drift_per_second
+
+        self.offset = None  # Baseline local time - media time, in seconds
+        self._offset_updated = None
+        self.processed = 0
+        self.dropped = 0
+        self.last_age = 0.0
+
+    def admit(self, media_time: float, now: float = None):
+        """
+        Args:
+            media_time: (float) Presentation time of the frame in seconds.
+            now: (float) Local time the frame is handled, time.perf_counter()
+                         by default.
+
+        Returns:
+            True if the frame should be processed, False to skip it.
+        """
+        if now is None:
+            now = time.perf_counter()
+
+        offset = now - media_time
+        if self.offset is None:
+            self.offset = offset
+        else:
+            self.offset += self.drift_per_second * (now - self._offset_updated)
+            self.offset = min(self.offset, offset)
+        self._offset_updated = now
+
+        self.last_age = offset - self.offset
+        if self.last_age > self.latency_budget:
+            self.dropped += 1
+            return False
+
+        self.processed += 1
+        return True
+
+    def frame_time(self, media_time: float):
+        """Local time at which a frame with this media time was captured"""
+        return media_time + self.offset
+
+    @property
+    def drop_rate(self):
+        total = self.processed + self.dropped
+        return self.dropped / total if total else 0.0
@@ -0,0 +1,239 @@
+"""
+Offline scoring of recorded driver-facing videos.
+
+Each video is split into time chunks that are processed across a process
+pool, each chunk with its own FaceMesh so landmark tracking never carries
+over between chunks that are not contiguous. Seeking is not frame-accurate
+on every codec, so the stitched chunks are checked to cover every frame
+exactly once; when they do not, the video is decoded again sequentially.
+The per-frame EAR/MAR features are stitched back in order and the
+drowsiness state machine is run over the stitched timeline using the media
+timestamps. Each video is stored as one trip.
+
+Usage:
+    python batch_process.py recordings/*.mp4 --workers 8 --store mysql
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from drowsy_detection import EYE_IDXS, MOUTH_IDXS, DrowsinessStateMachine, calculate_ear_mar, get_mediapipe_app
+
+#Change threshold values if needed
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+logger = logging.getLogger("d3f.batch")
+
+#MySQL error code of CREATE TABLE on an existing table
+TABLE_EXISTS_ERROR = 1050
+
+
+def process_chunk(task):
+    """
+    Extract per-frame features for frames [start_frame, end_frame) of a video.
+
+    Returns:
+        features: (np.ndarray) One (media_time, EAR, MAR) row per frame,
+                               EAR and MAR are NaN when no face was found.
+    """
+    video_path, start_frame, end_frame = task
+
+    capture = cv2.VideoCapture(video_path)
+    if start_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    # A fresh FaceMesh per chunk, its tracking state only holds within contiguous frames
+    facemesh_model = get_mediapipe_app()
+    features = np.full((end_frame - start_frame, 3), np.nan)
+    count = 0
+    try:
+        while count < len(features):
+            media_time = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            # FaceMesh expects RGB, OpenCV decodes to BGR
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_h, frame_w, _ = frame_rgb.shape
+            results = facemesh_model.process(frame_rgb)
+
+            features[count, 0] = media_time
+            if results.multi_face_landmarks:
+                landmarks = results.multi_face_landmarks[0].landmark
+                EAR, MAR, _ = calculate_ear_mar(landmarks, EYE_IDXS["left"], EYE_IDXS["right"], MOUTH_IDXS["mouth"], frame_w, frame_h)
+                features[count, 1:] = (EAR, MAR)
+            count += 1
+    finally:
+        facemesh_model.close()
+        capture.release()
+
+    return features[:count]
+
+
+def split_video(video_path, chunk_seconds):
+    """
+    Return the frame ranges of a video, chunk_seconds long each.
+
+    Returns:
+        chunks: (list) (start_frame, end_frame) of each chunk.
+        fps: (float) Frame rate reported by the container.
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    finally:
+        capture.release()
+
+    chunk_frames = max(1, int(round(chunk_seconds * fps)))
+    return [(start, min(start + chunk_frames, frame_count)) for start in range(0, frame_count, chunk_frames)], fps
+
+
+def chunks_contiguous(parts, chunks, fps):
+    """
+    Check that chunk features stitch into the video without repeated or skipped frames.
+
+    Every chunk must hold as many frames as its range, and each chunk must
+    start one frame interval after the previous one ended.
+    """
+    prev_end = None
+    for features, (start_frame, end_frame) in zip(parts, chunks):
+        if len(features) != end_frame - start_frame:
+            return False
+        if not np.all(np.diff(features[:, 0]) > 0):
+            return False
+        if prev_end is not None and not 0.5 / fps < features[0, 0] - prev_end < 1.5 / fps:
+            return False
+        prev_end = features[-1, 0]
+    return True
+
+
+def score_timeline(features, start_epoch, thresholds):
+    """
+    Run the drowsiness state machine over stitched per-frame features.
+
+    Args:
+        features: (np.ndarray) (media_time, EAR, MAR) rows in media order.
+        start_epoch: (float) Wall-clock time of the first frame of the video.
+        thresholds: (dict) Contains EAR_THRESH, MAR_THRESH and WAIT_TIME.
+
+    Returns:
+        rows: (list) Trip samples in trip_storage.TRIP_COLUMNS order, one
+                     per frame with a face.
+    """
+    state = DrowsinessStateMachine(start_time=features[0, 0] if len(features) else 0.0)
+    rows = []
+    for media_time, EAR, MAR in features:
+        if math.isnan(EAR):
+            state.reset(media_time)
+            continue
+
+        play_alarm = state.update(EAR, MAR, media_time, thresholds)
+        # Plain Python values, pymysql does not convert numpy scalars
+        rows.append([float(start_epoch + media_time), float(EAR), float(MAR), state.eye_shut_counter, state.yawn_counter, state.alarm_counter,
+                     bool(play_alarm), float(state.fatigue.perclos), float(state.fatigue.blink_rate), float(state.fatigue.blink_duration)])
+
+    return rows
+
+
+def video_start_epoch(video_path, features):
+    """Best guess of when recording started: file modification time minus its length"""
+    duration = features[-1, 0] if len(features) else 0.0
+    return os.path.getmtime(video_path) - duration
+
+
+def store_trip(rows, start_epoch, store, log_dir, driver):
+    # Trip names are only precise to the second, videos starting in the same second get a _2, _3, ... suffix
+    base_name = f"trip_{time.strftime('%Y%m%d%H%M%S', time.localtime(start_epoch))}"
+    names = (base_name if n == 1 else f"{base_name}_{n}" for n in range(1, 1000))
+
+    if store == "mysql":
+        # Only imported when logging to MySQL
+        import pymysql
+        import trip_storage
+
+        trip_storage.create_database(trip_storage.db_credentials["database"])
+        trip_storage.create_summary_table()
+        for table_name in names:
+            try:
+                trip_storage.create_table(table_name)
+                break
+            except pymysql.err.OperationalError as e:
+                if e.args[0] != TABLE_EXISTS_ERROR:
+                    raise
+        trip_storage.insert_samples(table_name, rows)
+        trip_storage.write_trip_summary(table_name, thresholds, driver)
+        return table_name
+
+    if store == "sqlite":
+        from edge_log import SqliteTripLog
+
+        os.makedirs(log_dir, exist_ok=True)
+        table_name = next(name for name in names if not os.path.exists(os.path.join(log_dir, f"{name}.sqlite")))
+        log = SqliteTripLog(log_dir, driver=driver, table_name=table_name)
+        log.write_many(rows)
+        log.close()
+        return log.path
+
+    return None
+
+
+def run(args):
+    with multiprocessing.Pool(args.workers) as pool:
+        for video_path in args.videos:
+            started = time.perf_counter()
+            chunks, fps = split_video(video_path, args.chunk_seconds)
+            tasks = [(video_path, start, end) for start, end in chunks]
+
+            # imap keeps the chunks in order, so stitching is a concatenation
+            parts = list(pool.imap(process_chunk, tasks))
+            if len(parts) > 1 and not chunks_contiguous(parts, chunks, fps):
+                logger.warning("%s: seeking is not frame-accurate, decoding the video sequentially", video_path)
+                parts = [pool.apply(process_chunk, ((video_path, 0, chunks[-1][1]),))]
+            features = np.concatenate(parts) if parts else np.empty((0, 3))
+
+            start_epoch = args.start_epoch if args.start_epoch is not None else video_start_epoch(video_path, features)
+            rows = score_timeline(features, start_epoch, thresholds)
+            location = store_trip(rows, start_epoch, args.store, args.log_dir, args.driver)
+
+            elapsed = time.perf_counter() - started
+            logger.info("%s: %d frames in %.1fs (%.0f fps), %d alarms -> %s", video_path, len(features), elapsed,
+                        len(features) / elapsed if elapsed else 0.0, rows[-1][5] if rows else 0, location)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score recorded driver-facing videos with the D3F pipeline")
+    parser.add_argument("videos", nargs="+", help="video files to process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0, help="length of the chunks handed to workers (default: 30)")
+    parser.add_argument("--start-epoch", type=float, help="recording start as epoch seconds (default: file mtime minus length)")
+    parser.add_argument("--store", choices=("sqlite", "mysql", "none"), default="mysql", help="where trips are written (default: mysql)")
+    parser.add_argument("--log-dir", default="trips", help="directory for SQLite trip files (default: trips)")
+    parser.add_argument("--driver", help="driver name stored with the trips")
+    parser.add_argument("--ear-thresh", type=float, default=thresholds["EAR_THRESH"])
+    parser.add_argument("--mar-thresh", type=float, default=thresholds["MAR_THRESH"])
+    parser.add_argument("--wait-time", type=float, default=thresholds["WAIT_TIME"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    thresholds.update(EAR_THRESH=args.ear_thresh, MAR_THRESH=args.mar_thresh, WAIT_TIME=args.wait_time)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
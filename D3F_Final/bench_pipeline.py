@@ -0,0 +1,417 @@
+"""
+Per-stage latency benchmark of the frame pipeline.
+
+Runs every stage of the live pipeline on deterministic synthetic frames,
+landmark fixtures and audio frames and reports p50/p95/p99 latencies.
+Results can be written as JSON and compared against an earlier run.
+
+The frame path check runs the live frame path on synthetic frames and
+counts the colour conversions, copies and VideoFrame constructions per
+frame, and the distinct pixel buffers of the returned frames.
+
+The startup check times the top-level imports of the Streamlit app in a
+fresh interpreter and fails when they exceed the budget or pull in one of
+the heavy libraries that the pages are meant to import lazily.
+
+Usage:
+    python bench_pipeline.py --json bench.json
+    python bench_pipeline.py --json new.json --compare bench.json
+    python bench_pipeline.py --startup-only --startup-budget 2.0
+    python bench_pipeline.py --check-frame-path
+"""
+import argparse
+import ast
+import fractions
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import av
+import numpy as np
+
+import drowsy_detection
+import frame_path as frame_path_module
+from audio_handling import AudioFrameHandler
+from drowsy_detection import EYE_IDXS, MOUTH_IDXS, VideoFrameHandler, calculate_ear_mar, get_mediapipe_app, plot_landmarks, plot_text
+from edge_log import LOG_COLUMNS, SqliteTripLog
+from frame_path import FramePath, VideoFramePool
+
+# Define the audio file to use.
+path = os.path.dirname(__file__)
+alarm_file_path = os.path.join(path, "audio", "wake_up.wav")
+
+# Same shape as the landmarks returned by FaceMesh
+Landmark = namedtuple("Landmark", ["x", "y", "z"])
+FaceLandmarks = namedtuple("FaceLandmarks", ["landmark"])
+FaceMeshResults = namedtuple("FaceMeshResults", ["multi_face_landmarks"])
+
+# FaceMesh with refine_landmarks=True returns 478 landmarks
+NUM_LANDMARKS = 478
+
+# Percentiles reported for every stage
+PERCENTILES = (50, 95, 99)
+
+# Samples per timed storage insert, the batch size of the trip writers
+STORAGE_BATCH = 200
+
+# Libraries the Streamlit app must not import at startup
+HEAVY_MODULES = ("pandas", "plotly", "av", "mediapipe", "cv2", "pymysql", "streamlit_webrtc", "pydub")
+
+# Media time base of WebRTC video (90 kHz clock)
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+
+# Run in a fresh interpreter: time the imports and list what they loaded
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{imports}
+print(json.dumps({{"seconds": time.perf_counter() - started, "modules": sorted(sys.modules)}}))
+"""
+
+
+def synthetic_frames(count, width, height, seed=0):
+    """Deterministic RGB frames: a smooth gradient with some noise on top"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    base = np.broadcast_to(gradient, (height, width, 3)).astype(np.int16)
+    return [np.clip(base + rng.integers(0, 32, base.shape, dtype=np.int16), 0, 255).astype(np.uint8) for _ in range(count)]
+
+
+def landmark_fixtures(count, seed=0):
+    """
+    Deterministic face landmark lists with open and closed eyes.
+
+    Eye and mouth landmarks are laid out in their expected order so the
+    EAR/MAR computations take their normal path; every other landmark is
+    random noise inside the frame.
+    """
+    rng = np.random.default_rng(seed)
+    fixtures = []
+    for i in range(count):
+        points = rng.uniform(0.2, 0.8, (NUM_LANDMARKS, 2))
+        opening = 0.02 if i % 2 else 0.005  # Alternate open and closed eyes
+        for cx, idxs in ((0.6, EYE_IDXS["left"]), (0.4, EYE_IDXS["right"])):
+            # P1..P6 around an ellipse: corners at P1/P4, lids at P2, P3, P5, P6
+            for idx, (dx, dy) in zip(idxs, [(-0.04, 0), (-0.015, -opening), (0.015, -opening), (0.04, 0), (0.015, opening), (-0.015, opening)]):
+                points[idx] = (cx + dx, 0.4 + dy)
+        for idx, (dx, dy) in zip(MOUTH_IDXS["mouth"], [(-0.06, 0), (0.06, 0), (-0.03, -0.02), (-0.03, 0.02), (0, -0.025), (0, 0.025), (0.03, -0.02), (0.03, 0.02)]):
+            points[idx] = (0.5 + dx, 0.7 + dy)
+        fixtures.append([Landmark(x, y, 0.0) for x, y in points])
+    return fixtures
+
+
+def synthetic_audio_frames(count, sample_rate=48000, samples=960):
+    """Stereo s16 audio frames as delivered by WebRTC (20 ms each)"""
+    t = np.arange(samples) / sample_rate
+    tone = (np.sin(2 * np.pi * 440 * t) * 3000).astype(np.int16)
+    packed = np.repeat(tone, 2).reshape(1, -1)
+    frames = []
+    for i in range(count):
+        frame = av.AudioFrame.from_ndarray(packed, format="s16", layout="stereo")
+        frame.sample_rate = sample_rate
+        frame.pts = i * samples
+        frames.append(frame)
+    return frames
+
+
+def measure(func, inputs, warmup):
+    """Call func on each input and return the latencies in milliseconds"""
+    for item in inputs[:warmup]:
+        func(item)
+
+    timings = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return np.asarray(timings)
+
+
+def run_benchmarks(iterations, width, height, warmup):
+    frames = synthetic_frames(iterations, width, height)
+    video_frames = [av.VideoFrame.from_ndarray(frame, format="rgb24").reformat(format="yuv420p") for frame in frames]
+    landmarks = landmark_fixtures(iterations)
+    audio_frames = synthetic_audio_frames(iterations)
+
+    facemesh_model = get_mediapipe_app()
+    audio_handler = AudioFrameHandler(sound_file_path=alarm_file_path)
+    pool = VideoFramePool()
+
+    coordinates = [calculate_ear_mar(lms, EYE_IDXS["left"], EYE_IDXS["right"], MOUTH_IDXS["mouth"], width, height)[2] for lms in landmarks]
+    color = (0, 255, 0)
+
+    def draw(i):
+        frame = frames[i].copy()
+        _, out = pool.next(width, height)
+        frame = plot_landmarks(frame, *coordinates[i], color, out)
+        plot_text(frame, "EAR: 0.25", (10, 30), color)
+        plot_text(frame, "MAR: 0.40", (10, 60), color)
+
+    def mirror(i):
+        _, out = pool.next(width, height)
+        drowsy_detection.cv2.flip(frames[i], 1, out)
+
+    def audio(i):
+        # Alternate between alarm and silence, in runs of 50 frames (1 s)
+        audio_handler.process(audio_frames[i], play_sound=(i // 50) % 2 == 1)
+
+    log_dir = tempfile.mkdtemp(prefix="d3f-bench-")
+    trip_log = SqliteTripLog(log_dir)
+    row = {"timestamp": time.time(), "EAR": 0.25, "MAR": 0.4, "eye_shut_counter": 1, "yawn_counter": 0, "alarm_counter": 0, "alarm_on": False,
+           "perclos": 5.0, "blink_rate": 15.0, "blink_duration": 0.2}
+    batch = [[row[column] for column in LOG_COLUMNS]] * STORAGE_BATCH
+
+    indices = list(range(iterations))
+    stages = {
+        "frame.to_ndarray(rgb24)": lambda i: video_frames[i].to_ndarray(format="rgb24"),
+        "facemesh_model.process": lambda i: facemesh_model.process(frames[i]),
+        "calculate_ear_mar": lambda i: calculate_ear_mar(landmarks[i], EYE_IDXS["left"], EYE_IDXS["right"], MOUTH_IDXS["mouth"], width, height),
+        "plot_landmarks+plot_text": draw,
+        "mirror into pooled frame": mirror,
+        "AudioFrameHandler.process": audio,
+        # One committed multi-row insert, as flushed by the trip writers (write() alone only buffers the row)
+        f"storage.insert ({STORAGE_BATCH} rows)": lambda i: trip_log.write_many(batch),
+    }
+
+    results = {}
+    for name, func in stages.items():
+        timings = measure(func, indices, warmup)
+        results[name] = {f"p{p}": float(np.percentile(timings, p)) for p in PERCENTILES}
+        results[name]["mean"] = float(timings.mean())
+        results[name]["n"] = len(timings)
+
+    trip_log.close()
+    return results
+
+
+class FixtureFaceMesh:
+    """Stands in for FaceMesh in the frame path check: alternates landmark fixtures and no face"""
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.calls = 0
+
+    def process(self, frame):
+        self.calls += 1
+        if self.calls % 4 == 0:
+            return FaceMeshResults(None)
+        return FaceMeshResults([FaceLandmarks(self.fixtures[self.calls % len(self.fixtures)])])
+
+
+class CountingProxy:
+    """Module proxy counting calls to some of its functions"""
+
+    def __init__(self, module, names):
+        self._module = module
+        self.counts = dict.fromkeys(names, 0)
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        if name not in self.counts:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingFrame:
+    """Received frame wrapper counting the conversions made from it"""
+
+    def __init__(self, frame, counts):
+        self.frame = frame
+        self.width, self.height = frame.width, frame.height
+        self.pts, self.time_base = frame.pts, frame.time_base
+        self.counts = counts
+
+    def to_ndarray(self, **kwargs):
+        key = f"to_ndarray({kwargs.get('format')})"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return self.frame.to_ndarray(**kwargs)
+
+    def reformat(self, *args, **kwargs):
+        self.counts["reformat"] = self.counts.get("reformat", 0) + 1
+        return self.frame.reformat(*args, **kwargs)
+
+
+def check_frame_path(width, height, count=120, warmup=8):
+    """
+    Count what the live frame path does per frame, after warm-up.
+
+    Returns:
+        result: (dict) Per-frame conversions, mirror copies, output frame
+                       allocations and VideoFrame constructions, the pixel
+                       buffers returned, and whether they match the
+                       single-conversion design.
+    """
+    frames = [av.VideoFrame.from_ndarray(frame, format="rgb24").reformat(format="yuv420p") for frame in synthetic_frames(8, width, height)]
+    for i, frame in enumerate(frames):
+        frame.pts = i * 3000
+        frame.time_base = VIDEO_TIME_BASE
+
+    handler = VideoFrameHandler(session="bench-frame-path", facemesh_model=FixtureFaceMesh(landmark_fixtures(16)))
+    path_under_test = FramePath(handler)
+    thresholds = {"EAR_THRESH": 0.18, "MAR_THRESH": 0.90, "WAIT_TIME": 4.0}
+
+    for i in range(warmup):
+        path_under_test(frames[i % len(frames)], thresholds)
+
+    frame_counts = {}
+    cv2_proxy = CountingProxy(drowsy_detection.cv2, ("cvtColor", "flip"))
+    av_proxy = CountingProxy(av, ("VideoFrame",))
+    real_cv2, drowsy_detection.cv2 = drowsy_detection.cv2, cv2_proxy
+    real_av, frame_path_module.av = frame_path_module.av, av_proxy
+    allocations_before = path_under_test.pool.allocations
+    outputs = set()
+    buffers = set()
+    timing_mismatches = 0
+    try:
+        for i in range(count):
+            frame = frames[i % len(frames)]
+            new_frame, _ = path_under_test(CountingFrame(frame, frame_counts), thresholds)
+            outputs.add(id(new_frame))
+            buffers.add(new_frame.planes[0].buffer_ptr)
+            timing_mismatches += new_frame.pts != frame.pts or new_frame.time_base != frame.time_base
+    finally:
+        drowsy_detection.cv2 = real_cv2
+        frame_path_module.av = real_av
+
+    result = {
+        "conversions": {name: calls / count for name, calls in frame_counts.items()},
+        "cvtColor": cv2_proxy.counts["cvtColor"] / count,
+        "mirror_copies": cv2_proxy.counts["flip"] / count,
+        "output_allocations": (path_under_test.pool.allocations - allocations_before) / count,
+        "video_frames_created": av_proxy.counts["VideoFrame"] / count,
+        "output_frames_reused": len(outputs),
+        "output_buffers": len(buffers),
+        "timing_mismatches": timing_mismatches,
+    }
+    result["passed"] = (result["conversions"] == {"to_ndarray(rgb24)": 1.0} and result["cvtColor"] == 0
+                        and result["mirror_copies"] == 1.0 and result["output_allocations"] == 0 and result["video_frames_created"] == 0
+                        and result["output_frames_reused"] <= path_under_test.pool.size and result["output_buffers"] <= path_under_test.pool.size
+                        and timing_mismatches == 0)
+    return result
+
+
+def top_level_imports(script):
+    """Import statements at module level of a script, as source lines"""
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def probe_imports(imports):
+    probe = IMPORT_PROBE.format(imports="\n".join(imports))
+    output = subprocess.run([sys.executable, "-c", probe], cwd=path, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_startup(budget, script=os.path.join(path, "streamlit_app.py")):
+    """
+    Time the app's top-level imports against a bare "import streamlit".
+
+    Returns:
+        result: (dict) Import time in seconds beyond the baseline, the heavy
+                       modules loaded at startup and whether the check passed.
+    """
+    baseline = probe_imports(["import streamlit"])
+    app = probe_imports(top_level_imports(script))
+
+    loaded = set(app["modules"]) - set(baseline["modules"])
+    heavy = sorted(name for name in HEAVY_MODULES if name in loaded)
+    seconds = max(0.0, app["seconds"] - baseline["seconds"])
+    return {"seconds": seconds, "budget": budget, "heavy_modules": heavy, "passed": seconds <= budget and not heavy}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'stage':<28}" + "".join(f"{f'p{p} ms':>12}" for p in PERCENTILES)
+    if baseline:
+        header += f"{'p50 change':>12}"
+    print(header)
+    for name, stats in results.items():
+        line = f"{name:<28}" + "".join(f"{stats[f'p{p}']:>12.3f}" for p in PERCENTILES)
+        if baseline and name in baseline:
+            previous = baseline[name]["p50"]
+            line += f"{(stats['p50'] - previous) / previous * 100 if previous else 0.0:>+11.1f}%"
+        elif baseline:
+            line += f"{'no baseline':>12}"
+        print(line)
+
+    # Stages renamed or removed since the baseline would otherwise drop out of the comparison silently
+    if baseline:
+        for name in baseline:
+            if name not in results:
+                print(f"{name:<28}" + f"{'not in this run':>{12 * len(PERCENTILES) + 12}}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark of the D3F frame pipeline")
+    parser.add_argument("--iterations", type=int, default=300, help="measured calls per stage (default: 300)")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured calls before each stage (default: 20)")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--startup-budget", type=float, default=1.0, help="allowed app import time in seconds beyond streamlit itself (default: 1.0)")
+    parser.add_argument("--startup-only", action="store_true", help="only run the startup import check")
+    parser.add_argument("--check-frame-path", action="store_true", help="only check conversions and copies per frame of the frame path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.check_frame_path:
+        frame_path = check_frame_path(args.width, args.height)
+        print(json.dumps(frame_path, indent=2))
+        sys.exit(0 if frame_path["passed"] else 1)
+
+    startup = check_startup(args.startup_budget)
+    print(f"startup imports: {startup['seconds']:.3f}s (budget {startup['budget']:.3f}s)"
+          + (f", heavy modules loaded: {', '.join(startup['heavy_modules'])}" if startup["heavy_modules"] else ""))
+
+    if args.startup_only:
+        sys.exit(0 if startup["passed"] else 1)
+
+    stages = run_benchmarks(args.iterations, args.width, args.height, args.warmup)
+    report = {
+        "revision": git_revision(),
+        "created": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "config": {"iterations": args.iterations, "warmup": args.warmup, "width": args.width, "height": args.height},
+        "stages": stages,
+        "startup": startup,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["stages"]
+
+    print_results(stages, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not startup["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
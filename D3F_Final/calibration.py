@@ -0,0 +1,184 @@
+"""
+Per-driver threshold calibration at the start of a trip.
+
+During the first CALIBRATION_SECONDS with a face in view, the EAR and MAR of
+every frame feed P-square streaming quantile estimators (five markers each,
+no sample history). The driver's open-eye EAR baseline is the median EAR,
+which blinks do not move; the MAR distribution is summarised by its median
+and 95th percentile, which cover normal talking. Thresholds are derived from
+them and clamped to a sane range.
+"""
+
+#Seconds of face-in-view frames used to calibrate at the start of a trip
+CALIBRATION_SECONDS = 60.0
+
+#Fewer samples than this (e.g. the face was mostly out of view) is not trusted
+MIN_SAMPLES = 300
+
+#Eyes count as closed below this fraction of the open-eye EAR baseline
+EAR_BASELINE_RATIO = 0.65
+
+#A yawn opens the mouth this much wider than the 95th percentile of the calibration MAR
+MAR_P95_RATIO = 1.5
+
+#Derived thresholds are kept inside these bounds
+EAR_THRESH_RANGE = (0.12, 0.30)
+MAR_THRESH_RANGE = (0.60, 1.20)
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate in O(1) memory (Jain & Chlamtac's P-square algorithm).
+
+    Keeps five markers whose heights approximate the minimum, p/2, p,
+    (1+p)/2 quantiles and maximum, adjusted with a piecewise-parabolic
+    formula as observations arrive.
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0]
+        self.increments = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+
+    def add(self, x: float):
+        self.count += 1
+        q = self.heights
+
+        # The first five observations initialise the markers
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the three middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            ordered = sorted(self.heights)
+            return ordered[min(len(ordered) - 1, int(self.p * len(ordered)))]
+        return self.heights[2]
+
+
+def _clamp(value, bounds):
+    return min(max(value, bounds[0]), bounds[1])
+
+
+class ThresholdCalibrator:
+    """
+    Collects EAR/MAR statistics of a driver at the start of a trip.
+
+    update() is cheap enough to call from the video callback; once the
+    calibration window has passed, result() returns the derived thresholds.
+    """
+
+    def __init__(self, duration: float = CALIBRATION_SECONDS, min_samples: int = MIN_SAMPLES):
+        self.duration = duration
+        self.min_samples = min_samples
+        self.start_time = None
+        self.last_time = None
+        self.done = False
+
+        self.ear_median = P2Quantile(0.5)
+        self.mar_median = P2Quantile(0.5)
+        self.mar_p95 = P2Quantile(0.95)
+
+    @property
+    def samples(self):
+        return self.ear_median.count
+
+    @property
+    def progress(self):
+        if self.done or self.start_time is None:
+            return 1.0 if self.done else 0.0
+        return min(1.0, (self.last_time - self.start_time) / self.duration)
+
+    def update(self, EAR: float, MAR: float, now: float):
+        """
+        Args:
+            EAR: (float) Average eye aspect ratio of a frame with a face.
+            MAR: (float) Mouth aspect ratio of the frame.
+            now: (float) Time of the frame in seconds.
+
+        Returns:
+            True once the calibration window is over.
+        """
+        if self.done:
+            return True
+
+        if self.start_time is None:
+            self.start_time = now
+        self.last_time = now
+
+        self.ear_median.add(EAR)
+        self.mar_median.add(MAR)
+        self.mar_p95.add(MAR)
+
+        if now - self.start_time >= self.duration:
+            self.done = True
+        return self.done
+
+    def result(self, thresholds: dict):
+        """
+        Args:
+            thresholds: (dict) Current thresholds, WAIT_TIME and anything
+                               else not calibrated is kept from it.
+
+        Returns:
+            The calibrated thresholds, or None if calibration is not over or
+            did not see enough frames with a face.
+        """
+        if not self.done or self.samples < self.min_samples:
+            return None
+
+        calibrated = dict(thresholds)
+        calibrated["EAR_THRESH"] = round(_clamp(self.ear_median.value() * EAR_BASELINE_RATIO, EAR_THRESH_RANGE), 3)
+        calibrated["MAR_THRESH"] = round(_clamp(self.mar_p95.value() * MAR_P95_RATIO, MAR_THRESH_RANGE), 3)
+        return calibrated
+
+    def statistics(self):
+        """Estimated baseline statistics, as stored with the driver's thresholds"""
+        return {
+            "ear_baseline": self.ear_median.value(),
+            "mar_median": self.mar_median.value(),
+            "mar_p95": self.mar_p95.value(),
+            "samples": self.samples,
+        }
@@ -0,0 +1,168 @@
+"""
+Host-wide capture resolution and frame rate policy.
+
+Browsers are asked for the capture profile the host can currently afford:
+the smallest profile that meets the detection accuracy target to begin with,
+stepped up while every session has processing headroom and stepped back down
+as soon as one of them exceeds its share of the host's CPU. The same profile
+applies to every session on the host. New streams request it through
+media_stream_constraints; running streams follow frame rate changes by
+skipping frames before they are decoded.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+CaptureProfile = namedtuple("CaptureProfile", ["width", "height", "fps"])
+
+# Candidate profiles, cheapest first (pixels per second)
+PROFILES = (
+    CaptureProfile(320, 240, 10),
+    CaptureProfile(480, 360, 10),
+    CaptureProfile(480, 360, 15),
+    CaptureProfile(640, 480, 15),
+    CaptureProfile(640, 480, 24),
+    CaptureProfile(640, 480, 30),
+    CaptureProfile(1280, 720, 30),
+)
+
+#Smallest profile meeting the detection accuracy target: below 480x360 the eye
+#landmarks of a driver at arm's length are only a few pixels apart, and blinks
+#need at least 15 fps to be seen
+MIN_PROFILE = CaptureProfile(480, 360, 15)
+
+#Largest profile ever requested, more pixels do not improve the EAR/MAR signal
+MAX_PROFILE = CaptureProfile(640, 480, 30)
+
+#A session over this fraction of its CPU share makes the host step down a profile
+HIGH_LOAD = 0.8
+
+#Every session under this fraction of its CPU share (also after the step) lets the host step up
+LOW_LOAD = 0.5
+
+#Seconds between policy decisions
+ADJUST_INTERVAL = 10.0
+
+
+def parse_profile(text):
+    """Parse a profile written as WIDTHxHEIGHT@FPS, e.g. 480x360@15"""
+    size, fps = text.split("@")
+    width, height = size.lower().split("x")
+    return CaptureProfile(int(width), int(height), int(fps))
+
+
+def profile_cost(profile):
+    return profile.width * profile.height * profile.fps
+
+
+class SessionLoad:
+    """Processing time of one session, written only by its video callback"""
+
+    def __init__(self):
+        self.busy = 0.0
+        self.frames = 0
+
+    def record(self, seconds: float):
+        self.busy += seconds
+        self.frames += 1
+
+
+class CaptureProfileManager:
+    """
+    Chooses the capture profile of every session on the host.
+
+    Sessions register a SessionLoad and record the processing time of each
+    frame in it; a background thread compares each session's busy time with
+    its share of the host's cores every ADJUST_INTERVAL seconds.
+    """
+
+    def __init__(self, profiles=PROFILES, min_profile: CaptureProfile = MIN_PROFILE, max_profile: CaptureProfile = MAX_PROFILE,
+                 cores: int = None, high_load: float = HIGH_LOAD, low_load: float = LOW_LOAD, interval: float = ADJUST_INTERVAL):
+        self.ladder = [profile for profile in sorted(profiles, key=profile_cost)
+                       if profile_cost(min_profile) <= profile_cost(profile) <= profile_cost(max_profile)
+                       and profile.width >= min_profile.width and profile.fps >= min_profile.fps]
+        if not self.ladder:
+            self.ladder = [min_profile]
+
+        self.cores = cores or os.cpu_count() or 1
+        self.high_load = high_load
+        self.low_load = low_load
+        self.interval = interval
+
+        self.level = 0  # Index in the ladder, start with the smallest profile meeting the target
+        self.loads = {}  # Highest session load seen at the last decision, as a fraction of its share
+        self._sessions = {}
+        self._previous = {}
+        self._last_adjust = time.perf_counter()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="CaptureProfileManager", daemon=True)
+        self._thread.start()
+
+    @property
+    def profile(self):
+        return self.ladder[self.level]
+
+    def media_stream_constraints(self):
+        """Constraints for webrtc_streamer asking the browser for the current profile"""
+        profile = self.profile
+        return {
+            "video": {
+                "width": {"ideal": profile.width, "max": profile.width},
+                "height": {"ideal": profile.height, "max": profile.height},
+                "frameRate": {"ideal": profile.fps, "max": profile.fps},
+            },
+            "audio": True,
+        }
+
+    def frame_interval(self):
+        """Minimum media time between processed frames, faster frames are skipped"""
+        return 1.0 / self.profile.fps
+
+    def register(self, session: str):
+        with self._lock:
+            load = self._sessions.setdefault(session, SessionLoad())
+            self._previous.setdefault(session, 0.0)
+        return load
+
+    def unregister(self, session: str):
+        with self._lock:
+            self._sessions.pop(session, None)
+            self._previous.pop(session, None)
+            self.loads.pop(session, None)
+
+    def adjust(self, now: float = None):
+        """Measure every session's load since the last call and step the profile if needed"""
+        now = time.perf_counter() if now is None else now
+        elapsed = now - self._last_adjust
+        self._last_adjust = now
+        if elapsed <= 0:
+            return self.profile
+
+        with self._lock:
+            sessions = dict(self._sessions)
+
+        # Each session is entitled to an equal share of the cores, at most one core
+        share = min(1.0, self.cores / len(sessions)) if sessions else 1.0
+        loads = {}
+        for session, load in sessions.items():
+            busy = load.busy
+            loads[session] = (busy - self._previous.get(session, busy)) / elapsed / share
+            self._previous[session] = busy
+        self.loads = loads
+
+        highest = max(loads.values(), default=0.0)
+        if highest > self.high_load and self.level > 0:
+            self.level -= 1
+        elif sessions and self.level + 1 < len(self.ladder):
+            # Step up only if the load, scaled to the next profile, would stay low
+            scale = profile_cost(self.ladder[self.level + 1]) / profile_cost(self.profile)
+            if highest * scale < self.low_load:
+                self.level += 1
+        return self.profile
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.adjust()
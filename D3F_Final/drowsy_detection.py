@@ -1,12 +1,30 @@
 import cv2
 import time
 import numpy as np
-import pandas as pd
+from collections import deque
 import mediapipe as mp
-import time
 #import datetime
+from instrumentation import metrics
 from mediapipe.python.solutions.drawing_utils import _normalized_to_pixel_coordinates as denormalize_coordinates
 
+# Left and right eye chosen landmarks.
+EYE_IDXS = {
+    "left": [362, 385, 387, 263, 373, 380],
+    "right": [33, 160, 158, 133, 153, 144],
+}
+
+# Mouth chosen landmarks.
+MOUTH_IDXS = {"mouth": [61, 291, 39, 181, 0, 17, 269, 405]}
+
+# Length in seconds of the sliding window of the fatigue indicators.
+FATIGUE_WINDOW = 60.0
+
+# Frames further apart than this (e.g. no face in between) add no time to PERCLOS.
+MAX_FRAME_GAP = 1.0
+
+# Longest eye closure in seconds counted as a blink, longer ones are microsleeps.
+BLINK_MAX_DURATION = 0.5
+
 
 def get_mediapipe_app(
     max_num_faces=1,
@@ -117,13 +135,14 @@ def calculate_ear_mar(landmarks, left_eye_idxs, right_eye_idxs, mouth_idxs, imag
     return Avg_EAR, cur_MAR, (left_lm_coordinates, right_lm_coordinates, mouth_lm_coordinates)
 
 
-def plot_landmarks(frame, left_lm_coordinates, right_lm_coordinates, mouth_lm_coordinates, color):
+def plot_landmarks(frame, left_lm_coordinates, right_lm_coordinates, mouth_lm_coordinates, color, out=None):
+    """Draw the landmarks in place, then mirror the frame into out (a new array if None)"""
     for lm_coordinates in [left_lm_coordinates, right_lm_coordinates, mouth_lm_coordinates]:
         if lm_coordinates:
             for coord in lm_coordinates:
                 cv2.circle(frame, coord, 2, color, -1)
 
-    frame = cv2.flip(frame, 1)
+    frame = cv2.flip(frame, 1, out)
     return frame
 
 def plot_text(image, text, origin, color, font=cv2.FONT_HERSHEY_SIMPLEX, fntScale=0.8, thickness=2):
@@ -131,61 +150,253 @@ def plot_text(image, text, origin, color, font=cv2.FONT_HERSHEY_SIMPLEX, fntScal
     return image
 
 
+class FatigueWindow:
+    """
+    PERCLOS, blink rate and mean blink duration over a sliding time window.
+
+    Every frame appends one (time, duration, closed) entry and every
+    finished blink one (time, duration) entry to a deque; entries leaving
+    the window are popped from the front and running sums are kept, so an
+    update is O(1) amortised whatever the window length.
+    """
+
+    def __init__(self, window: float = FATIGUE_WINDOW):
+        self.window = window
+        self._frames = deque()  # (time, duration, closed) per frame
+        self._blinks = deque()  # (end time, duration) per blink
+        self._frame_time = 0.0
+        self._closed_time = 0.0
+        self._blink_time = 0.0
+        self._first_time = None
+        self._last_time = None
+        self._closed_since = None
+
+    def update(self, now: float, closed: bool):
+        """Add one frame with a face, closed is whether the eyes are shut"""
+        if self._first_time is None:
+            self._first_time = now
+        dt = now - self._last_time if self._last_time is not None else 0.0
+        if not 0.0 <= dt <= MAX_FRAME_GAP:
+            # The eyes were not seen in between, a closure before the gap is not a blink
+            dt = 0.0
+            self._closed_since = None
+        self._last_time = now
+
+        self._frames.append((now, dt, closed))
+        self._frame_time += dt
+        if closed:
+            self._closed_time += dt
+
+        if closed and self._closed_since is None:
+            self._closed_since = now
+        elif not closed and self._closed_since is not None:
+            duration = now - self._closed_since
+            if duration <= BLINK_MAX_DURATION:
+                self._blinks.append((now, duration))
+                self._blink_time += duration
+            self._closed_since = None
+
+        # Drop what left the window
+        start = now - self.window
+        while self._frames and self._frames[0][0] < start:
+            _, dt, closed = self._frames.popleft()
+            self._frame_time -= dt
+            if closed:
+                self._closed_time -= dt
+        while self._blinks and self._blinks[0][0] < start:
+            self._blink_time -= self._blinks.popleft()[1]
+
+    def face_lost(self):
+        """No face in the frame: forget the closure in progress, it is not a blink"""
+        self._closed_since = None
+
+    @property
+    def perclos(self):
+        """Percentage of the window with the eyes closed"""
+        return 100.0 * self._closed_time / self._frame_time if self._frame_time > 0 else 0.0
+
+    @property
+    def blink_rate(self):
+        """Blinks per minute"""
+        if self._last_time is None:
+            return 0.0
+        span = min(self.window, self._last_time - self._first_time)
+        return 60.0 * len(self._blinks) / span if span >= 1.0 else 0.0
+
+    @property
+    def blink_duration(self):
+        """Mean blink duration in seconds"""
+        return self._blink_time / len(self._blinks) if self._blinks else 0.0
+
+
+class DrowsinessStateMachine:
+    """
+    Drowsiness decision logic, independent of where EAR/MAR and time come from.
+
+    Live sessions drive it with time.perf_counter(); offline tools drive it
+    with media timestamps so recorded videos are scored on their own timeline.
+    """
+
+    def __init__(self, start_time: float = None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.drowsy_time = 0.0  # Holds the amount of time passed with EAR < EAR_THRESH
+        self.play_alarm = False
+
+        self.eye_shut_counter = 0
+        self.yawn_counter = 0
+        self.alarm_counter = 0
+        self.yawn_flag = False
+        self.eye_shut_flag = False
+        self.alarm_flag = False
+
+        # Sliding-window fatigue indicators (PERCLOS, blink rate and duration)
+        self.fatigue = FatigueWindow()
+
+    def update(self, EAR: float, MAR: float, now: float, thresholds: dict):
+        """
+        Advance the state with the measurements of one frame.
+
+        Args:
+            EAR: (float) Average eye aspect ratio of the frame.
+            MAR: (float) Mouth aspect ratio of the frame.
+            now: (float) Time of the frame in seconds.
+            thresholds: (dict) Contains EAR_THRESH, MAR_THRESH and WAIT_TIME.
+
+        Returns:
+            A boolean flag to indicate if the alarm should be played or not.
+        """
+        if MAR > thresholds["MAR_THRESH"]:
+            if self.yawn_flag != True:
+                self.yawn_counter += 1
+                self.yawn_flag = True
+        else:
+            self.yawn_flag = False
+
+        self.fatigue.update(now, EAR < thresholds["EAR_THRESH"])
+
+        if EAR < thresholds["EAR_THRESH"]:
+
+            # Increase DROWSY_TIME to track the time period with EAR less than the threshold
+            # and reset the start_time for the next iteration.
+            self.drowsy_time += now - self.start_time
+            self.start_time = now
+
+            if self.eye_shut_flag != True:
+                self.eye_shut_counter += 1
+                self.eye_shut_flag = True
+
+            if self.drowsy_time >= thresholds["WAIT_TIME"]:
+                self.play_alarm = True
+
+                if self.alarm_flag != True:
+                    self.alarm_counter += 1
+                    self.alarm_flag = True
+            else:
+                self.alarm_flag = False
+
+        else:
+            self.reset(now)
+            self.eye_shut_flag = False
+
+        return self.play_alarm
+
+    def reset(self, now: float):
+        """Eyes open or no face in the frame: stop accumulating drowsy time"""
+        self.start_time = now
+        self.drowsy_time = 0.0
+        self.play_alarm = False
+        self.fatigue.face_lost()
+
+
 class VideoFrameHandler:
-    def __init__(self):
+    def __init__(self, session: str = "default", facemesh_model=None, recorder=None):
         """
         Initialize the necessary constants, mediapipe app
         and tracker variables
-        """
-        # Left and right eye chosen landmarks.
-        self.eye_idxs = {
-            "left": [362, 385, 387, 263, 373, 380],
-            "right": [33, 160, 158, 133, 153, 144],
-        }
 
-        # Mouth chosen landmarks.
-        self.mouth_idxs ={ "mouth": [61, 291, 39, 181, 0, 17, 269, 405]}
+        Args:
+            session: (str) Label of the session in the recorded metrics.
+            facemesh_model: Already built FaceMesh graph (e.g. from the
+                            warm-up pool), a new one is built if None.
+            recorder: Optional landmark_log.LandmarkRecorder that records
+                      the landmarks of every frame for replay.
+        """
+        # Left and right eye and mouth chosen landmarks.
+        self.eye_idxs = EYE_IDXS
+        self.mouth_idxs = MOUTH_IDXS
 
         # Used for coloring landmark points.
         # Its value depends on the current EAR value.
-        self.RED = (0, 0, 255)  # BGR
-        self.GREEN = (0, 255, 0)  # BGR
+        self.RED = (255, 0, 0)  # RGB, frames are processed in the model's colour order
+        self.GREEN = (0, 255, 0)  # RGB
 
         # Initializing Mediapipe FaceMesh solution pipeline
-        self.facemesh_model = get_mediapipe_app()
+        self.facemesh_model = facemesh_model if facemesh_model is not None else get_mediapipe_app()
+        self.recorder = recorder
+
+        # Drowsiness decision logic, counters and alarm state.
+        self.state_machine = DrowsinessStateMachine()
 
-        # For tracking counters and sharing states in and out of callbacks.
+        # For sharing states in and out of callbacks.
         self.state_tracker = {
-            "start_time": time.perf_counter(),
-            "DROWSY_TIME": 0.0,  # Holds the amount of time passed with EAR < EAR_THRESH
             "COLOR": self.GREEN,
-            "play_alarm": False
         }
 
         self.EAR_txt_pos = (10, 30)
         self.MAR_txt_pos = (10, 60)
-        self.eye_shut_counter = 0
-        self.yawn_counter = 0
-        self.alarm_counter = 0
-        self.yawn_flag = False
-        self.eye_shut_flag = False
-        self.alarm_flag = False
+        self.PERCLOS_txt_pos = (10, 90)
+        self.BLINK_txt_pos = (10, 120)
         self.row_dict = {}
 
-    def process(self, frame: np.array, thresholds: dict):
+        # Hot-path metrics (no-ops when instrumentation is disabled)
+        self.frames_metric = metrics.counter("d3f_video_frames_total", "Video frames processed", session=session)
+        self.no_face_metric = metrics.counter("d3f_video_frames_without_face_total", "Video frames without a detected face", session=session)
+        self.inference_metric = metrics.histogram("d3f_inference_seconds", "FaceMesh inference time", session=session)
+        self.process_metric = metrics.histogram("d3f_video_process_seconds", "VideoFrameHandler.process time", session=session)
+
+    @property
+    def eye_shut_counter(self):
+        return self.state_machine.eye_shut_counter
+
+    @property
+    def yawn_counter(self):
+        return self.state_machine.yawn_counter
+
+    @property
+    def alarm_counter(self):
+        return self.state_machine.alarm_counter
+
+    def close(self):
+        """Release the FaceMesh graph, no frames can be processed afterwards"""
+        close = getattr(self.facemesh_model, "close", None)
+        if close is not None:
+            close()
+
+    def process(self, frame: np.array, thresholds: dict, draw: bool = True, now: float = None, out: np.array = None):
         """
         This function is used to implement our Drowsy detection algorithm
 
         Args:
-            frame: (np.array) Input frame matrix.
+            frame: (np.array) Input RGB frame matrix, the overlay is drawn on it.
             thresholds: (dict) Contains the two threshold values
                                WAIT_TIME and EAR_THRESH.
+            draw: (bool) Draw the landmarks and text overlay on the frame.
+                         Headless callers can skip it.
+            now: (float) Capture time of the frame on the time.perf_counter()
+                         clock, defaults to the time it is processed.
+            out: (np.array) Buffer of the same shape that receives the mirrored
+                            output frame, e.g. a reused output frame. A new
+                            array is allocated if None.
 
         Returns:
             The processed frame and a boolean flag to
             indicate if the alarm should be played or not.
         """
 
+        process_start = time.perf_counter()
+        if now is None:
+            now = process_start
+
         # To improve performance,
         # mark the frame as not writeable to pass by reference.
         frame.flags.writeable = False
@@ -195,71 +406,58 @@ class VideoFrameHandler:
         ALM_txt_pos = (10, int(frame_h // 2 * 1.85))
 
         results = self.facemesh_model.process(frame)
+        self.inference_metric.observe(time.perf_counter() - process_start)
+        frame.flags.writeable = True
+        state = self.state_machine
 
         if results.multi_face_landmarks:
             landmarks = results.multi_face_landmarks[0].landmark
+            if self.recorder is not None:
+                self.recorder.write(now, landmarks, frame_w, frame_h)
+
             EAR, MAR, coordinates = calculate_ear_mar(landmarks, self.eye_idxs["left"], self.eye_idxs["right"], self.mouth_idxs["mouth"], frame_w, frame_h)
-            frame = plot_landmarks(frame, coordinates[0], coordinates[1], coordinates[2], self.state_tracker["COLOR"])
+            if draw:
+                frame = plot_landmarks(frame, coordinates[0], coordinates[1], coordinates[2], self.state_tracker["COLOR"], out)
 
-            if MAR > thresholds["MAR_THRESH"]:
-                if self.yawn_flag != True:
-                    self.yawn_counter += 1
-                    self.yawn_flag = True
-            else:
-                self.yawn_flag = False
-
-            if EAR < thresholds["EAR_THRESH"]:
-
-                # Increase DROWSY_TIME to track the time period with EAR less than the threshold
-                # and reset the start_time for the next iteration.
-                end_time = time.perf_counter()
-                self.state_tracker["DROWSY_TIME"] += end_time - self.state_tracker["start_time"]
-                self.state_tracker["start_time"] = end_time
-                self.state_tracker["COLOR"] = self.RED
-                
-                if self.eye_shut_flag != True:
-                    self.eye_shut_counter += 1
-                    self.eye_shut_flag = True
-
-                if self.state_tracker["DROWSY_TIME"] >= thresholds["WAIT_TIME"]:
-                    self.state_tracker["play_alarm"] = True
-                    plot_text(frame, "WAKE UP! WAKE UP", ALM_txt_pos, self.state_tracker["COLOR"])
+            play_alarm = state.update(EAR, MAR, now, thresholds)
+            self.state_tracker["COLOR"] = self.RED if EAR < thresholds["EAR_THRESH"] else self.GREEN
 
-                    if self.alarm_flag != True:
-                        self.alarm_counter += 1
-                        self.alarm_flag = True
-                else:
-                    self.alarm_flag = False
+            if draw:
+                if play_alarm:
+                    plot_text(frame, "WAKE UP! WAKE UP", ALM_txt_pos, self.state_tracker["COLOR"])
 
-            else:
-                self.state_tracker["start_time"] = time.perf_counter()
-                self.state_tracker["DROWSY_TIME"] = 0.0
-                self.state_tracker["COLOR"] = self.GREEN
-                self.state_tracker["play_alarm"] = False
-                self.eye_shut_flag = False
-
-            EAR_txt = f"EAR: {round(EAR, 2)}"
-            MAR_txt = f"MAR: {round(MAR, 2)}"
-            DROWSY_TIME_txt = f"DROWSY: {round(self.state_tracker['DROWSY_TIME'], 3)} Secs"
-            plot_text(frame, EAR_txt, self.EAR_txt_pos, self.state_tracker["COLOR"])
-            plot_text(frame, MAR_txt, self.MAR_txt_pos, self.state_tracker["COLOR"])
-            plot_text(frame, DROWSY_TIME_txt, DROWSY_TIME_txt_pos, self.state_tracker["COLOR"])
+                EAR_txt = f"EAR: {round(EAR, 2)}"
+                MAR_txt = f"MAR: {round(MAR, 2)}"
+                DROWSY_TIME_txt = f"DROWSY: {round(state.drowsy_time, 3)} Secs"
+                plot_text(frame, EAR_txt, self.EAR_txt_pos, self.state_tracker["COLOR"])
+                plot_text(frame, MAR_txt, self.MAR_txt_pos, self.state_tracker["COLOR"])
+                plot_text(frame, DROWSY_TIME_txt, DROWSY_TIME_txt_pos, self.state_tracker["COLOR"])
+                plot_text(frame, f"PERCLOS: {state.fatigue.perclos:.1f}%", self.PERCLOS_txt_pos, self.state_tracker["COLOR"])
+                plot_text(frame, f"BLINKS: {state.fatigue.blink_rate:.0f}/min, {state.fatigue.blink_duration * 1000:.0f} ms",
+                          self.BLINK_txt_pos, self.state_tracker["COLOR"])
 
             # Save the information to a pandas dataframe
             # current_time = datetime.datetime.now()
             current_time=time.time()
-            alarm_on = self.state_tracker["play_alarm"]
 
-            self.row_dict={"timestamp": current_time, "EAR": EAR, "MAR": MAR, "eye_shut_counter": self.eye_shut_counter, "yawn_counter": self.yawn_counter, "alarm_counter": self.alarm_counter , "alarm_on": alarm_on}
+            self.row_dict={"timestamp": current_time, "EAR": EAR, "MAR": MAR, "eye_shut_counter": state.eye_shut_counter, "yawn_counter": state.yawn_counter, "alarm_counter": state.alarm_counter , "alarm_on": play_alarm,
+                          "perclos": state.fatigue.perclos, "blink_rate": state.fatigue.blink_rate, "blink_duration": state.fatigue.blink_duration}
 
 
         else:
-            self.state_tracker["start_time"] = time.perf_counter()
-            self.state_tracker["DROWSY_TIME"] = 0.0
+            state.reset(now)
             self.state_tracker["COLOR"] = self.GREEN
-            self.state_tracker["play_alarm"] = False
+            if self.recorder is not None:
+                self.recorder.write(now, None, frame_w, frame_h)
+
+            # No face, no sample to record for this frame
+            self.row_dict = {}
+            self.no_face_metric.inc()
             
             # Flip the frame horizontally for a selfie-view display.
-            frame = cv2.flip(frame, 1)
+            if draw:
+                frame = cv2.flip(frame, 1, out)
 
-        return frame, self.state_tracker["play_alarm"] 
+        self.frames_metric.inc()
+        self.process_metric.observe(time.perf_counter() - process_start)
+        return frame, state.play_alarm
@@ -0,0 +1,217 @@
+"""
+Headless D3F agent for in-vehicle units without a browser.
+
+Reads frames from a V4L2 camera or a video file with OpenCV, runs the
+drowsiness detection pipeline in a tight loop, plays the alarm through the
+local sound card and logs the trip to MySQL or to a local SQLite file.
+
+Usage:
+    python edge_agent.py --source 0 --store sqlite --log-dir trips
+    python edge_agent.py --source dashcam.mp4 --store mysql --driver alice
+"""
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import cv2
+
+from drowsy_detection import VideoFrameHandler
+from edge_log import SqliteTripLog
+
+#Change threshold values if needed
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+# Define the audio file to use.
+path = os.path.dirname(__file__)
+alarm_file_path = os.path.join(path, "audio", "wake_up.wav")
+
+logger = logging.getLogger("d3f.edge")
+
+
+class LocalAlarmPlayer:
+    """
+    Loops the alarm sound on the local sound card while the alarm is on.
+
+    Playback runs on its own thread so the frame loop only flips a flag.
+    Uses simpleaudio when it is installed and falls back to ALSA's aplay.
+    """
+
+    def __init__(self, sound_file_path: str):
+        self.sound_file_path = sound_file_path
+        self._play = threading.Event()
+        self._play_sound = self._get_backend()
+        self._thread = threading.Thread(target=self._run, name="LocalAlarmPlayer", daemon=True)
+        self._thread.start()
+
+    def _get_backend(self):
+        try:
+            import simpleaudio
+        except ImportError:
+            simpleaudio = None
+
+        if simpleaudio is not None:
+            wave_obj = simpleaudio.WaveObject.from_wave_file(self.sound_file_path)
+            return lambda: wave_obj.play().wait_done()
+
+        aplay = shutil.which("aplay")
+        if aplay is not None:
+            return lambda: subprocess.run([aplay, "-q", self.sound_file_path], check=False)
+
+        logger.warning("No audio backend found (install simpleaudio or alsa-utils), alarm will only be logged")
+        return lambda: time.sleep(0.5)
+
+    def set(self, play_alarm: bool):
+        if play_alarm:
+            self._play.set()
+        else:
+            self._play.clear()
+
+    def _run(self):
+        while True:
+            self._play.wait()
+            self._play_sound()
+
+
+def open_capture(source: str, width: int = None, height: int = None, fps: float = None):
+    """Open a camera index / V4L2 device path or a video file"""
+    if source.isdigit() or source.startswith("/dev/video"):
+        device = int(source) if source.isdigit() else source
+        capture = cv2.VideoCapture(device, cv2.CAP_V4L2)
+        # Keep only the newest frame queued so we never process stale frames
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if width:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            capture.set(cv2.CAP_PROP_FPS, fps)
+        is_file = False
+    else:
+        capture = cv2.VideoCapture(source)
+        is_file = True
+
+    if not capture.isOpened():
+        raise RuntimeError(f"Could not open video source {source!r}")
+    return capture, is_file
+
+
+def open_store(store: str, log_dir: str, driver: str):
+    """Return (writer, finish) for the configured trip store"""
+    if store == "sqlite":
+        log = SqliteTripLog(log_dir, driver=driver)
+        logger.info("Logging trip to %s", log.path)
+        return log, log.close
+
+    if store == "mysql":
+        # Only imported when logging to MySQL
+        import trip_storage
+
+        trip_storage.create_database(trip_storage.db_credentials["database"])
+        trip_storage.create_summary_table()
+        table_name = trip_storage.create_table()
+        writer = trip_storage.TripWriter(table_name)
+        logger.info("Logging trip to MySQL table %s", table_name)
+
+        def finish():
+            writer.close()
+            trip_storage.write_trip_summary(table_name, thresholds, driver)
+
+        return writer, finish
+
+    return None, lambda: None
+
+
+def run(args):
+    capture, is_file = open_capture(args.source, args.width, args.height, args.fps)
+    frame_interval = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 30.0) if is_file else 0.0
+
+    recorder = None
+    if args.record_landmarks:
+        from landmark_log import LandmarkRecorder
+
+        recorder = LandmarkRecorder(os.path.join(args.record_landmarks, f"trip_{time.strftime('%Y%m%d%H%M%S')}.d3fl"),
+                                    clock_offset=time.time() - time.perf_counter())
+        logger.info("Recording landmarks to %s", recorder.path)
+
+    video_handler = VideoFrameHandler(recorder=recorder)
+    player = LocalAlarmPlayer(alarm_file_path) if not args.mute else None
+    writer, finish = open_store(args.store, args.log_dir, args.driver)
+
+    frames = 0
+    stats_start = time.perf_counter()
+    next_frame_time = time.perf_counter()
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            # FaceMesh expects RGB, OpenCV decodes to BGR
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            _, play_alarm = video_handler.process(frame, thresholds, draw=False)
+
+            if player is not None:
+                player.set(play_alarm)
+            if writer is not None and video_handler.row_dict:
+                writer.write(video_handler.row_dict)
+
+            frames += 1
+            now = time.perf_counter()
+            if now - stats_start >= args.stats_interval:
+                logger.info("%.1f fps, alarms: %d", frames / (now - stats_start), video_handler.alarm_counter)
+                frames = 0
+                stats_start = now
+
+            # Video files are paced to their frame rate so WAIT_TIME means real seconds
+            if is_file:
+                next_frame_time += frame_interval
+                delay = next_frame_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
+        if recorder is not None:
+            recorder.close()
+        if player is not None:
+            player.set(False)
+        finish()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless driver drowsiness detection agent")
+    parser.add_argument("--source", default="0", help="camera index, /dev/videoN device or video file (default: 0)")
+    parser.add_argument("--width", type=int, help="requested camera frame width")
+    parser.add_argument("--height", type=int, help="requested camera frame height")
+    parser.add_argument("--fps", type=float, help="requested camera frame rate")
+    parser.add_argument("--store", choices=("sqlite", "mysql", "none"), default="sqlite", help="where the trip is logged (default: sqlite)")
+    parser.add_argument("--log-dir", default="trips", help="directory for SQLite trip logs (default: trips)")
+    parser.add_argument("--driver", help="driver name stored with the trip")
+    parser.add_argument("--ear-thresh", type=float, default=thresholds["EAR_THRESH"])
+    parser.add_argument("--mar-thresh", type=float, default=thresholds["MAR_THRESH"])
+    parser.add_argument("--wait-time", type=float, default=thresholds["WAIT_TIME"])
+    parser.add_argument("--record-landmarks", metavar="DIR", help="also record the eye and mouth landmarks to DIR for replay.py")
+    parser.add_argument("--mute", action="store_true", help="do not play the alarm sound")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between frame rate log lines")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    thresholds.update(EAR_THRESH=args.ear_thresh, MAR_THRESH=args.mar_thresh, WAIT_TIME=args.wait_time)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import time
+
+# Same columns as the raw trip tables in trip_storage, in insertion order
+LOG_COLUMNS = ("timestamp", "EAR", "MAR", "eye_shut_counter", "yawn_counter", "alarm_counter", "alarm_on", "perclos", "blink_rate", "blink_duration")
+
+
+class SqliteTripLog:
+    """
+    Trip log kept in a local SQLite file, for vehicles without a database link.
+
+    Each trip is written to its own trip_YYYYmmddHHMMSS.sqlite file holding a
+    `samples` table with the raw trip columns and a one-row `trip` table with
+    the trip metadata, so the file can be uploaded and ingested later.
+    """
+
+    def __init__(self, log_dir: str, driver: str = None, table_name: str = None, batch_size: int = 200, flush_interval: float = 1.0):
+        os.makedirs(log_dir, exist_ok=True)
+        self.table_name = table_name or f"trip_{time.strftime('%Y%m%d%H%M%S')}"
+        self.path = os.path.join(log_dir, f"{self.table_name}.sqlite")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Used by one thread at a time, but not always the one that opened it (e.g. a metrics bus subscriber)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                timestamp REAL,
+                EAR REAL,
+                MAR REAL,
+                eye_shut_counter INTEGER,
+                yawn_counter INTEGER,
+                alarm_counter INTEGER,
+                alarm_on INTEGER,
+                perclos REAL,
+                blink_rate REAL,
+                blink_duration REAL
+            )
+            """
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS trip (table_name TEXT, driver TEXT, created REAL)")
+        self._connection.execute("INSERT INTO trip VALUES (?, ?, ?)", (self.table_name, driver, time.time()))
+        self._connection.commit()
+
+        self._sql_insert = f"INSERT INTO samples ({', '.join(LOG_COLUMNS)}) VALUES ({', '.join(['?'] * len(LOG_COLUMNS))})"
+        self._pending = []
+        self._last_flush = time.perf_counter()
+
+    def write(self, row_dict: dict):
+        """Buffer one sample, flushing a batch in one transaction when due"""
+        self._pending.append([row_dict[column] for column in LOG_COLUMNS])
+        if len(self._pending) >= self.batch_size or time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_many(self, rows: list):
+        """Insert already ordered sample rows (LOG_COLUMNS order) in one transaction"""
+        self.flush()
+        self._connection.executemany(self._sql_insert, rows)
+        self._connection.commit()
+
+    def flush(self):
+        if self._pending:
+            self._connection.executemany(self._sql_insert, self._pending)
+            self._connection.commit()
+            self._pending = []
+        self._last_flush = time.perf_counter()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,111 @@
+"""
+Frame path of the live video callback.
+
+Each received frame is converted exactly once, from the decoder's YUV to
+the RGB layout FaceMesh expects. The landmarks are drawn in place on that
+array, which is then mirrored straight into the buffer of a pooled output
+VideoFrame where the text overlay is drawn. Output frames are allocated
+once per resolution and reused, so a frame costs one colour conversion and
+one copy (the mirror) and no output allocations. Frames that are not
+processed show the last output again, copied into the next pooled frame.
+"""
+import av
+import numpy as np
+
+#Output frames in flight at once: a frame is only reused this many frames
+#later, once the sender has long encoded it
+OUTPUT_POOL_SIZE = 4
+
+
+def frame_buffer(frame):
+    """Writable (height, width, 3) view of the pixels of a packed rgb24 VideoFrame"""
+    plane = frame.planes[0]
+    rows = np.frombuffer(plane, dtype=np.uint8).reshape(frame.height, plane.line_size)
+    return rows[:, :frame.width * 3].reshape(frame.height, frame.width, 3)
+
+
+class VideoFramePool:
+    """Round robin of output frames, reallocated only when the resolution changes"""
+
+    def __init__(self, size: int = OUTPUT_POOL_SIZE):
+        self.size = size
+        self.allocations = 0
+        self._frames = []
+        self._next = 0
+        self._shape = None
+
+    def next(self, width: int, height: int):
+        """
+        Returns:
+            frame: (av.VideoFrame) Output frame to fill and return.
+            buffer: (np.array) Writable view of the frame's pixels.
+        """
+        if self._shape != (width, height):
+            self._frames = []
+            for _ in range(self.size):
+                frame = av.VideoFrame(width, height, "rgb24")
+                self._frames.append((frame, frame_buffer(frame)))
+                self.allocations += 1
+            self._shape = (width, height)
+
+        pair = self._frames[self._next]
+        self._next = (self._next + 1) % self.size
+        return pair
+
+
+class FramePath:
+    """Runs a VideoFrameHandler on received frames and returns pooled output frames"""
+
+    def __init__(self, video_handler, pool_size: int = OUTPUT_POOL_SIZE):
+        self.video_handler = video_handler
+        self.pool = VideoFramePool(pool_size)
+        self._last = None  # (frame, buffer) of the last output
+
+    def __call__(self, frame, thresholds: dict, now: float = None):
+        """
+        Args:
+            frame: (av.VideoFrame) Frame received from the browser.
+            thresholds: (dict) Contains EAR_THRESH, MAR_THRESH and WAIT_TIME.
+            now: (float) Capture time of the frame on the time.perf_counter() clock.
+
+        Returns:
+            The output frame and a boolean flag to
+            indicate if the alarm should be played or not.
+        """
+        image = frame.to_ndarray(format="rgb24")  # The only colour conversion
+        new_frame, out = self.pool.next(frame.width, frame.height)
+
+        _, play_alarm = self.video_handler.process(image, thresholds, now=now, out=out)
+
+        stamp(new_frame, frame)
+        self._last = (new_frame, out)
+        return new_frame, play_alarm
+
+    def repeat(self, frame):
+        """
+        Show the last output again for a received frame that is not processed.
+
+        The output already sent is never restamped, it may still be waiting
+        to be encoded with its own pts.
+
+        Returns:
+            A pooled output frame with the last output's pixels and the
+            received frame's pts, or the received frame itself when nothing
+            was processed at its resolution yet.
+        """
+        if self._last is None or (self._last[0].width, self._last[0].height) != (frame.width, frame.height):
+            return frame
+
+        new_frame, out = self.pool.next(frame.width, frame.height)
+        np.copyto(out, self._last[1])
+        stamp(new_frame, frame)
+        self._last = (new_frame, out)
+        return new_frame
+
+
+def stamp(new_frame, frame):
+    """Give an output frame the timing of the received frame"""
+    new_frame.pts = frame.pts
+    # PyAV 14+ rejects None, frames without a time base keep the default one
+    if frame.time_base is not None:
+        new_frame.time_base = frame.time_base
@@ -0,0 +1,466 @@
+"""
+Bulk ingestion of trip logs recorded offline into the central trip store.
+
+Vehicles logging without a database link (edge_agent.py --store sqlite)
+upload whole trips later, as the SQLite trip file or a CSV spool with the
+raw trip columns, optionally gzip-compressed. The format is recognised from
+the file contents. Each file is validated (readable, the expected tables
+and columns, a trip_YYYYmmddHHMMSS trip id) before anything is written;
+samples with missing or non-finite values are skipped and counted.
+
+Samples are loaded with multi-row INSERT IGNORE statements of BATCH_SIZE
+rows, committed every TRANSACTION_ROWS rows. Trip tables get a unique index
+on the sample timestamp, so uploading a trip again, or a file overlapping
+one already loaded, only adds the samples that are new. The trip summary
+and rollup are written once the samples are in.
+
+Files are ingested concurrently by a bounded pool of workers, each with its
+own database connection, from the command line or over HTTP:
+
+Usage:
+    python ingest.py uploads/*.sqlite.gz --workers 4
+    python ingest.py --serve 8503 --workers 4
+    curl --data-binary @trip_20240101120000.sqlite.gz -H "X-File-Name: trip_20240101120000.sqlite.gz" http://server:8503/trips
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from instrumentation import metrics
+from trip_storage import (TIMESTAMP_INDEX, TRIP_COLUMNS, connect, create_database, create_summary_table, create_table, db_credentials,
+                          get_driver_thresholds, write_trip_summary)
+
+#Change threshold values if needed, trips of calibrated drivers are summarized with the driver's thresholds like in the app
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+#Rows per multi-row INSERT statement
+BATCH_SIZE = 10000
+
+#Rows per transaction
+TRANSACTION_ROWS = 200000
+
+#Files ingested at once (each worker holds one database connection)
+DEFAULT_WORKERS = 4
+
+#Largest upload accepted by the HTTP endpoint
+MAX_UPLOAD_BYTES = 1 << 30
+
+#Columns every trip file must have; the fatigue columns are missing from logs of older agents and loaded as NULL
+REQUIRED_COLUMNS = ("timestamp", "EAR", "MAR", "eye_shut_counter", "yawn_counter", "alarm_counter", "alarm_on")
+
+#Name of the unique index that deduplicates the samples of a trip table
+UNIQUE_INDEX = "uniq_timestamp"
+
+TRIP_NAME = re.compile(r"trip_[0-9]{14}(?:_[0-9]+)?")
+GZIP_MAGIC = b"\x1f\x8b"
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+logger = logging.getLogger("d3f.ingest")
+
+files_metric = metrics.counter("d3f_ingest_files_total", "Trip files ingested")
+rejected_metric = metrics.counter("d3f_ingest_files_rejected_total", "Trip files rejected by validation")
+rows_metric = metrics.counter("d3f_ingest_rows_total", "Trip samples inserted by ingestion")
+
+
+class InvalidTripFile(ValueError):
+    """The uploaded file is not a trip log that can be ingested"""
+
+
+def clean_row(values):
+    """
+    Validate one sample given in TRIP_COLUMNS order, optional columns as None.
+
+    Returns:
+        The sample with its values converted, or None if it is unusable.
+    """
+    try:
+        timestamp, EAR, MAR = float(values[0]), float(values[1]), float(values[2])
+        counters = [int(float(value)) for value in values[3:6]]
+        alarm_on = values[6]
+        alarm_on = int(alarm_on == "True") if alarm_on in ("True", "False") else int(float(alarm_on) != 0)
+        fatigue = [None if value in (None, "") else float(value) for value in values[7:]]
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+    if not (timestamp > 0 and math.isfinite(timestamp) and math.isfinite(EAR) and math.isfinite(MAR)):
+        return None
+    if min(counters) < 0 or not all(value is None or math.isfinite(value) for value in fatigue):
+        return None
+    return (timestamp, EAR, MAR, *counters, alarm_on, *fatigue)
+
+
+def trip_name_from_file(name):
+    match = TRIP_NAME.search(os.path.basename(name or ""))
+    return match.group(0) if match else None
+
+
+def decompressed_copy(path):
+    """
+    Path of the uncompressed contents of a trip file.
+
+    Returns:
+        plain_path: (str) The file itself, or a temporary copy if it was gzip-compressed.
+        temporary: (bool) Whether plain_path should be removed after use.
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if not compressed:
+        return path, False
+
+    fd, plain_path = tempfile.mkstemp(prefix="d3f-ingest-")
+    try:
+        with gzip.open(path, "rb") as source, os.fdopen(fd, "wb") as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+    except (OSError, EOFError) as e:
+        os.remove(plain_path)
+        raise InvalidTripFile(f"Corrupt gzip file: {e}") from None
+    return plain_path, True
+
+
+def read_sqlite_trip(path, name, stats):
+    """
+    Yield (table_name, driver, batch) from an edge_log SQLite trip file.
+
+    Raises:
+        InvalidTripFile: the database is damaged or not a trip log.
+    """
+    connection = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        try:
+            if connection.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise InvalidTripFile("SQLite integrity check failed")
+            tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "samples" not in tables:
+                raise InvalidTripFile("No samples table")
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(samples)")}
+
+            table_name, driver = trip_name_from_file(name), None
+            if "trip" in tables:
+                trip = connection.execute("SELECT table_name, driver FROM trip LIMIT 1").fetchone()
+                if trip is not None:
+                    table_name, driver = trip
+        except sqlite3.DatabaseError as e:
+            raise InvalidTripFile(f"Not a readable SQLite trip log: {e}") from None
+
+        missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+        if missing:
+            raise InvalidTripFile(f"Samples table lacks columns {', '.join(missing)}")
+        if not table_name or not TRIP_NAME.fullmatch(table_name):
+            raise InvalidTripFile(f"Invalid trip id {table_name!r}, expected trip_YYYYmmddHHMMSS")
+
+        select = ", ".join(column if column in columns else "NULL" for column in TRIP_COLUMNS)
+        cursor = connection.execute(f"SELECT {select} FROM samples")
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            batch = [row for row in map(clean_row, rows) if row is not None]
+            stats["invalid"] += len(rows) - len(batch)
+            yield table_name, driver, batch
+    finally:
+        connection.close()
+
+
+def read_csv_trips(path, name, stats):
+    """
+    Yield (table_name, driver, batch) from a CSV spool with a header row.
+
+    The trip of each sample is its "trip" column (as written by
+    trip_export.py) or, without one, the trip id in the file name.
+    """
+    with open(path, newline="", encoding="utf-8", errors="strict") as f:
+        try:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                raise InvalidTripFile("Empty file")
+            positions = {column: i for i, column in enumerate(header)}
+
+            missing = [column for column in REQUIRED_COLUMNS if column not in positions]
+            if missing:
+                raise InvalidTripFile(f"Not a trip log, CSV header lacks {', '.join(missing)}")
+            trip_position = positions.get("trip")
+            file_trip = trip_name_from_file(name)
+            if trip_position is None and file_trip is None:
+                raise InvalidTripFile("No trip column and no trip id in the file name")
+
+            indices = [positions.get(column) for column in TRIP_COLUMNS]
+            pending = {}
+            for record in reader:
+                table_name = record[trip_position] if trip_position is not None and trip_position < len(record) else file_trip
+                if not table_name or not TRIP_NAME.fullmatch(table_name):
+                    stats["invalid"] += 1
+                    continue
+                row = clean_row([record[i] if i is not None and i < len(record) else None for i in indices])
+                if row is None:
+                    stats["invalid"] += 1
+                    continue
+
+                batch = pending.setdefault(table_name, [])
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    yield table_name, None, pending.pop(table_name)
+
+            for table_name, batch in pending.items():
+                yield table_name, None, batch
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise InvalidTripFile(f"Not a readable CSV trip log: {e}") from None
+
+
+def prepare_trip_table(connection, table_name):
+    """Create the trip table if needed and make sure it has the unique timestamp index and every trip column"""
+    import pymysql
+
+    create_table(table_name, if_not_exists=True)
+
+    with connection.cursor() as cursor:
+        sql = "SELECT column_name AS column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s"
+        cursor.execute(sql, (db_credentials["database"], table_name))
+        existing = {row["column_name"].lower() for row in cursor.fetchall()}
+        for column in TRIP_COLUMNS:
+            if column.lower() not in existing:
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} DOUBLE")
+
+        sql = "SELECT DISTINCT index_name AS index_name FROM information_schema.statistics WHERE table_schema = %s AND table_name = %s"
+        cursor.execute(sql, (db_credentials["database"], table_name))
+        indexes = {row["index_name"] for row in cursor.fetchall()}
+        if UNIQUE_INDEX not in indexes:
+            # The unique index also serves the dashboard's range queries, the plain one is dropped
+            drop = f", DROP INDEX {TIMESTAMP_INDEX}" if TIMESTAMP_INDEX in indexes else ""
+            try:
+                cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE INDEX {UNIQUE_INDEX} (timestamp){drop}")
+            except pymysql.err.IntegrityError:
+                raise RuntimeError(f"{table_name} already holds samples with the same timestamp, deduplicate it before ingesting") from None
+            except pymysql.err.OperationalError as e:
+                if e.args[0] not in (1061, 1091):  # Another worker changed the indexes first
+                    raise
+    connection.commit()
+
+
+def ingest_file(path, name=None):
+    """
+    Validate a trip file and load its samples.
+
+    Args:
+        path: (str) File to ingest, gzip-compressed or not.
+        name: (str) Original file name, for the trip id of CSV spools (default: path).
+
+    Returns:
+        report: (dict) Trips loaded, samples read, inserted, already present
+                       (duplicates) and skipped as invalid.
+
+    Raises:
+        InvalidTripFile: the file cannot be ingested. Files are checked before any
+                         sample is written, but damage further into a CSV spool is
+                         only found while loading it (committed batches are kept,
+                         uploading the file again after fixing it adds the rest).
+    """
+    started = time.perf_counter()
+    name = name or path
+    stats = {"file": os.path.basename(name), "trips": [], "rows": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+
+    plain_path, temporary = decompressed_copy(path)
+    try:
+        with open(plain_path, "rb") as f:
+            is_sqlite = f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+        batches = read_sqlite_trip(plain_path, name, stats) if is_sqlite else read_csv_trips(plain_path, name, stats)
+
+        sql_insert = f"({', '.join(TRIP_COLUMNS)}) VALUES ({', '.join(['%s'] * len(TRIP_COLUMNS))})"
+        drivers = {}
+        uncommitted = 0
+        connection = connect()
+        try:
+            with connection.cursor() as cursor:
+                for table_name, driver, batch in batches:
+                    if table_name not in drivers:
+                        prepare_trip_table(connection, table_name)
+                        drivers[table_name] = driver
+                    if not batch:
+                        continue
+
+                    # pymysql sends an INSERT ... VALUES executemany as multi-row statements
+                    inserted = cursor.executemany(f"INSERT IGNORE INTO {table_name} {sql_insert}", batch)
+                    stats["rows"] += len(batch)
+                    stats["inserted"] += inserted
+                    uncommitted += len(batch)
+                    if uncommitted >= TRANSACTION_ROWS:
+                        connection.commit()
+                        uncommitted = 0
+            connection.commit()
+        finally:
+            connection.close()
+    except InvalidTripFile:
+        rejected_metric.inc()
+        raise
+    finally:
+        if temporary:
+            os.remove(plain_path)
+
+    for table_name, driver in drivers.items():
+        trip_thresholds = (get_driver_thresholds(driver, thresholds) if driver else None) or thresholds
+        write_trip_summary(table_name, trip_thresholds, driver)
+
+    stats["trips"] = list(drivers)
+    stats["duplicates"] = stats["rows"] - stats["inserted"]
+    stats["seconds"] = time.perf_counter() - started
+    files_metric.inc()
+    rows_metric.inc(stats["inserted"])
+    return stats
+
+
+def ingest_files(paths, workers=DEFAULT_WORKERS):
+    """
+    Ingest files concurrently, at most `workers` at a time.
+
+    Returns:
+        reports: (list) One report per file, {"file", "error"} for the files that failed.
+    """
+    def ingest_one(path):
+        try:
+            return ingest_file(path)
+        except Exception as e:
+            if not isinstance(e, InvalidTripFile):
+                logger.exception("Ingesting %s failed", path)
+            return {"file": os.path.basename(path), "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Ingest") as executor:
+        return list(executor.map(ingest_one, paths))
+
+
+def serve(port, workers=DEFAULT_WORKERS, host="0.0.0.0"):
+    """
+    Accept trip files at POST http://host:port/trips, ingested by a pool of `workers`.
+
+    The body is the file as is; its name, for the trip id of CSV spools, can
+    be given in an X-File-Name header. Responds with the ingestion report as
+    JSON, 400 for files that fail validation.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Ingest")
+
+    class IngestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.split("?")[0] != "/trips":
+                self.send_error(404)
+                return
+            length = self.headers.get("Content-Length")
+            if length is None:
+                self.send_error(411)
+                return
+            try:
+                length = int(length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.send_error(400, "Invalid Content-Length")
+                return
+            if length > MAX_UPLOAD_BYTES:
+                self.send_error(413)
+                return
+
+            # Spool the upload to disk, never holding the whole file in memory
+            fd, upload_path = tempfile.mkstemp(prefix="d3f-upload-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    remaining = int(length)
+                    while remaining:
+                        chunk = self.rfile.read(min(remaining, 1 << 20))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+
+                # The client went away before sending the whole file, never ingest part of it
+                if remaining:
+                    self.send_json(400, {"error": f"Upload ended {remaining} bytes short of its Content-Length"})
+                    return
+
+                try:
+                    report = executor.submit(ingest_file, upload_path, self.headers.get("X-File-Name")).result()
+                    self.send_json(200, report)
+                except InvalidTripFile as e:
+                    self.send_json(400, {"error": str(e)})
+                except Exception as e:
+                    logger.exception("Ingesting an upload failed")
+                    self.send_json(500, {"error": str(e)})
+            finally:
+                os.remove(upload_path)
+
+        def send_json(self, status, body):
+            body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.info("%s %s", self.address_string(), format % args)
+
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    logger.info("Accepting trip files at http://%s:%d/trips with %d workers", host, port, workers)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        executor.shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load trip logs recorded offline into the central trip store")
+    parser.add_argument("files", nargs="*", help="SQLite trip logs or CSV spools, optionally gzip-compressed")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"files ingested at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="accept uploads at POST http://host:PORT/trips instead")
+    parser.add_argument("--host", default="0.0.0.0", help="address to serve on (default: 0.0.0.0)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    create_database(db_credentials["database"])
+    create_summary_table()
+
+    if args.serve:
+        serve(args.serve, args.workers, args.host)
+        return
+    if not args.files:
+        sys.exit("No trip files given")
+
+    started = time.perf_counter()
+    reports = ingest_files(args.files, args.workers)
+    elapsed = time.perf_counter() - started
+
+    for report in reports:
+        if "error" in report:
+            print(f"{report['file']}: REJECTED {report['error']}")
+        else:
+            print(f"{report['file']}: {', '.join(report['trips']) or 'no trips'}, {report['inserted']} samples inserted, "
+                  f"{report['duplicates']} duplicates, {report['invalid']} invalid")
+
+    inserted = sum(report.get("inserted", 0) for report in reports)
+    rows = sum(report.get("rows", 0) for report in reports)
+    print(f"{rows} samples from {len(reports)} files in {elapsed:.1f} s ({rows / elapsed * 60 if elapsed else 0:,.0f} samples/min), {inserted} new")
+    if any("error" in report for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Low-overhead hot-path instrumentation.
+
+Counters and fixed-bucket latency histograms kept in process memory, shown on
+the admin page and exported in the Prometheus text format. Set the
+environment variable D3F_METRICS=0 to disable instrumentation: every metric
+is then a shared no-op object and recording costs one empty method call.
+"""
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("D3F_METRICS", "1") != "0"
+
+# Upper bounds in seconds, from 0.1 ms to 5 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: dict):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Histogram:
+    """
+    Latency histogram with fixed bucket bounds.
+
+    observe() is a binary search and two additions. Each metric is expected
+    to be written from one thread (its session's callback or the writer).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: dict, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class _NullMetric:
+    """Stands in for every metric when instrumentation is disabled"""
+
+    value = 0
+    count = 0
+    sum = 0.0
+
+    def inc(self, amount: int = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def quantile(self, q: float):
+        return 0.0
+
+
+NULL_METRIC = _NullMetric()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = ENABLED):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()  # Only taken when metrics are created or removed
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        if not self.enabled:
+            return NULL_METRIC
+
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls(name, help, labels, **kwargs))
+        return metric
+
+    def counter(self, name: str, help: str, **labels):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def remove(self, **labels):
+        """Drop every metric carrying these labels, e.g. when a session ends"""
+        with self._lock:
+            for key in [key for key, metric in self._metrics.items() if labels.items() <= metric.labels.items()]:
+                del self._metrics[key]
+
+    def metrics(self):
+        return list(self._metrics.values())
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        by_name = {}
+        for metric in self.metrics():
+            by_name.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name, metrics in sorted(by_name.items()):
+            lines.append(f"# HELP {name} {metrics[0].help}")
+            lines.append(f"# TYPE {name} {metrics[0].kind}")
+            for metric in metrics:
+                if metric.kind == "counter":
+                    lines.append(f"{name}{_format_labels(metric.labels)} {metric.value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), metric.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels({**metric.labels, 'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(metric.labels)} {metric.sum}")
+                lines.append(f"{name}_count{_format_labels(metric.labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels.keys(), escaped)) + "}"
+
+
+# Process-wide registry used by the video, audio and storage paths
+metrics = MetricsRegistry()
+
+
+def start_http_server(port: int, registry: MetricsRegistry = metrics, host: str = "0.0.0.0"):
+    """Serve the registry at http://host:port/metrics for Prometheus to scrape"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="MetricsHTTPServer", daemon=True).start()
+    return server
@@ -0,0 +1,140 @@
+"""
+Compact binary recordings of the landmarks used by the drowsiness logic.
+
+A recording holds, for every processed frame, its capture time and the
+normalized (x, y) coordinates of the 20 eye and mouth landmarks, quantized
+to 16 bits: 88 bytes per frame, about 9.5 MB per hour at 30 fps. That is
+everything replay.py needs to re-run the state machine with other
+thresholds without a camera, FaceMesh or the video.
+
+File layout (little endian):
+    header: magic "D3FL", version (uint8), frame width and height (uint16),
+            clock offset to epoch seconds (float64), landmark count (uint8)
+            and the FaceMesh index of each landmark (uint16 each)
+    frames: capture time (float64) then x, y per landmark (uint16 each)
+"""
+import os
+import struct
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from drowsy_detection import EYE_IDXS, MOUTH_IDXS
+
+MAGIC = b"D3FL"
+VERSION = 1
+
+# Recorded landmarks in the order calculate_ear_mar reads them
+LANDMARK_IDS = tuple(EYE_IDXS["left"] + EYE_IDXS["right"] + MOUTH_IDXS["mouth"])
+
+# Coordinates in [0, 1] map to 0..SCALE, MISSING marks a coordinate outside
+# the frame (it has no pixel position) or a frame without a face
+SCALE = 65534
+MISSING = 65535
+
+_HEADER = struct.Struct("<4sBHHdB")
+
+LandmarkRecording = namedtuple("LandmarkRecording", ["width", "height", "clock_offset", "landmark_ids", "times", "points"])
+
+
+def frame_dtype(count):
+    return np.dtype([("time", "<f8"), ("xy", "<u2", (count, 2))])
+
+
+class LandmarkRecorder:
+    """
+    Appends the recorded landmarks of each frame to a file.
+
+    write() is called from the video callback; the header is written with
+    the first frame, once the frame size is known. close() may be called
+    from another thread.
+    """
+
+    def __init__(self, path: str, clock_offset: float = 0.0, landmark_ids=LANDMARK_IDS):
+        """
+        Args:
+            path: (str) File to create, its directory is created if needed.
+            clock_offset: (float) Added to the frame times to get epoch
+                                  seconds, e.g. time.time() - time.perf_counter().
+            landmark_ids: (tuple) FaceMesh indexes of the recorded landmarks.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.clock_offset = clock_offset
+        self.landmark_ids = tuple(landmark_ids)
+        self.frames = 0
+
+        self._record = struct.Struct(f"<d{2 * len(self.landmark_ids)}H")
+        self._missing = (MISSING,) * (2 * len(self.landmark_ids))
+        self._file = open(path, "wb")
+        self._header_written = False
+        self._lock = threading.Lock()
+
+    def _write_header(self, frame_w, frame_h):
+        self._file.write(_HEADER.pack(MAGIC, VERSION, frame_w, frame_h, self.clock_offset, len(self.landmark_ids)))
+        self._file.write(struct.pack(f"<{len(self.landmark_ids)}H", *self.landmark_ids))
+        self._header_written = True
+
+    def write(self, now: float, landmarks, frame_w: int, frame_h: int):
+        """
+        Args:
+            now: (float) Capture time of the frame in seconds.
+            landmarks: FaceMesh landmark list of the face, None if no face was found.
+            frame_w: (int) Width of the frame.
+            frame_h: (int) Height of the frame.
+        """
+        if landmarks is None:
+            values = self._missing
+        else:
+            values = []
+            for i in self.landmark_ids:
+                lm = landmarks[i]
+                values.append(round(lm.x * SCALE) if 0.0 <= lm.x <= 1.0 else MISSING)
+                values.append(round(lm.y * SCALE) if 0.0 <= lm.y <= 1.0 else MISSING)
+
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self._header_written:
+                self._write_header(frame_w, frame_h)
+            self._file.write(self._record.pack(now, *values))
+            self.frames += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_recording(path: str):
+    """
+    Load a recording written by LandmarkRecorder.
+
+    Returns:
+        recording: (LandmarkRecording) times is a float64 array of n frame
+                   times and points an (n, landmarks, 2) float64 array of
+                   normalized coordinates, NaN where a coordinate is missing.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return LandmarkRecording(0, 0, 0.0, LANDMARK_IDS, np.empty(0), np.empty((0, len(LANDMARK_IDS), 2)))
+
+        magic, version, width, height, clock_offset, count = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} landmark recording")
+
+        landmark_ids = struct.unpack(f"<{count}H", f.read(2 * count))
+        dtype = frame_dtype(count)
+        data = f.read()
+
+    # A recording cut short (e.g. power loss) keeps all of its whole frames
+    frames = np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)
+    points = frames["xy"].astype(np.float64)
+    points[frames["xy"] == MISSING] = np.nan
+    points /= SCALE
+
+    return LandmarkRecording(width, height, clock_offset, landmark_ids, frames["time"].copy(), points)
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class MetricsRingBuffer:
+    """
+    Fixed-size ring buffer holding the most recent per-frame metrics.
+
+    Written by a single thread (the video callback) and read by the page
+    script without locking: the reader detects and discards any slots the
+    writer may have overwritten while it was copying.
+    """
+
+    def __init__(self, capacity: int, columns=("timestamp", "EAR", "MAR", "alarm_on")):
+        self.capacity = capacity
+        self.columns = tuple(columns)
+        self._data = np.zeros((capacity, len(self.columns)), dtype=np.float64)
+        self._count = 0  # Total number of rows ever appended
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, row_dict: dict):
+        """Store one row of metrics, overwriting the oldest row once full"""
+        slot = self._data[self._count % self.capacity]
+        for i, column in enumerate(self.columns):
+            slot[i] = row_dict[column]
+
+        # Publish the row only once it is completely written
+        self._count += 1
+
+    def snapshot(self, since: float = None):
+        """
+        Copy the buffered rows, oldest first.
+
+        Args:
+            since: (float) Only return rows with a timestamp at or after this.
+
+        Returns:
+            A dict mapping each column name to a numpy array.
+        """
+        count_before = self._count
+        data = self._data.copy()
+        count_after = self._count
+
+        # Rows appended during the copy may have replaced the oldest rows we saw, and
+        # the writer may be halfway through the slot after them (index count_after)
+        valid = min(count_before, self.capacity - (count_after - count_before) - 1)
+        if valid <= 0:
+            return {column: np.empty(0) for column in self.columns}
+
+        start = (count_before - valid) % self.capacity
+        order = (np.arange(valid) + start) % self.capacity
+        rows = data[order]
+
+        if since is not None and "timestamp" in self.columns:
+            rows = rows[rows[:, self.columns.index("timestamp")] >= since]
+
+        return {column: rows[:, i] for i, column in enumerate(self.columns)}
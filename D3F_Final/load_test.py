@@ -0,0 +1,562 @@
+"""
+Capacity test of the live pipeline with synthetic WebRTC drivers.
+
+Every simulated driver is a headless aiortc client streaming video and
+audio over a real WebRTC connection (VP8/Opus over loopback) to a server
+peer that runs the app's per-session pipeline: the stale frame gate, the
+frame path with FaceMesh and the overlay, the alarm signal and the audio
+handler, exactly as the video and audio callbacks of the Drowsiness
+Detection page wire them. The processed video and audio are sent back to
+the client, which measures what a driver would see and hear.
+
+Each client stamps a frame id and an alarm-test flag into a strip at the
+bottom of the frames it sends. The server forces the alarm on while it
+processes flagged frames, the client reads the id back from the returned
+(mirrored) frames and listens for the alarm sound in the returned audio:
+
+    latency        send to receipt of the processed frame, per frame
+    fps            processed frames received per second
+    dropped        frames sent but never returned processed (skipped as
+                   stale, lost or still queued)
+    alarm latency  send of the first flagged frame to the first alarm audio
+    busy           server processing time per second of the session
+
+CPU time and RSS are sampled for the process as a whole, which also runs
+the clients' encoders and decoders; busy isolates the server side.
+
+The synthetic frames hold no face, so FaceMesh finds nothing and the
+landmark, EAR/MAR and overlay work is never measured; the report warns
+when no processed frame had a face. Pass --video with a recording of a
+driver for a representative load.
+
+Sessions are added in steps, each step is measured for --duration seconds
+after a --warmup, and the report names the last step where every session
+kept up (fps, p95 latency and drops within limits).
+
+Usage:
+    python load_test.py --sessions 1 2 4 8 --duration 30
+    python load_test.py --sessions 2 4 6 8 --video driver.mp4 --json capacity.json
+"""
+import argparse
+import asyncio
+import fractions
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import av
+import numpy as np
+from aiortc import MediaStreamTrack, RTCPeerConnection
+from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import AudioStreamTrack
+
+from alarm_signal import AlarmSignal
+from audio_handling import AudioFrameHandler
+from backpressure import FrameAgeGate
+from drowsy_detection import VideoFrameHandler
+from frame_path import FramePath
+
+# Define the audio file to use.
+path = os.path.dirname(__file__)
+alarm_file_path = os.path.join(path, "audio", "wake_up.wav")
+
+#Change threshold values if needed
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+#Same default as the app's stale frame gate
+LATENCY_BUDGET = float(os.environ.get("D3F_LATENCY_BUDGET", 0.3))
+
+#Side of one stamp block in pixels, a whole macroblock so the encoder keeps it crisp
+STAMP_BLOCK = 16
+
+#Stamp layout: frame id bits, the alarm-test flag, then check bits
+ID_BITS = 16
+CHECK_BITS = 3
+STAMP_BITS = ID_BITS + 1 + CHECK_BITS
+
+#Seconds the alarm-test flag stays on in each alarm interval
+ALARM_HOLD = 1.0
+
+#Received audio louder than this (RMS of s16 samples) is the alarm sound
+ALARM_RMS = 500.0
+
+#A step is saturated when a session falls below this fraction of the sent frame rate...
+MIN_FPS_RATIO = 0.9
+
+#... or loses more than this fraction of its frames
+MAX_DROP_RATIO = 0.05
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+
+def stamp(image, frame_id, alarm):
+    """Write the frame id and alarm flag as black/white blocks along the bottom of an RGB image"""
+    frame_id %= 2 ** ID_BITS
+    bits = [(frame_id >> i) & 1 for i in range(ID_BITS)] + [int(alarm)]
+    check = sum(bits) % 2 ** CHECK_BITS
+    bits += [(check >> i) & 1 for i in range(CHECK_BITS)]
+
+    strip = image[-STAMP_BLOCK:]
+    for i, bit in enumerate(bits):
+        strip[:, i * STAMP_BLOCK:(i + 1) * STAMP_BLOCK] = 255 if bit else 0
+
+
+def read_stamp(frame, mirrored):
+    """
+    Read the stamp of a decoded frame from its luma plane, without a colour conversion.
+
+    Args:
+        frame: (av.VideoFrame) Decoded yuv420p frame.
+        mirrored: (bool) True for frames returned by the app, which mirrors them.
+
+    Returns:
+        frame_id, alarm: The stamped values, or None if the stamp is missing or damaged.
+    """
+    plane = frame.planes[0]
+    luma = np.frombuffer(plane, dtype=np.uint8).reshape(frame.height, plane.line_size)[:, :frame.width]
+    strip = luma[-STAMP_BLOCK:]
+    if mirrored:
+        strip = strip[:, ::-1]
+
+    # Sample the middle of each block, away from edges blurred by the encoder
+    margin = STAMP_BLOCK // 4
+    bits = [int(strip[margin:-margin, i * STAMP_BLOCK + margin:(i + 1) * STAMP_BLOCK - margin].mean() > 128)
+            for i in range(STAMP_BITS)]
+
+    data, check = bits[:ID_BITS + 1], bits[ID_BITS + 1:]
+    if sum(data) % 2 ** CHECK_BITS != sum(bit << i for i, bit in enumerate(check)):
+        return None
+    return sum(bit << i for i, bit in enumerate(data[:ID_BITS])), bool(data[ID_BITS])
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
+
+
+def read_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak instead of current RSS where /proc is not available (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+class DriverVideoTrack(MediaStreamTrack):
+    """
+    Video a simulated driver sends: a clip played in a loop, or synthetic frames.
+
+    Every frame is stamped with its id and the alarm-test flag, which is on
+    for the first ALARM_HOLD seconds of every alarm interval.
+    """
+
+    kind = "video"
+
+    def __init__(self, client, width, height, fps, video=None, alarm_interval=10.0):
+        super().__init__()
+        self.client = client
+        self.fps = fps
+        self.alarm_interval = alarm_interval
+        self.player = MediaPlayer(video, loop=True) if video else None
+        self._start = None
+        self._count = 0
+
+        # Gradient with noise so the encoder has some texture to work on
+        rng = np.random.default_rng(client.index)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        base = np.broadcast_to(gradient, (height, width, 3)).astype(np.int16)
+        self._image = np.clip(base + rng.integers(0, 32, base.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+
+    async def recv(self):
+        if self._start is None:
+            self._start = time.perf_counter()
+
+        if self.player is not None:
+            # The player paces the clip at its own frame rate
+            source = await self.player.video.recv()
+            image = source.to_ndarray(format="rgb24")
+            if image.shape[1] < STAMP_BITS * STAMP_BLOCK or image.shape[0] < STAMP_BLOCK:
+                raise ValueError(f"The clip must be at least {STAMP_BITS * STAMP_BLOCK} pixels wide to carry the stamp")
+            media_time = time.perf_counter() - self._start
+        else:
+            wait = self._start + self._count / self.fps - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            image = self._image.copy()
+            media_time = self._count / self.fps
+
+        alarm = self.alarm_interval > 0 and media_time % self.alarm_interval < ALARM_HOLD
+        frame_id = self._count
+        stamp(image, frame_id, alarm)
+        self.client.frame_sent(frame_id, alarm)
+
+        frame = av.VideoFrame.from_ndarray(image, format="rgb24")
+        frame.pts = int(media_time * VIDEO_CLOCK_RATE)
+        frame.time_base = VIDEO_TIME_BASE
+        self._count += 1
+        return frame
+
+    def stop(self):
+        super().stop()
+        if self.player is not None and self.player.video is not None:
+            self.player.video.stop()
+
+
+class ProcessedTrack(MediaStreamTrack):
+    """Track the server sends back: each received frame run through a callback on the session's worker thread"""
+
+    def __init__(self, kind, source, callback, executor):
+        super().__init__()
+        self.kind = kind
+        self.source = source
+        self.callback = callback
+        self.executor = executor
+
+    async def recv(self):
+        frame = await self.source.recv()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.callback, frame)
+
+
+class ServerSession:
+    """Server side of one driver session, wired like the callbacks of the Drowsiness Detection page"""
+
+    def __init__(self, name, latency_budget=LATENCY_BUDGET):
+        self.video_handler = VideoFrameHandler(session=name)
+        self.audio_handler = AudioFrameHandler(sound_file_path=alarm_file_path, session=name)
+        self.frame_path = FramePath(self.video_handler)
+        self.alarm_signal = AlarmSignal(name)
+        self.age_gate = FrameAgeGate(latency_budget)
+        self.thresholds = dict(thresholds)
+        self.busy = 0.0
+        self.face_frames = 0
+
+        # One worker per track, as callbacks of a session never run concurrently
+        self.video_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-video")
+        self.audio_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-audio")
+
+    def video_frame_callback(self, frame: av.VideoFrame):
+        callback_start = time.perf_counter()
+
+        # Stale frames are not processed, the last output frame is shown again
+        frame_time = None
+        if frame.time is not None:
+            if not self.age_gate.admit(frame.time, callback_start):
+                return self.frame_path.repeat(frame)
+            frame_time = self.age_gate.frame_time(frame.time)
+
+        # The alarm-test flag stands in for a drowsy driver
+        stamped = read_stamp(frame, mirrored=False)
+        alarm_test = stamped is not None and stamped[1]
+
+        new_frame, play_alarm = self.frame_path(frame, self.thresholds, now=frame_time)
+        self.alarm_signal.publish(play_alarm or alarm_test)
+        if self.video_handler.row_dict:
+            self.face_frames += 1
+
+        self.busy += time.perf_counter() - callback_start
+        return new_frame
+
+    def audio_frame_callback(self, frame: av.AudioFrame):
+        callback_start = time.perf_counter()
+        play_alarm, _ = self.alarm_signal.read()
+        new_frame = self.audio_handler.process(frame, play_sound=play_alarm)
+        self.busy += time.perf_counter() - callback_start
+        return new_frame
+
+    def close(self):
+        # A frame still in FaceMesh finishes before the graph is released
+        self.video_executor.shutdown(wait=True)
+        self.audio_executor.shutdown(wait=False)
+        self.video_handler.close()
+
+
+class DriverClient:
+    """Measurements of one simulated driver"""
+
+    def __init__(self, index):
+        self.index = index
+        self.sent_times = {}
+        self.reset()
+
+    def reset(self):
+        """Start a new measurement window"""
+        self.started = time.perf_counter()
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        self.alarm_latencies = []
+        self.alarms_sent = 0
+        self.alarm_pending = None
+        self._alarm_flag = False
+        self.busy_start = None
+        self.face_start = None
+
+    def frame_sent(self, frame_id, alarm):
+        now = time.perf_counter()
+        self.sent_times[frame_id % 2 ** ID_BITS] = now
+        self.sent += 1
+
+        # The first flagged frame of an interval starts an alarm measurement
+        if alarm and not self._alarm_flag:
+            self.alarms_sent += 1
+            self.alarm_pending = now
+        self._alarm_flag = alarm
+
+    async def consume_video(self, track):
+        while True:
+            frame = await track.recv()
+            now = time.perf_counter()
+            stamped = read_stamp(frame, mirrored=True)
+            if stamped is None:
+                continue  # Passed through unprocessed, or damaged
+            sent = self.sent_times.pop(stamped[0], None)
+            if sent is None:
+                continue  # A repeated output frame
+            self.received += 1
+            self.latencies.append(now - sent)
+
+    async def consume_audio(self, track):
+        while True:
+            frame = await track.recv()
+            if self.alarm_pending is None:
+                continue
+            samples = frame.to_ndarray().astype(np.float32)
+            if np.sqrt(np.mean(samples ** 2)) > ALARM_RMS:
+                self.alarm_latencies.append(time.perf_counter() - self.alarm_pending)
+                self.alarm_pending = None
+
+    def results(self, elapsed, busy, face_frames):
+        return {
+            "session": self.index,
+            "sent": self.sent,
+            "received": self.received,
+            "fps": self.received / elapsed,
+            "dropped": max(0, self.sent - self.received),
+            "drop_ratio": max(0, self.sent - self.received) / self.sent if self.sent else 0.0,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+            "alarms_sent": self.alarms_sent,
+            "alarms_heard": len(self.alarm_latencies),
+            "alarms_missed": self.alarms_sent - len(self.alarm_latencies) - (self.alarm_pending is not None),
+            "alarm_latency_p50": percentile(self.alarm_latencies, 50),
+            "alarm_latency_max": max(self.alarm_latencies, default=None),
+            "busy": busy / elapsed,
+            "face_frames": face_frames,
+        }
+
+
+async def connect_driver(index, args, loop, tasks):
+    """
+    Open the WebRTC connection of one simulated driver to its server session.
+
+    Returns:
+        The client and server peer connections, the DriverClient and the ServerSession.
+    """
+    client = DriverClient(index)
+    session = await loop.run_in_executor(None, ServerSession, f"load_{index}", args.latency_budget)
+
+    server_pc = RTCPeerConnection()
+    client_pc = RTCPeerConnection()
+
+    @server_pc.on("track")
+    def on_server_track(track):
+        if track.kind == "video":
+            server_pc.addTrack(ProcessedTrack("video", track, session.video_frame_callback, session.video_executor))
+        else:
+            server_pc.addTrack(ProcessedTrack("audio", track, session.audio_frame_callback, session.audio_executor))
+
+    @client_pc.on("track")
+    def on_client_track(track):
+        consume = client.consume_video if track.kind == "video" else client.consume_audio
+        tasks.append(asyncio.ensure_future(consume(track)))
+
+    client_pc.addTrack(DriverVideoTrack(client, args.width, args.height, args.fps, args.video, args.alarm_interval))
+    client_pc.addTrack(AudioStreamTrack())  # Silence, replaced by the alarm sound while the alarm plays
+
+    # Loopback signaling: the offer/answer exchange the browser does with the app
+    await client_pc.setLocalDescription(await client_pc.createOffer())
+    await server_pc.setRemoteDescription(client_pc.localDescription)
+    await server_pc.setLocalDescription(await server_pc.createAnswer())
+    await client_pc.setRemoteDescription(server_pc.localDescription)
+
+    return client_pc, server_pc, client, session
+
+
+async def run_step(sessions, args):
+    """Run `sessions` drivers at once and measure them for args.duration seconds"""
+    loop = asyncio.get_running_loop()
+    tasks = []
+    drivers = await asyncio.gather(*(connect_driver(i, args, loop, tasks) for i in range(sessions)))
+
+    await asyncio.sleep(args.warmup)  # Connection setup, FaceMesh start-up and jitter buffers filling
+
+    for _, _, client, session in drivers:
+        client.reset()
+        client.busy_start = session.busy
+        client.face_start = session.face_frames
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    peak_rss = read_rss()
+
+    deadline = wall_start + args.duration
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(min(0.5, max(0.0, deadline - time.perf_counter())))
+        peak_rss = max(peak_rss, read_rss())
+
+    elapsed = time.perf_counter() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    results = [client.results(elapsed, session.busy - client.busy_start, session.face_frames - client.face_start)
+               for _, _, client, session in drivers]
+
+    for task in tasks:
+        task.cancel()
+    for client_pc, server_pc, _, session in drivers:
+        await client_pc.close()
+        await server_pc.close()
+        session.close()
+
+    return summarize_step(sessions, results, cpu / elapsed, peak_rss, args)
+
+
+def summarize_step(sessions, results, cpu_cores, peak_rss, args):
+    """Aggregate the session results of a step and decide whether it saturated the host"""
+    latencies = [r["latency_p95"] for r in results if r["latency_p95"] is not None]
+    alarm_latencies = [r["alarm_latency_max"] for r in results if r["alarm_latency_max"] is not None]
+    step = {
+        "sessions": sessions,
+        "fps_min": min(r["fps"] for r in results),
+        "fps_mean": statistics.mean(r["fps"] for r in results),
+        "latency_p95_max": max(latencies, default=None),
+        "drop_ratio_max": max(r["drop_ratio"] for r in results),
+        "alarm_latency_max": max(alarm_latencies, default=None),
+        "alarms_missed": sum(r["alarms_missed"] for r in results),
+        "busy_mean": statistics.mean(r["busy"] for r in results),
+        "face_frames": sum(r["face_frames"] for r in results),
+        "cpu_cores": cpu_cores,
+        "rss_mb": peak_rss / 2 ** 20,
+        "session_results": results,
+    }
+
+    reasons = []
+    if step["fps_min"] < MIN_FPS_RATIO * args.fps:
+        reasons.append(f"fps {step['fps_min']:.1f} < {MIN_FPS_RATIO * args.fps:.1f}")
+    if step["latency_p95_max"] is None or step["latency_p95_max"] > args.latency_budget:
+        reasons.append("no frames returned" if step["latency_p95_max"] is None
+                       else f"p95 latency {step['latency_p95_max'] * 1000:.0f} ms > {args.latency_budget * 1000:.0f} ms")
+    if step["drop_ratio_max"] > MAX_DROP_RATIO:
+        reasons.append(f"{step['drop_ratio_max']:.0%} frames dropped")
+    if step["alarms_missed"]:
+        reasons.append(f"{step['alarms_missed']} alarms not heard")
+    step["saturated"] = bool(reasons)
+    step["reasons"] = reasons
+    return step
+
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_report(steps, args):
+    print(f"{args.width}x{args.height} @ {args.fps:g} fps per session, {os.cpu_count()} cores, "
+          f"latency budget {args.latency_budget * 1000:.0f} ms")
+    print(f"{'sessions':>8} {'fps min':>8} {'p95 ms':>8} {'drop':>6} {'alarm ms':>9} {'missed':>6} "
+          f"{'busy':>6} {'cpu':>6} {'rss MB':>7}  status")
+    for step in steps:
+        status = "SATURATED: " + ", ".join(step["reasons"]) if step["saturated"] else "ok"
+        print(f"{step['sessions']:>8} {step['fps_min']:>8.1f} {ms(step['latency_p95_max']):>8} {step['drop_ratio_max']:>6.1%} "
+              f"{ms(step['alarm_latency_max']):>9} {step['alarms_missed']:>6} {step['busy_mean']:>6.0%} "
+              f"{step['cpu_cores']:>6.2f} {step['rss_mb']:>7.0f}  {status}")
+
+    # Without a face the FaceMesh landmarks, EAR/MAR and overlay never run and the capacity is overstated
+    if not any(step["face_frames"] for step in steps):
+        print("WARNING: no face was detected in any processed frame, the landmark and overlay work was not measured. "
+              "Pass --video with a recording of a driver for a representative load.")
+
+    capacity = capacity_of(steps)
+    saturated = next((step["sessions"] for step in steps if step["saturated"]), None)
+    if saturated is None:
+        print(f"Not saturated up to {capacity} sessions, try more")
+    else:
+        print(f"Capacity: {capacity} sessions, saturated at {saturated}")
+
+
+def capacity_of(steps):
+    """Largest session count before the first saturated step"""
+    capacity = 0
+    for step in steps:
+        if step["saturated"]:
+            break
+        capacity = step["sessions"]
+    return capacity
+
+
+async def run(args):
+    steps = []
+    for sessions in sorted(args.sessions):
+        step = await run_step(sessions, args)
+        steps.append(step)
+        print(f"{sessions} sessions: fps min {step['fps_min']:.1f}, p95 {ms(step['latency_p95_max'])} ms, "
+              f"cpu {step['cpu_cores']:.2f} cores" + (" (saturated)" if step["saturated"] else ""), file=sys.stderr)
+        if step["saturated"] and not args.keep_going:
+            break
+    return steps
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find how many concurrent driver sessions this host handles")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent sessions of each step (default: 1 2 4 8)")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per step (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before each step (default: 5)")
+    parser.add_argument("--video", help="clip every driver streams in a loop, e.g. a recording of a real driver (default: synthetic frames)")
+    parser.add_argument("--width", type=int, default=640, help="width of the synthetic frames (default: 640)")
+    parser.add_argument("--height", type=int, default=480, help="height of the synthetic frames (default: 480)")
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate sent by each driver, also the fps target (default: 30)")
+    parser.add_argument("--alarm-interval", type=float, default=10.0, help=f"seconds between alarm tests, each {ALARM_HOLD:g} s long, 0 for none (default: 10)")
+    parser.add_argument("--latency-budget", type=float, default=LATENCY_BUDGET, help=f"p95 frame latency a step may reach (default: {LATENCY_BUDGET:g})")
+    parser.add_argument("--keep-going", action="store_true", help="run the remaining steps after the first saturated one")
+    parser.add_argument("--json", help="write the capacity report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.width < STAMP_BITS * STAMP_BLOCK:
+        sys.exit(f"Frames must be at least {STAMP_BITS * STAMP_BLOCK} pixels wide to carry the stamp")
+
+    steps = asyncio.run(run(args))
+    print_report(steps, args)
+
+    if args.json:
+        report = {
+            "created": time.time(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cores": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items() if key != "json"},
+            "capacity": capacity_of(steps),
+            "steps": steps,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
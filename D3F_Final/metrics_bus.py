@@ -0,0 +1,171 @@
+"""
+In-process publish/subscribe fan-out of per-frame metrics.
+
+The video callback publishes each frame's metrics record (the row_dict of
+VideoFrameHandler, never mutated once published) to the bus once. Every
+subscriber has its own bounded queue and delivery thread, so adding a
+consumer (storage, live charts, calibration, analytics, notifications)
+adds one append per frame to the callback and nothing else. When a
+subscriber falls behind and its queue is full, its overflow policy decides
+which record is lost; the publisher never waits.
+
+The alarm is not routed through the bus: the audio callback reads it from
+AlarmSignal with no queue in between.
+"""
+import logging
+import threading
+from collections import deque
+
+from instrumentation import metrics
+
+#Overflow policies: discard the oldest queued record to make room, or discard the record being published
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+#Records queued per subscriber by default, 10 s at 30 fps
+DEFAULT_CAPACITY = 300
+
+#Seconds a delivery thread sleeps between checks when nothing wakes it
+POLL_INTERVAL = 0.5
+
+logger = logging.getLogger("d3f.metrics_bus")
+
+
+class Subscription:
+    """
+    Bounded queue of one subscriber and the thread delivering it to the handler.
+
+    offer() is called by the publisher only and never blocks: a deque append
+    (plus popping the oldest record when full) and, if the delivery thread is
+    asleep, setting its event.
+    """
+
+    def __init__(self, name: str, handler, capacity: int = DEFAULT_CAPACITY, overflow: str = DROP_OLDEST, session: str = "default"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+
+        self.name = name
+        self.handler = handler
+        self.capacity = capacity
+        self.overflow = overflow
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._dropped_metric = metrics.counter("d3f_bus_dropped_total", "Metrics records dropped by a full subscriber queue",
+                                               session=session, subscriber=name)
+
+        self._thread = threading.Thread(target=self._run, name=f"MetricsBus-{name}", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def offer(self, record):
+        """
+        Queue a record for the handler, applying the overflow policy when full.
+
+        Returns:
+            False if a record was dropped, True otherwise.
+        """
+        accepted = True
+        if len(self._queue) >= self.capacity:
+            self.dropped += 1
+            self._dropped_metric.inc()
+            accepted = False
+            if self.overflow == DROP_NEWEST:
+                return False
+            try:
+                self._queue.popleft()
+            except IndexError:
+                pass  # The delivery thread emptied the queue in between
+
+        self._queue.append(record)
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+        return accepted
+
+    def close(self, timeout: float = None):
+        """Deliver the queued records and stop the delivery thread"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+            while True:
+                try:
+                    record = self._queue.popleft()
+                except IndexError:
+                    break
+
+                try:
+                    self.handler(record)
+                    self.delivered += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Metrics subscriber %s failed on a record", self.name)
+
+            if self._closed and not self._queue:
+                return
+
+
+class MetricsBus:
+    """
+    Fans per-frame metrics records out to subscribers.
+
+    publish() iterates over an immutable tuple of subscriptions that
+    subscribe()/unsubscribe() rebind, so the publisher never takes a lock.
+    """
+
+    def __init__(self, session: str = "default"):
+        self.session = session
+        self.published = 0
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, name: str, handler, capacity: int = DEFAULT_CAPACITY, overflow: str = DROP_OLDEST):
+        """
+        Args:
+            name: (str) Label of the subscriber in logs and metrics.
+            handler: Called with each record on the subscriber's own thread.
+            capacity: (int) Records queued before the overflow policy applies.
+            overflow: (str) DROP_OLDEST keeps the freshest records (live views),
+                            DROP_NEWEST keeps the queued backlog intact.
+
+        Returns:
+            The Subscription, with its delivered/dropped/failed counts.
+        """
+        subscription = Subscription(name, handler, capacity, overflow, self.session)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        subscription.close()
+
+    def publish(self, record):
+        """Called by the single publisher (the video callback), never blocks"""
+        for subscription in self._subscriptions:
+            subscription.offer(record)
+        self.published += 1
+
+    @property
+    def subscriptions(self):
+        return self._subscriptions
+
+    def close(self, timeout: float = None):
+        """Deliver what is queued to every subscriber and stop their threads"""
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, ()
+        for subscription in subscriptions:
+            subscription.close(timeout)
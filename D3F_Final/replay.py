@@ -0,0 +1,193 @@
+"""
+Replay landmark recordings through the drowsiness state machine.
+
+EAR and MAR are computed for all frames of a recording at once with numpy,
+then the state machine is run over them for every threshold set, without a
+camera, FaceMesh or video. The alarm timeline of each set is compared with
+the first (baseline) set.
+
+Usage:
+    python replay.py recordings/trip_20240101120000.d3fl --ear 0.16 0.18 0.20 --wait 2 4
+    python replay.py recordings/*.d3fl --ear 0.18 --mar 0.8 0.9 --json replay.json
+"""
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+
+from drowsy_detection import DrowsinessStateMachine
+from landmark_log import LANDMARK_IDS, read_recording
+
+#Change threshold values if needed
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+
+def to_pixels(points, width, height):
+    """Same rounding as mediapipe's _normalized_to_pixel_coordinates"""
+    x = np.minimum(np.floor(points[..., 0] * width), width - 1)
+    y = np.minimum(np.floor(points[..., 1] * height), height - 1)
+    return np.stack([x, y], axis=-1)
+
+
+def _distance(points, a, b):
+    return np.linalg.norm(points[:, a] - points[:, b], axis=-1)
+
+
+def _ratio(numerator, denominator, points):
+    # The live code returns 0.0 when a landmark has no pixel position or the ratio divides by zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = numerator / denominator
+    invalid = np.isnan(points).any(axis=(1, 2)) | (denominator == 0)
+    return np.where(invalid, 0.0, ratio)
+
+
+def compute_ear_mar(recording):
+    """
+    EAR and MAR of every frame of a recording, as calculate_ear_mar computes them live.
+
+    Returns:
+        has_face: (np.ndarray) False for frames where no face was found.
+        EAR: (np.ndarray) Average eye aspect ratio per frame.
+        MAR: (np.ndarray) Mouth aspect ratio per frame.
+    """
+    if tuple(recording.landmark_ids) != LANDMARK_IDS:
+        raise ValueError("Recording does not hold the eye and mouth landmarks of this version")
+
+    points = recording.points
+    has_face = ~np.isnan(points).all(axis=(1, 2))
+    pixels = to_pixels(points, recording.width, recording.height)
+
+    ears = []
+    for eye in (pixels[:, 0:6], pixels[:, 6:12]):
+        ears.append(_ratio(_distance(eye, 1, 5) + _distance(eye, 2, 4), 2.0 * _distance(eye, 0, 3), eye))
+    EAR = (ears[0] + ears[1]) / 2.0
+
+    mouth = pixels[:, 12:20]
+    MAR = _ratio(_distance(mouth, 2, 3) + _distance(mouth, 4, 5) + _distance(mouth, 6, 7), 3 * _distance(mouth, 0, 1), mouth)
+
+    return has_face, EAR, MAR
+
+
+def run_state_machine(times, has_face, EAR, MAR, thresholds):
+    """
+    Run the state machine over precomputed features.
+
+    Returns:
+        result: (dict) Alarm, yawn and eye closure counts and the alarm
+                       intervals as (start, end) seconds from the first frame.
+    """
+    start = times[0] if len(times) else 0.0
+    state = DrowsinessStateMachine(start_time=start)
+    intervals = []
+    alarm_start = None
+
+    # Plain Python floats are much faster to loop over than numpy scalars
+    for now, face, ear, mar in zip(times.tolist(), has_face.tolist(), EAR.tolist(), MAR.tolist()):
+        if face:
+            play_alarm = state.update(ear, mar, now, thresholds)
+        else:
+            state.reset(now)
+            play_alarm = False
+
+        if play_alarm and alarm_start is None:
+            alarm_start = now
+        elif not play_alarm and alarm_start is not None:
+            intervals.append((alarm_start - start, now - start))
+            alarm_start = None
+
+    if alarm_start is not None:
+        intervals.append((alarm_start - start, times[-1] - start))
+
+    return {
+        "alarms": state.alarm_counter,
+        "yawns": state.yawn_counter,
+        "eye_closures": state.eye_shut_counter,
+        "alarm_seconds": sum(end - begin for begin, end in intervals),
+        "alarm_intervals": intervals,
+    }
+
+
+def _overlaps(interval, intervals):
+    return any(begin <= interval[1] and interval[0] <= end for begin, end in intervals)
+
+
+def compare_timelines(result, baseline):
+    """Alarm intervals of result that do not overlap any of baseline, and the reverse"""
+    return {
+        "added": [interval for interval in result["alarm_intervals"] if not _overlaps(interval, baseline["alarm_intervals"])],
+        "removed": [interval for interval in baseline["alarm_intervals"] if not _overlaps(interval, result["alarm_intervals"])],
+    }
+
+
+def replay(path, threshold_sets):
+    recording = read_recording(path)
+    started = time.perf_counter()
+    has_face, EAR, MAR = compute_ear_mar(recording)
+
+    results = []
+    for current in threshold_sets:
+        result = run_state_machine(recording.times, has_face, EAR, MAR, current)
+        result["thresholds"] = current
+        results.append(result)
+
+    for result in results:
+        result.update(compare_timelines(result, results[0]))
+
+    elapsed = time.perf_counter() - started
+    duration = float(recording.times[-1] - recording.times[0]) if len(recording.times) > 1 else 0.0
+    return {
+        "recording": path,
+        "frames": len(recording.times),
+        "duration": duration,
+        "replay_seconds": elapsed,
+        "speedup": duration * len(threshold_sets) / elapsed if elapsed else 0.0,
+        "results": results,
+    }
+
+
+def print_report(report):
+    print(f"{report['recording']}: {report['frames']} frames, {report['duration']:.0f}s recorded, "
+          f"replayed in {report['replay_seconds'] * 1000:.1f} ms ({report['speedup']:.0f}x real time per threshold set)")
+    print(f"{'EAR':>6}{'MAR':>6}{'WAIT':>6}{'alarms':>8}{'alarm s':>9}{'yawns':>7}{'closures':>10}{'added':>7}{'removed':>9}")
+    for result in report["results"]:
+        current = result["thresholds"]
+        print(f"{current['EAR_THRESH']:>6.2f}{current['MAR_THRESH']:>6.2f}{current['WAIT_TIME']:>6.1f}"
+              f"{result['alarms']:>8}{result['alarm_seconds']:>9.1f}{result['yawns']:>7}{result['eye_closures']:>10}"
+              f"{len(result['added']):>7}{len(result['removed']):>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay landmark recordings with different drowsiness thresholds")
+    parser.add_argument("recordings", nargs="+", help="recordings written with landmark recording enabled")
+    parser.add_argument("--ear", type=float, nargs="+", default=[thresholds["EAR_THRESH"]], help="EAR_THRESH values to try")
+    parser.add_argument("--mar", type=float, nargs="+", default=[thresholds["MAR_THRESH"]], help="MAR_THRESH values to try")
+    parser.add_argument("--wait", type=float, nargs="+", default=[thresholds["WAIT_TIME"]], help="WAIT_TIME values to try")
+    parser.add_argument("--json", help="write the reports, including the alarm intervals, to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Every combination is compared with the first one
+    threshold_sets = [{"EAR_THRESH": ear, "MAR_THRESH": mar, "WAIT_TIME": wait} for ear, mar, wait in itertools.product(args.ear, args.mar, args.wait)]
+
+    reports = []
+    for path in args.recordings:
+        report = replay(path, threshold_sets)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
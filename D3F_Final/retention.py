@@ -0,0 +1,195 @@
+"""
+Retention and compaction of old trips.
+
+Raw per-frame samples are kept for RETENTION_DAYS. After that a trip is
+compacted: its summary record, EAR rollup and downsampled overview (which
+the trip list, the fleet analytics and the dashboard read) are kept, its
+raw rows are deleted in small batches so no lock is held for long, and the
+emptied table is dropped. The summary is flagged as compacted so the
+dashboard shows the summary and overview only. Trips are only compacted
+once they have a summary, i.e. after they ended or were backfilled, and
+trips summarized before overviews existed get theirs before their samples
+are dropped.
+
+The job runs in the background of the Streamlit server (one runner per
+database, guarded by a MySQL named lock) or from cron:
+
+Usage:
+    python retention.py --days 90
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from trip_storage import OVERVIEW_TABLE, SUMMARY_TABLE, TRIP_TABLE_PATTERN, connect, create_summary_table, db_credentials, write_trip_overview
+
+#Days of raw per-frame samples to keep
+RETENTION_DAYS = float(os.environ.get("D3F_RETENTION_DAYS", 90))
+
+#Seconds between background compaction runs
+COMPACT_INTERVAL = 3600.0
+
+#Raw rows deleted per statement, each batch commits on its own
+DELETE_BATCH = 5000
+
+#Pause between batches so live inserts and dashboard reads get the table in between
+BATCH_PAUSE = 0.05
+
+#Named lock making sure only one server process compacts at a time
+LOCK_NAME = "d3f_retention"
+
+logger = logging.getLogger("d3f.retention")
+
+
+#function to add the compacted flag to summary tables created before it existed
+def ensure_compacted_column():
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+            SELECT COUNT(*) AS found FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s AND column_name = 'compacted'
+            """
+            cursor.execute(sql, (db_credentials["database"], SUMMARY_TABLE))
+            if not cursor.fetchone()["found"]:
+                cursor.execute(f"ALTER TABLE {SUMMARY_TABLE} ADD COLUMN compacted BOOLEAN NOT NULL DEFAULT FALSE")
+                connection.commit()
+    finally:
+        connection.close()
+
+
+#function to list the trips whose raw samples are older than the retention window, oldest first
+def get_expired_trips(cutoff):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT s.table_name AS table_name, s.start_time AS start_time, s.end_time AS end_time,
+                t.data_length + t.index_length AS size,
+                EXISTS (SELECT 1 FROM {OVERVIEW_TABLE} o WHERE o.table_name = s.table_name) AS has_overview
+            FROM {SUMMARY_TABLE} s JOIN information_schema.tables t
+                ON t.table_schema = %s AND t.table_name = s.table_name
+            WHERE s.end_time < %s AND NOT s.compacted AND s.table_name REGEXP %s
+            ORDER BY s.end_time
+            """
+            cursor.execute(sql, (db_credentials["database"], cutoff, TRIP_TABLE_PATTERN))
+            trips = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return trips
+
+
+def compact_trip(table_name, batch_size=DELETE_BATCH, pause=BATCH_PAUSE):
+    """
+    Compact one trip whose summary and rollup are written: drop its raw samples.
+
+    Returns:
+        rows: (int) Raw samples deleted.
+    """
+    deleted = 0
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            while True:
+                count = cursor.execute(f"DELETE FROM {table_name} LIMIT %s", (batch_size,))
+                connection.commit()
+                deleted += count
+                if count < batch_size:
+                    break
+                time.sleep(pause)
+
+            cursor.execute(f"UPDATE {SUMMARY_TABLE} SET compacted = TRUE WHERE table_name = %s", (table_name,))
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            connection.commit()
+    finally:
+        connection.close()
+
+    return deleted
+
+
+def compact_expired_trips(days=RETENTION_DAYS, now=None):
+    """
+    Compact every trip that ended more than `days` days ago.
+
+    Returns:
+        report: (dict) Trips compacted, raw rows deleted and bytes reclaimed
+                       (table data and index size before compaction), or
+                       None if another process holds the retention lock.
+    """
+    now = time.time() if now is None else now
+    ensure_compacted_column()
+    create_summary_table()  # The overview table is missing from databases created before it existed
+
+    lock_connection = connect()
+    try:
+        with lock_connection.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (LOCK_NAME,))
+            if not cursor.fetchone()["acquired"]:
+                return None
+
+        started = time.perf_counter()
+        report = {"started": now, "trips": 0, "rows": 0, "bytes": 0, "seconds": 0.0}
+        for trip in get_expired_trips(now - days * 86400):
+            # Only the overview is left to draw a compacted trip, build it while the samples are still there
+            if not trip["has_overview"] and trip["start_time"] is not None:
+                write_trip_overview(trip["table_name"], trip["start_time"], trip["end_time"])
+            rows = compact_trip(trip["table_name"])
+            report["trips"] += 1
+            report["rows"] += rows
+            report["bytes"] += int(trip["size"] or 0)
+            logger.info("Compacted %s: %d rows, %d bytes", trip["table_name"], rows, trip["size"] or 0)
+        report["seconds"] = time.perf_counter() - started
+
+        with lock_connection.cursor() as cursor:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    finally:
+        lock_connection.close()
+
+    return report
+
+
+class RetentionJob:
+    """Runs compact_expired_trips every `interval` seconds on a daemon thread"""
+
+    def __init__(self, days: float = RETENTION_DAYS, interval: float = COMPACT_INTERVAL):
+        self.days = days
+        self.interval = interval
+        self.last_report = None
+        self._thread = threading.Thread(target=self._run, name="RetentionJob", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                report = compact_expired_trips(self.days)
+                if report is not None:
+                    self.last_report = report
+            except Exception:
+                logger.exception("Trip compaction failed, retrying in %.0f s", self.interval)
+            time.sleep(self.interval)
+
+
+def format_report(report):
+    return (f"{report['trips']} trips compacted, {report['rows']} raw samples deleted, "
+            f"{report['bytes'] / 2 ** 20:.1f} MiB reclaimed in {report['seconds']:.1f} s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compact trips older than the retention window")
+    parser.add_argument("--days", type=float, default=RETENTION_DAYS, help=f"days of raw samples to keep (default: {RETENTION_DAYS:g})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    report = compact_expired_trips(args.days)
+    print(format_report(report) if report is not None else "Another process is compacting trips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Soak test of a long trip at accelerated speed.
+
+Runs the per-session pipeline of the live page (stale frame gate, frame
+path, video handler, alarm signal, audio handler, and the metrics bus
+feeding the live chart buffer, threshold calibration and trip storage) on
+synthetic input for a simulated multi-hour trip, as fast as the host
+allows. Time is simulated: every frame advances the trip clock by 1/fps, so
+the state machine, fatigue window and calibration see the trip's own
+timeline. The driver keeps their eyes open, blinks, and closes them long
+enough to raise the alarm once a minute; the soak fails if the alarm is
+never raised.
+
+Memory is sampled every --sample-minutes of trip time, after a full garbage
+collection: RSS, the number of objects tracked by the garbage collector and
+open file descriptors. Growth is measured from the first sample after
+--warmup-minutes, once the bounded buffers have filled, and the test fails
+when it exceeds the budgets.
+
+Usage:
+    python soak_test.py --hours 4
+    python soak_test.py --hours 8 --width 480 --height 360 --rss-budget 32 --json soak.json
+    python soak_test.py --hours 1 --mysql
+"""
+import argparse
+import fractions
+import gc
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import av
+import numpy as np
+
+from alarm_signal import AlarmSignal
+from audio_handling import AudioFrameHandler
+from backpressure import FrameAgeGate
+from bench_pipeline import FaceLandmarks, FaceMeshResults, landmark_fixtures, synthetic_audio_frames, synthetic_frames
+from calibration import ThresholdCalibrator
+from drowsy_detection import VideoFrameHandler
+from edge_log import SqliteTripLog
+from frame_path import FramePath
+from live_metrics import MetricsRingBuffer
+from metrics_bus import DROP_NEWEST, MetricsBus
+
+# Define the audio file to use.
+path = os.path.dirname(__file__)
+alarm_file_path = os.path.join(path, "audio", "wake_up.wav")
+
+#Change threshold values if needed
+thresholds = {
+        "EAR_THRESH": 0.18,
+        "MAR_THRESH": 0.90,
+        "WAIT_TIME": 4.0
+    }
+
+#Audio frames per second of trip (20 ms WebRTC frames)
+AUDIO_FPS = 50
+
+#Rows kept by the live chart buffer, 5 min at 30 fps
+LIVE_BUFFER_SIZE = 5 * 60 * 30
+
+#Samples the trip writer may queue with --mysql, 5 min at 30 fps
+STORAGE_QUEUE_SIZE = 5 * 60 * 30
+
+#The driver closes their eyes for EYES_CLOSED seconds every DROWSY_INTERVAL seconds, longer than WAIT_TIME
+DROWSY_INTERVAL = 60.0
+EYES_CLOSED = 5.0
+
+#The driver blinks for BLINK_DURATION seconds every BLINK_INTERVAL seconds
+BLINK_INTERVAL = 4.0
+BLINK_DURATION = 0.15
+
+#Every NO_FACE_INTERVAL frames no face is found, outside the eyes-closed windows
+#(losing the face resets the drowsy timer, the alarm would never be raised)
+NO_FACE_INTERVAL = 10
+
+#Media time base of the simulated video frames
+TIME_BASE = fractions.Fraction(1, 1000000)
+
+
+class SoakFaceMesh:
+    """Stands in for FaceMesh: returns open or closed eye landmarks following the simulated trip clock"""
+
+    def __init__(self, clock, fixtures):
+        self.clock = clock
+        self.open = fixtures[1::2]  # landmark_fixtures alternate closed and open eyes
+        self.closed = fixtures[0::2]
+        self.calls = 0
+
+    def process(self, frame):
+        self.calls += 1
+        now = self.clock()
+        drowsy = now % DROWSY_INTERVAL < EYES_CLOSED
+        if self.calls % NO_FACE_INTERVAL == 0 and not drowsy:
+            return FaceMeshResults(None)
+
+        closed = drowsy or now % BLINK_INTERVAL < BLINK_DURATION
+        fixtures = self.closed if closed else self.open
+        return FaceMeshResults([FaceLandmarks(fixtures[self.calls % len(fixtures)])])
+
+
+def read_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak instead of current RSS where /proc is not available (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def count_fds():
+    """Open file descriptors of this process, None where they cannot be listed"""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def take_sample(trip_time, frames):
+    gc.collect()
+    return {
+        "trip_minutes": trip_time / 60.0,
+        "frames": frames,
+        "wall_seconds": time.perf_counter(),
+        "rss_mb": read_rss() / 2 ** 20,
+        "objects": len(gc.get_objects()),
+        "fds": count_fds(),
+    }
+
+
+class TripStorage:
+    """Trip storage of the soak: a local SQLite trip log, or a trip table written by TripWriter"""
+
+    def __init__(self, mysql: bool):
+        self.mysql = mysql
+        if mysql:
+            from trip_storage import TripWriter, create_database, create_summary_table, create_table, db_credentials
+
+            create_database(db_credentials["database"])
+            create_summary_table()
+            self.table_name = create_table()
+            self.writer = TripWriter(self.table_name, max_queue=STORAGE_QUEUE_SIZE)
+        else:
+            self.log_dir = tempfile.mkdtemp(prefix="d3f-soak-")
+            self.writer = SqliteTripLog(self.log_dir)
+
+    def write(self, row_dict):
+        self.writer.write(row_dict)
+
+    def close(self):
+        self.writer.close()
+        if self.mysql:
+            from trip_storage import delete_table
+
+            delete_table(self.table_name)
+        else:
+            shutil.rmtree(self.log_dir, ignore_errors=True)
+
+
+def run_soak(args):
+    """
+    Run the pipeline for args.hours of simulated trip time.
+
+    Returns:
+        samples: (list) Memory samples taken every args.sample_minutes of trip time.
+        alarms: (int) Number of times the alarm was raised.
+        dropped: (dict) Records dropped by each metrics bus subscriber.
+    """
+    trip = {"time": 0.0}
+    clock = lambda: trip["time"]
+
+    video_frames = [av.VideoFrame.from_ndarray(frame, format="rgb24").reformat(format="yuv420p")
+                    for frame in synthetic_frames(8, args.width, args.height)]
+    audio_frames = synthetic_audio_frames(AUDIO_FPS)
+
+    video_handler = VideoFrameHandler(session="soak", facemesh_model=SoakFaceMesh(clock, landmark_fixtures(16)))
+    audio_handler = AudioFrameHandler(sound_file_path=alarm_file_path, session="soak")
+    frame_path = FramePath(video_handler)
+    alarm_signal = AlarmSignal("soak")
+    age_gate = FrameAgeGate()
+    live_buffer = MetricsRingBuffer(LIVE_BUFFER_SIZE)
+    calibrator = ThresholdCalibrator()
+    trip_thresholds = dict(thresholds)
+    storage = TripStorage(args.mysql)
+
+    # Subscribed like the live page does
+    def calibrate(row):
+        # Rows carry the wall-clock time, calibration runs on the trip clock
+        if not calibrator.done and calibrator.update(row["EAR"], row["MAR"], clock()):
+            trip_thresholds.update(calibrator.result(trip_thresholds) or {})
+
+    metrics_bus = MetricsBus("soak")
+    metrics_bus.subscribe("storage", storage.write, overflow=DROP_NEWEST)
+    metrics_bus.subscribe("live_charts", live_buffer.append)
+    metrics_bus.subscribe("calibration", calibrate)
+
+    total_frames = int(args.hours * 3600 * args.fps)
+    sample_every = max(1, int(args.sample_minutes * 60 * args.fps))
+    audio_per_frame = AUDIO_FPS / args.fps
+    audio_due = 0.0
+    audio_sent = 0
+    alarms = 0
+    alarm_on = False
+
+    samples = [take_sample(0.0, 0)]
+    try:
+        for i in range(total_frames):
+            trip["time"] = i / args.fps
+
+            frame = video_frames[i % len(video_frames)]
+            frame.pts = round(trip["time"] / TIME_BASE)
+            frame.time_base = TIME_BASE
+
+            # The simulated frames are never late, the gate runs on the trip clock
+            if age_gate.admit(frame.time, trip["time"]):
+                _, play_alarm = frame_path(frame, trip_thresholds, now=age_gate.frame_time(frame.time))
+                alarms += play_alarm and not alarm_on
+                alarm_on = play_alarm
+                alarm_signal.publish(play_alarm)
+
+                if video_handler.row_dict:
+                    metrics_bus.publish(video_handler.row_dict)
+
+            audio_due += audio_per_frame
+            while audio_due >= 1.0:
+                audio_due -= 1.0
+                play_alarm, _ = alarm_signal.read()
+                audio_handler.process(audio_frames[audio_sent % len(audio_frames)], play_sound=play_alarm)
+                audio_sent += 1
+
+            if (i + 1) % sample_every == 0:
+                samples.append(take_sample(trip["time"], i + 1))
+                print_sample(samples[-1], samples[0], file=sys.stderr)
+    finally:
+        dropped = {subscription.name: subscription.dropped for subscription in metrics_bus.subscriptions}
+        metrics_bus.close()
+        storage.close()
+        video_handler.close()
+
+    return samples, alarms, dropped
+
+
+def print_sample(sample, first, file=sys.stdout):
+    elapsed = sample["wall_seconds"] - first["wall_seconds"]
+    speedup = sample["trip_minutes"] * 60.0 / elapsed if elapsed > 0 else 0.0
+    print(f"{sample['trip_minutes']:8.0f} min  rss {sample['rss_mb']:8.1f} MB  objects {sample['objects']:9d}  "
+          f"fds {sample['fds'] if sample['fds'] is not None else '-':>4}  ({speedup:.0f}x real time)", file=file)
+
+
+def evaluate(samples, alarms, args):
+    """
+    Compare the growth after warm-up with the budgets, and check the alarm was raised.
+
+    Returns:
+        result: (dict) Growth of each measure, RSS growth per trip hour,
+                       the failed checks and whether the soak passed.
+    """
+    baseline = next((s for s in samples if s["trip_minutes"] >= args.warmup_minutes), samples[0])
+    last = samples[-1]
+    after = [s for s in samples if s["trip_minutes"] >= baseline["trip_minutes"]]
+
+    result = {
+        "baseline_minutes": baseline["trip_minutes"],
+        "rss_growth_mb": last["rss_mb"] - baseline["rss_mb"],
+        "objects_growth": last["objects"] - baseline["objects"],
+        "fds_growth": None if last["fds"] is None else last["fds"] - baseline["fds"],
+        "rss_mb_per_hour": None,
+    }
+    if len(after) >= 3:
+        hours = np.array([s["trip_minutes"] / 60.0 for s in after])
+        result["rss_mb_per_hour"] = float(np.polyfit(hours, [s["rss_mb"] for s in after], 1)[0])
+
+    failures = []
+    if result["rss_growth_mb"] > args.rss_budget:
+        failures.append(f"RSS grew {result['rss_growth_mb']:.1f} MB (budget {args.rss_budget:g} MB)")
+    if result["objects_growth"] > args.objects_budget:
+        failures.append(f"{result['objects_growth']} more objects (budget {args.objects_budget})")
+    if result["fds_growth"] is not None and result["fds_growth"] > args.fd_budget:
+        failures.append(f"{result['fds_growth']} more open file descriptors (budget {args.fd_budget})")
+    if len(after) < 2:
+        failures.append(f"no samples after the {args.warmup_minutes:g} min warm-up, run a longer trip")
+    if alarms == 0:
+        failures.append("the alarm was never raised, the alarm and alarm audio paths did not run")
+
+    result["failures"] = failures
+    result["passed"] = not failures
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test the D3F pipeline over a simulated long trip")
+    parser.add_argument("--hours", type=float, default=4.0, help="simulated trip length (default: 4)")
+    parser.add_argument("--fps", type=float, default=30.0, help="simulated camera frame rate (default: 30)")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--sample-minutes", type=float, default=10.0, help="trip minutes between memory samples (default: 10)")
+    parser.add_argument("--warmup-minutes", type=float, default=10.0, help="trip minutes before the baseline sample (default: 10)")
+    parser.add_argument("--rss-budget", type=float, default=32.0, help="allowed RSS growth after warm-up in MB (default: 32)")
+    parser.add_argument("--objects-budget", type=int, default=10000, help="allowed growth of gc-tracked objects after warm-up (default: 10000)")
+    parser.add_argument("--fd-budget", type=int, default=2, help="allowed growth of open file descriptors after warm-up (default: 2)")
+    parser.add_argument("--mysql", action="store_true", help="store the trip with TripWriter in the configured database instead of SQLite")
+    parser.add_argument("--json", help="write the samples and the verdict to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    samples, alarms, dropped = run_soak(args)
+    result = evaluate(samples, alarms, args)
+    result["alarms"] = alarms
+    result["bus_dropped"] = dropped
+
+    print(f"{args.hours:g} h trip at {args.fps:g} fps, {samples[-1]['frames']} frames, {alarms} alarms")
+    if any(dropped.values()):
+        print("metrics bus drops: " + ", ".join(f"{name} {count}" for name, count in dropped.items()))
+    print(f"after {result['baseline_minutes']:.0f} min: RSS {result['rss_growth_mb']:+.1f} MB"
+          + (f" ({result['rss_mb_per_hour']:+.2f} MB/h)" if result["rss_mb_per_hour"] is not None else "")
+          + f", objects {result['objects_growth']:+d}"
+          + (f", fds {result['fds_growth']:+d}" if result["fds_growth"] is not None else ""))
+    print("PASSED" if result["passed"] else "FAILED: " + "; ".join(result["failures"]))
+
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key != "json"}
+        with open(args.json, "w") as f:
+            json.dump({"created": time.time(), "config": config, "samples": samples, "result": result}, f, indent=2)
+
+    sys.exit(0 if result["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
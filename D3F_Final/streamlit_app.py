@@ -1,25 +1,41 @@
+import datetime
 import os
-import av
-import pandas as pd
-import threading
+import tempfile
+import time
 import streamlit as st
-#import datetime
 #import streamlit_nested_layout
-import pymysql
-from streamlit_webrtc import VideoHTMLAttributes, webrtc_streamer
-from pymysql.cursors import DictCursor
-from audio_handling import AudioFrameHandler
-from drowsy_detection import VideoFrameHandler
-import plotly.express as px
-import plotly.graph_objects as go
-
-# Add your database credentials here
-db_credentials = {
-    "host": "localhost",
-    "user": "root",
-    "password": "mysql",
-    "database": "d3f",
-}
+# pandas, plotly, av, streamlit_webrtc and the detection pipeline are imported
+# by the pages that use them; the model itself is built by the warm-up thread.
+import warmup
+from alarm_signal import AlarmSignal
+from backpressure import FrameAgeGate
+from calibration import ThresholdCalibrator
+from capture_profile import MAX_PROFILE, MIN_PROFILE, CaptureProfileManager, parse_profile
+from instrumentation import metrics, start_http_server
+from metrics_bus import DROP_NEWEST, MetricsBus
+from retention import RETENTION_DAYS, RetentionJob, format_report
+from trip_export import FORMATS, export_file_name, export_trips, get_trips_in_range
+from trip_storage import (
+    DISPLAY_TZ,
+    TripWriter,
+    backfill_trip_summaries,
+    create_database,
+    create_summary_table,
+    create_table,
+    db_credentials,
+    delete_table,
+    ensure_timestamp_index,
+    format_trip_name,
+    get_driver_statistics,
+    get_driver_thresholds,
+    get_ear_distribution,
+    get_trip_page,
+    load_trip_overview,
+    load_trip_window,
+    save_driver_thresholds,
+    write_trip_overview,
+    write_trip_summary,
+)
 
 #Change threshold values if needed 
 thresholds = {
@@ -28,129 +44,336 @@ thresholds = {
         "WAIT_TIME": 4.0
     }
 
-#function to get tables names for the drop down menu
-def get_table_names():
-    connection = pymysql.connect(**db_credentials, cursorclass=DictCursor)
-    try:
-        with connection.cursor() as cursor:
-            sql = f"""
-            SELECT table_name FROM information_schema.tables 
-            WHERE table_type = 'BASE TABLE' AND table_schema='{db_credentials['database']}' 
-            ORDER BY table_name desc;
-            """
-            cursor.execute(sql)
-            tables = [row["TABLE_NAME"] for row in cursor.fetchall()]
-    finally:
-        connection.close()
-
-    formatted_tables = []
-    for table in tables:
-        year = table[5:9]
-        month = table[9:11]
-        day = table[11:13]
-        hour = table[13:15]
-        minute = table[15:17]
-        second = table[17:19]
-        formatted_table = f"Trip {month}/{day}/{year} {hour}:{minute}:{second}"
-        formatted_tables.append(formatted_table)
-    
-    return dict(zip(formatted_tables,tables))
+#Trip dashboard: seconds shown at full resolution when a trip is opened, and the longest window the zoom slider allows
+ZOOM_WINDOW = 300
+MAX_ZOOM_WINDOW = 1800
 
+#Series longer than this are rendered with WebGL traces on the dashboard
+WEBGL_MIN_POINTS = 1000
 
-#function to load data from table elected from the drop down menu
-def load_data_from_table(table_name):
-    connection = pymysql.connect(**db_credentials, cursorclass=DictCursor)
-    try:
-        with connection.cursor() as cursor:
-            sql = f"SELECT * FROM {table_name}"
-            cursor.execute(sql)
-            data = cursor.fetchall()
-    finally:
-        connection.close()
+#Number of trips loaded at a time in the trip selector
+TRIPS_PER_PAGE = 20
 
-    return pd.DataFrame(data)
+#Live in-trip charts: seconds of history shown, refresh period and points drawn per chart
+LIVE_WINDOW = 300
+LIVE_REFRESH_SECONDS = 1.0
+LIVE_MAX_POINTS = 600
 
+#Size of the in-memory ring buffer behind the live charts (LIVE_WINDOW at 30 fps)
+LIVE_BUFFER_SIZE = LIVE_WINDOW * 30
 
-#function to delete table from backend database
-def delete_table(table_name):
-    connection = pymysql.connect(**db_credentials, cursorclass=DictCursor)
-    try:
-        with connection.cursor() as cursor:
-            sql = f"DROP TABLE {table_name}"
-            cursor.execute(sql)
-            connection.commit()
-    finally:
-        connection.close()
-
-
-#function for creating the dashboard using data from the selected table
-def create_dashboard(data):
-    # Convert the timestamp to a pandas datetime object
-    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s').dt.tz_localize('UTC').dt.tz_convert('US/Eastern').dt.strftime('%H:%M:%S.%f')
-
-    # EAR time series plot
-    fig_ear = px.line(data, x='timestamp', y='EAR', title='Eye Aspect Ratio (EAR) over Time')
-    fig_ear.add_trace(go.Scatter(x=data['timestamp'], y=[thresholds["EAR_THRESH"]]*len(data), mode='lines', name='Threshold'))
+#Samples the trip writer may queue while the database is slow (5 min at 30 fps), newer ones are dropped beyond that
+STORAGE_QUEUE_SIZE = 5 * 60 * 30
+
+#Frames older than this (in seconds) when they reach the server are skipped before inference
+LATENCY_BUDGET = float(os.environ.get("D3F_LATENCY_BUDGET", 0.3))
+
+#Port of the Prometheus metrics endpoint (http://host:METRICS_PORT/metrics)
+METRICS_PORT = int(os.environ.get("D3F_METRICS_PORT", 9108))
+
+#Capture profiles requested from the browsers, as WIDTHxHEIGHT@FPS (see capture_profile.py)
+CAPTURE_MIN_PROFILE = parse_profile(os.environ.get("D3F_MIN_PROFILE", "{}x{}@{}".format(*MIN_PROFILE)))
+CAPTURE_MAX_PROFILE = parse_profile(os.environ.get("D3F_MAX_PROFILE", "{}x{}@{}".format(*MAX_PROFILE)))
+
+#Directory of the landmark recordings made for replay.py
+RECORDINGS_DIR = os.environ.get("D3F_RECORDINGS_DIR", os.path.join(os.path.dirname(__file__), "recordings"))
+
+#function for building a time series figure that stays responsive on long trips
+def time_series_figure(data, y, title, threshold=None):
+    import plotly.express as px
+
+    # Large series are drawn with WebGL (scattergl) instead of one SVG node per point
+    render_mode = "webgl" if len(data) > WEBGL_MIN_POINTS else "svg"
+    fig = px.line(data, x='timestamp', y=y, title=title, render_mode=render_mode)
+
+    # A constant reference line instead of a threshold series as long as the trip
+    if threshold is not None:
+        fig.add_hline(y=threshold, line_dash="dash", line_color="red", annotation_text="Threshold")
+
+    fig.update_xaxes(type="date", tickformat="%H:%M:%S")
+    return fig
+
+
+#function for building the label shown for a trip in the drop down menu
+def trip_label(summary):
+    label = format_trip_name(summary["table_name"])
+    minutes = (summary["duration"] or 0) / 60
+    return f"{label} ({minutes:.0f} min, {summary['alarm_counter'] or 0} alarms)"
+
+
+#function for converting epoch timestamps to a datetime axis, the timezone only changes how it is displayed
+def to_display_time(data):
+    import pandas as pd
+
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s', utc=True).dt.tz_convert(DISPLAY_TZ)
+    return data
+
+
+#function for showing the whole trip from its downsampled overview
+def create_overview(overview):
+    st.subheader("Trip Overview")
+    overview = to_display_time(overview)
+
+    fig_ear = time_series_figure(overview, 'EAR', 'Mean Eye Aspect Ratio (EAR) over the Trip', thresholds["EAR_THRESH"])
     st.plotly_chart(fig_ear)
-    
-    # MAR time series plot
-    fig_mar = px.line(data, x='timestamp', y='MAR', title='Mouth Aspect Ratio (MAR) over Time')
-    fig_mar.add_trace(go.Scatter(x=data['timestamp'], y=[thresholds["MAR_THRESH"]]*len(data), mode='lines', name='Threshold'))
-    st.plotly_chart(fig_mar)
 
-    # Alarm_behaviour time series plot
-    fig_alarm = px.line(data, x='timestamp', y='alarm_on', title='Alarm Behaviour over Time')
+    fig_alarm = time_series_figure(overview, 'alarm_on', 'Alarm over the Trip')
     st.plotly_chart(fig_alarm)
 
+
+#function for choosing the window of the trip shown at full resolution, returns its epoch start and end times
+def create_zoom_slider(table_name, summary):
+    import pandas as pd
+
+    # The slider works on local wall-clock times, offsets from the trip start map them back to epoch times
+    trip_start = pd.Timestamp(summary["start_time"], unit='s', tz='UTC').tz_convert(DISPLAY_TZ).tz_localize(None).to_pydatetime()
+    trip_end = trip_start + datetime.timedelta(seconds=max(1.0, summary["end_time"] - summary["start_time"]))
+    window = (trip_start, min(trip_end, trip_start + datetime.timedelta(seconds=ZOOM_WINDOW)))
+
+    window = st.slider("Zoom window:", min_value=trip_start, max_value=trip_end, value=window,
+                       step=datetime.timedelta(seconds=1), format="HH:mm:ss", key=f"zoom_{table_name}")
+    start_time = summary["start_time"] + (window[0] - trip_start).total_seconds()
+    end_time = summary["start_time"] + (window[1] - trip_start).total_seconds()
+
+    if end_time - start_time > MAX_ZOOM_WINDOW:
+        st.caption(f"Showing the first {MAX_ZOOM_WINDOW // 60} minutes of the window, zoom in further to see the rest at full resolution.")
+        end_time = start_time + MAX_ZOOM_WINDOW
+
+    # Up to and including the last second of the window
+    return start_time, end_time + 1.0
+
+
+#function for creating the dashboard of the selected trip: its overview, the zoomed window and its summary record
+def create_dashboard(table_name, overview, summary):
+    create_overview(overview)
+
+    # Only the visible window is queried, through the timestamp index
+    start_time, end_time = create_zoom_slider(table_name, summary)
+    data = load_trip_window(table_name, start_time, end_time)
+
+    st.subheader("Zoomed Window")
+    if data.empty:
+        st.write("No samples in this window")
+    else:
+        data = to_display_time(data)
+
+        # EAR time series plot
+        fig_ear = time_series_figure(data, 'EAR', 'Eye Aspect Ratio (EAR) over Time', thresholds["EAR_THRESH"])
+        st.plotly_chart(fig_ear)
+    
+        # MAR time series plot
+        fig_mar = time_series_figure(data, 'MAR', 'Mouth Aspect Ratio (MAR) over Time', thresholds["MAR_THRESH"])
+        st.plotly_chart(fig_mar)
+
+        # PERCLOS time series plot (trips recorded before it was stored have no such column)
+        if 'perclos' in data:
+            fig_perclos = time_series_figure(data, 'perclos', 'PERCLOS over the last minute (%)')
+            st.plotly_chart(fig_perclos)
+
+        # Alarm_behaviour time series plot
+        fig_alarm = time_series_figure(data, 'alarm_on', 'Alarm Behaviour over Time')
+        st.plotly_chart(fig_alarm)
+
+    create_trip_summary(summary)
+
+
+#function for showing the summary record of a trip, all that is left of a compacted trip
+def create_trip_summary(summary):
+    # Trip duration and fatigue indicators
+    st.subheader("Trip Summary")
+    st.write(f"Duration: {summary['duration'] / 60:.1f} minutes")
+    st.write(f"PERCLOS: {summary['perclos']:.1f}% of the time with eyes closed")
+    st.write(f"Longest Eye Closure: {summary['longest_eye_closure']:.2f} seconds")
+    st.write(f"Mean EAR: {summary['mean_ear']:.3f}")
+
     # Eye shut counter and yawn counter
     st.subheader("Eye Shut & Yawn Counters")
-    st.write(f"Eye Shut Counter: {data['eye_shut_counter'].max()}")
-    st.write(f"Yawn Counter: {data['yawn_counter'].max()}")
+    st.write(f"Eye Shut Counter: {summary['eye_shut_counter']}")
+    st.write(f"Yawn Counter: {summary['yawn_counter']}")
 
     # Alarm count
     st.subheader("Alarm Count")
-    st.write(f"Alarm triggered {data['alarm_counter'].max()} times during the trip")
+    st.write(f"Alarm triggered {summary['alarm_counter']} times during the trip")
+    st.write(f"Alarm sounded for {summary['alarm_time']:.1f} seconds in total")
+
+
+#function for exporting the selected trip, or the trips in the date range, to a compressed file for download
+def create_export(selected_table, start_time, end_time):
+    st.subheader("Export")
+    fmt = st.radio("Format:", FORMATS, format_func=lambda name: "CSV (gzip)" if name == "csv" else "Parquet", horizontal=True)
+    scopes = ["Selected trip"] + (["All trips in the date range"] if start_time is not None else [])
+    scope = st.radio("Trips:", scopes, horizontal=True)
+
+    if st.button("Prepare export"):
+        table_names = [selected_table] if scope == scopes[0] else get_trips_in_range(start_time, end_time)
+
+        # Streamed to a temporary file in chunks, only the compressed file is handed to the browser
+        # and the file is removed as soon as the download button holds it
+        f = tempfile.NamedTemporaryFile(prefix="d3f-export-", delete=False)
+        try:
+            try:
+                rows = export_trips(table_names, f, fmt)
+            except RuntimeError as e:
+                # pyarrow is not installed
+                st.error(str(e))
+                return
+            f.seek(0)
+            file_name = export_file_name(table_names, fmt)
+            st.download_button(f"Download {file_name} ({rows} samples of {len(table_names)} trips)", f, file_name=file_name)
+        finally:
+            f.close()
+            os.remove(f.name)
+
+
+#function for creating the fleet analytics view for trips started between two dates
+def create_analytics(start_date, end_date):
+    import pandas as pd
+    import plotly.express as px
+
+    start_time = pd.Timestamp(start_date, tz=DISPLAY_TZ).timestamp()
+    end_time = (pd.Timestamp(end_date, tz=DISPLAY_TZ) + pd.Timedelta(days=1)).timestamp()
+
+    # Per-driver rates, aggregated by the database over the trip summaries
+    statistics = get_driver_statistics(start_time, end_time)
+    if statistics.empty:
+        st.write("No trips in the selected date range")
+        return
+
+    st.subheader("Drivers")
+    st.dataframe(statistics.round(2))
+
+    fig_rates = px.bar(statistics, x='driver', y=['alarms_per_hour', 'yawns_per_hour'], barmode='group', title='Alarms and Yawns per Hour')
+    st.plotly_chart(fig_rates)
+
+    # EAR distribution by hour of day, aggregated over the per-trip rollups
+    driver = st.selectbox("EAR distribution for:", ["All drivers"] + statistics['driver'].tolist())
+    distribution = get_ear_distribution(start_time, end_time, None if driver == "All drivers" else driver)
+
+    fig_ear = px.density_heatmap(distribution, x='hour_of_day', y='EAR', z='samples', histfunc='sum',
+                                 nbinsx=24, title='EAR Distribution by Hour of Day')
+    fig_ear.add_hline(y=thresholds["EAR_THRESH"], line_dash="dash", line_color="red", annotation_text="Threshold")
+    st.plotly_chart(fig_ear)
 
 
-#function for creating a backend database based on the credentials in the db_credentials dictionary
-def create_database(db_name):
-    credentials= {"host": db_credentials["host"], "user": db_credentials["user"], "password": db_credentials["password"]}
-    connection = pymysql.connect(**credentials, cursorclass=DictCursor)
+#function for drawing the live charts of the last LIVE_WINDOW seconds from the ring buffer
+def create_live_panel(live_buffer, placeholder):
+    import pandas as pd
+
+    window = live_buffer.snapshot(since=time.time() - LIVE_WINDOW)
+    if len(window["timestamp"]) == 0:
+        placeholder.write("Waiting for data...")
+        return
+
+    # Thin the window out so every refresh sends a bounded number of points
+    step = max(1, len(window["timestamp"]) // LIVE_MAX_POINTS)
+    data = pd.DataFrame({column: values[::step] for column, values in window.items()})
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s', utc=True).dt.tz_convert(DISPLAY_TZ)
+    data = data.set_index('timestamp')
+
+    with placeholder.container():
+        st.line_chart(data[['EAR', 'MAR']])
+        st.area_chart(data[['alarm_on']])
+
+
+#function for creating the admin view of the hot-path metrics
+def create_admin_view():
+    import pandas as pd
+
+    if not metrics.enabled:
+        st.write("Instrumentation is disabled (D3F_METRICS=0)")
+        return
+
+    now = time.perf_counter()
+    previous, previous_time = st.session_state.get("metrics_previous", ({}, now))
+
+    histograms = []
+    counters = []
+    current = {}
+    for metric in metrics.metrics():
+        labels = ", ".join(f"{key}={value}" for key, value in metric.labels.items())
+        if metric.kind == "histogram":
+            histograms.append({
+                "metric": metric.name,
+                "labels": labels,
+                "count": metric.count,
+                "mean ms": metric.sum / metric.count * 1000 if metric.count else 0.0,
+                "p50 ms": metric.quantile(0.50) * 1000,
+                "p95 ms": metric.quantile(0.95) * 1000,
+                "p99 ms": metric.quantile(0.99) * 1000,
+            })
+        else:
+            key = (metric.name, labels)
+            current[key] = metric.value
+            elapsed = now - previous_time
+            rate = (metric.value - previous[key]) / elapsed if key in previous and elapsed > 0 else None
+            counters.append({"metric": metric.name, "labels": labels, "value": metric.value, "per second": rate})
+
+    # Counter rates (e.g. frames per second per session) are measured between refreshes
+    st.session_state.metrics_previous = (current, now)
+
+    st.subheader("Latency Histograms")
+    st.dataframe(pd.DataFrame(histograms).round(3))
+    st.subheader("Counters")
+    st.dataframe(pd.DataFrame(counters).round(2))
+
+    # Host-wide capture profile and the load of each session (share of its CPU entitlement)
+    capture_manager = get_capture_manager()
+    profile = capture_manager.profile
+    st.subheader("Capture Profile")
+    st.write(f"New streams request {profile.width}x{profile.height} at {profile.fps} fps "
+             f"(step {capture_manager.level + 1} of {len(capture_manager.ladder)})")
+    loads = dict(capture_manager.loads)
+    if loads:
+        st.dataframe(pd.DataFrame({"session": list(loads), "load": list(loads.values())}).round(2))
+
+    st.subheader("Retention")
+    report = start_retention_job().last_report
+    st.write(f"Raw samples are kept for {RETENTION_DAYS:g} days, then trips are compacted to their summaries.")
+    if report is not None:
+        st.write(f"Last run {time.strftime('%Y-%m-%d %H:%M', time.localtime(report['started']))}: {format_report(report)}")
+
+    exposition = metrics.render_prometheus()
+    st.subheader("Prometheus Exposition")
+    st.write(f"Scraped at http://<host>:{METRICS_PORT}/metrics")
+    st.download_button("Download metrics", exposition, file_name="metrics.txt")
+    st.code(exposition, language="text")
+
+
+#function for starting the Prometheus endpoint once per server process
+@st.cache_resource
+def start_metrics_server():
+    if not metrics.enabled:
+        return None
     try:
-        with connection.cursor() as cursor:
-            sql= f"CREATE DATABASE IF NOT EXISTS {db_name}"
-            cursor.execute(sql)
-            connection.commit()
-    finally:
-        connection.close()
+        return start_http_server(METRICS_PORT)
+    except OSError:
+        # Another server process on this host already exposes the port
+        return None
 
 
-#Function for creating a new table to collect trip data
-def create_table():
-    connection = pymysql.connect(**db_credentials, cursorclass=DictCursor)
-    try:
-        with connection.cursor() as cursor:
-            # Create a unique table name
-            table_name = f"trip_{pd.Timestamp.now().strftime('%Y%m%d%H%M%S')}"
-            # Create the table
-            sql_create = f"""
-            CREATE TABLE {table_name} (
-                timestamp DOUBLE,
-                EAR DOUBLE,
-                MAR DOUBLE,
-                eye_shut_counter INT,
-                yawn_counter INT,
-                alarm_counter INT,
-                alarm_on BOOLEAN
-            )
-            """
-            cursor.execute(sql_create)
-            connection.commit()
-
-    finally:
-        connection.close()
-    
-    st.session_state.curr_table_name = table_name
+#function for getting the capture profile policy shared by every session of the server process
+@st.cache_resource
+def get_capture_manager():
+    return CaptureProfileManager(min_profile=CAPTURE_MIN_PROFILE, max_profile=CAPTURE_MAX_PROFILE)
+
+
+#function for creating the database and the summary tables once per server process
+@st.cache_resource
+def prepare_database():
+    create_database(db_credentials["database"])
+    create_summary_table()
+
+
+#function for starting the background trip compaction once per server process
+@st.cache_resource
+def start_retention_job():
+    return RetentionJob()
+
+
+#function for starting the pipeline warm-up once per server process
+@st.cache_resource
+def start_warmup():
+    warmup.start(alarm_file_path)
 
 
 # Define the audio file to use.
@@ -168,6 +391,9 @@ st.set_page_config(
     },
 )
 
+start_metrics_server()
+start_warmup()
+
 # preserving important variables for the duration of the session
 if "main_state" not in st.session_state:
     st.session_state.main_state = True
@@ -184,19 +410,134 @@ if "curr_table_name" not in st.session_state:
 if "selected" not in st.session_state:
     st.session_state.selected = str()
 
+if "trip_cursors" not in st.session_state:
+    st.session_state.trip_cursors = [None]
+
+if "trip_filters" not in st.session_state:
+    st.session_state.trip_filters = None
+
+if "backfilled" not in st.session_state:
+    st.session_state.backfilled = False
+
+if "live_buffer" not in st.session_state:
+    st.session_state.live_buffer = None
+
+if "trip_writer" not in st.session_state:
+    st.session_state.trip_writer = None
+
+if "p4" not in st.session_state:
+    st.session_state.p4 = False
+
+if "p5" not in st.session_state:
+    st.session_state.p5 = False
+
+if "driver" not in st.session_state:
+    st.session_state.driver = str()
+
+if "record_landmarks" not in st.session_state:
+    st.session_state.record_landmarks = False
+
+if "landmark_recorder" not in st.session_state:
+    st.session_state.landmark_recorder = None
+
+if "trip_thresholds" not in st.session_state:
+    st.session_state.trip_thresholds = dict(thresholds)
+
+if "calibrator" not in st.session_state:
+    st.session_state.calibrator = None
+
+if "trip_pipeline" not in st.session_state:
+    st.session_state.trip_pipeline = None
+
+
+#function for building the frame pipeline of a trip once, reruns of the page reuse it
+def get_trip_pipeline(session):
+    from audio_handling import AudioFrameHandler
+    from drowsy_detection import VideoFrameHandler
+    from frame_path import FramePath
+
+    pipeline = st.session_state.trip_pipeline
+    if pipeline is None or pipeline["session"] != session:
+        release_trip_pipeline()
+
+        # Consumers of the per-frame metrics, each behind its own bounded queue and thread
+        metrics_bus = MetricsBus(session)
+        # Storage only hands samples on to the trip writer, whose queue of STORAGE_QUEUE_SIZE absorbs a slow database
+        metrics_bus.subscribe("storage", st.session_state.trip_writer.write, overflow=DROP_NEWEST)
+        metrics_bus.subscribe("live_charts", st.session_state.live_buffer.append)
+
+        # Thresholds of this trip, replaced by the calibrated ones once calibration is over
+        calibrator = st.session_state.calibrator
+        trip_thresholds = st.session_state.trip_thresholds
+        if calibrator is not None:
+            def calibrate(row):
+                if not calibrator.done and calibrator.update(row["EAR"], row["MAR"], row["timestamp"]):
+                    trip_thresholds.update(calibrator.result(trip_thresholds) or {})
+
+            metrics_bus.subscribe("calibration", calibrate)
+
+        # Using a FaceMesh graph prepared by the warm-up when one is ready
+        video_handler = VideoFrameHandler(session=session, facemesh_model=warmup.take_facemesh(), recorder=st.session_state.landmark_recorder)
+        pipeline = {
+            "session": session,
+            "video_handler": video_handler,
+            "audio_handler": AudioFrameHandler(sound_file_path=alarm_file_path, session=session),
+            # One RGB conversion per frame, overlay drawn into reused output frames
+            "frame_path": FramePath(video_handler),
+            # Alarm state published by the video callback and read lock-free by the audio callback
+            "alarm_signal": AlarmSignal(session),
+            # Skips frames that waited longer than LATENCY_BUDGET so the alarm follows the freshest frame
+            "age_gate": FrameAgeGate(LATENCY_BUDGET),
+            "frame_timing": {"last": None, "interval": None, "processed": None},
+            "metrics_bus": metrics_bus,
+        }
+        st.session_state.trip_pipeline = pipeline
+
+    return pipeline
+
+
+#function for releasing the frame pipeline (and its FaceMesh graph) when the trip ends
+def release_trip_pipeline():
+    pipeline = st.session_state.trip_pipeline
+    st.session_state.trip_pipeline = None
+    if pipeline is not None:
+        pipeline["metrics_bus"].close()  # Hands the queued samples to the trip writer
+        pipeline["video_handler"].close()
+
 
 #Home page for d3f.io app
 def main():
     st.title("D3F.io")
     st.subheader("Driver Drowsiness Detection and Feedback")
 
+    st.session_state.driver = st.text_input("Driver:", st.session_state.driver)
+    st.session_state.record_landmarks = st.checkbox("Record landmarks for threshold tuning (replay.py)", st.session_state.record_landmarks)
+
     prev_trip = st.button("View Previous Trips")
     start_trip = st.button("Start New Trip") 
+    analytics = st.button("Fleet Analytics")
+    admin = st.button("Admin")
     
-    create_database(db_credentials["database"])
+    prepare_database()
+    start_retention_job()
 
     if start_trip:
-        create_table()
+        from live_metrics import MetricsRingBuffer
+
+        st.session_state.curr_table_name = create_table()
+        st.session_state.live_buffer = MetricsRingBuffer(LIVE_BUFFER_SIZE)
+        st.session_state.trip_writer = TripWriter(st.session_state.curr_table_name, max_queue=STORAGE_QUEUE_SIZE)
+
+        # Start from the driver's calibrated thresholds if any, and calibrate again at the start of this trip
+        driver = st.session_state.driver or None
+        st.session_state.trip_thresholds = (driver and get_driver_thresholds(driver, thresholds)) or dict(thresholds)
+        st.session_state.calibrator = ThresholdCalibrator() if driver else None
+        st.session_state.landmark_recorder = None
+        if st.session_state.record_landmarks:
+            from landmark_log import LandmarkRecorder
+
+            recording_path = os.path.join(RECORDINGS_DIR, f"{st.session_state.curr_table_name}.d3fl")
+            st.session_state.landmark_recorder = LandmarkRecorder(recording_path, clock_offset=time.time() - time.perf_counter())
         st.session_state.p2 = True
         st.session_state.main_state = False
         st.session_state.p3 = False
@@ -207,100 +548,237 @@ def main():
         st.session_state.p2 = False
         st.experimental_rerun()
 
+    if analytics:
+        st.session_state.p4 = True
+        st.session_state.main_state = False
+        st.experimental_rerun()
+
+    if admin:
+        st.session_state.p5 = True
+        st.session_state.main_state = False
+        st.experimental_rerun()
+
 #page containing the real time feedback system
 def page2():
 
+    import av
+    from streamlit_webrtc import VideoHTMLAttributes, webrtc_streamer
+
     st.title("Drowsiness Detection")
     
-    # For streamlit-webrtc
-    video_handler = VideoFrameHandler()
-    audio_handler = AudioFrameHandler(sound_file_path=alarm_file_path)
-    
-    # For thread-safe access & to prevent race-condition.
-    lock = threading.Lock()  
-    
-    #dictionary to pass necessary data between frames using threading.lock()
-    shared_state = {"play_alarm": False, "connection": pymysql.connect(**db_credentials, cursorclass=DictCursor), "table_name": st.session_state.curr_table_name}
+    # For streamlit-webrtc, built on the first run of the trip and reused by every rerun
+    session = st.session_state.curr_table_name
+    landmark_recorder = st.session_state.landmark_recorder
+    pipeline = get_trip_pipeline(session)
+    video_handler = pipeline["video_handler"]
+    audio_handler = pipeline["audio_handler"]
+    frame_path = pipeline["frame_path"]
+
+    # Filled through the metrics bus, read by the live charts (no database reads)
+    live_buffer = st.session_state.live_buffer
+
+    # Inserts samples from its own thread, off the video and audio paths
+    trip_writer = st.session_state.trip_writer
+
+    # Per-frame metrics are published once, storage, live charts and calibration consume them from their own threads
+    metrics_bus = pipeline["metrics_bus"]
+
+    # Thresholds of this trip, replaced by the calibrated ones once calibration is over
+    trip_thresholds = st.session_state.trip_thresholds
+    calibrator = st.session_state.calibrator
+
+    alarm_signal = pipeline["alarm_signal"]
+
+    # Hot-path metrics of this session (no-ops when instrumentation is disabled)
+    video_callback_metric = metrics.histogram("d3f_video_callback_seconds", "Video frame callback time", session=session)
+    audio_callback_metric = metrics.histogram("d3f_audio_callback_seconds", "Audio frame callback time", session=session)
+    alarm_age_metric = metrics.histogram("d3f_alarm_signal_age_seconds", "Age of the alarm state read by the audio callback", session=session)
+    dropped_metric = metrics.counter("d3f_video_frames_dropped_total", "Video frames missing from the received stream", session=session)
+    stale_metric = metrics.counter("d3f_video_frames_stale_total", "Video frames skipped for exceeding the latency budget", session=session)
+    frame_timing = pipeline["frame_timing"]
+    age_gate = pipeline["age_gate"]
+
+    # Host-wide capture profile: requested from the browser, and its frame rate enforced on running streams
+    capture_manager = get_capture_manager()
+    session_load = capture_manager.register(session)
+    rate_limited_metric = metrics.counter("d3f_video_frames_rate_limited_total", "Video frames skipped above the capture profile frame rate", session=session)
     
     def video_frame_callback(frame: av.VideoFrame):
-        frame = frame.to_ndarray(format="bgr24")  # Decode and convert frame to RGB
-        frame, play_alarm = video_handler.process(frame, thresholds)  # Process frame
-
-        with lock:
-            shared_state["play_alarm"] = play_alarm  # Update shared state
-            
-            #insert data into mysql table
-            if video_handler.row_dict:
-                sql_insert = f"""
-                    INSERT INTO {shared_state["table_name"]}
-                    (timestamp, EAR, MAR, eye_shut_counter, yawn_counter, alarm_counter, alarm_on)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """
-                shared_state["connection"].cursor().execute(sql_insert, list(video_handler.row_dict.values()))
-                shared_state["connection"].commit() 
-        
-        # Encode and return BGR frame
-        return av.VideoFrame.from_ndarray(frame, format="bgr24")  
+        callback_start = time.perf_counter()
+
+        # Frames skipped upstream show up as gaps in the media timestamps
+        if frame.time is not None:
+            if frame_timing["last"] is not None:
+                gap = frame.time - frame_timing["last"]
+                if gap > 0:
+                    frame_timing["interval"] = min(gap, frame_timing["interval"] or gap)
+                    dropped_metric.inc(max(0, round(gap / frame_timing["interval"]) - 1))
+            frame_timing["last"] = frame.time
+
+        # Frames above the profile's frame rate are not decoded either
+        if frame.time is not None and frame_timing["processed"] is not None:
+            if frame.time - frame_timing["processed"] < capture_manager.frame_interval() * 0.9:
+                rate_limited_metric.inc()
+                return frame_path.repeat(frame)
+
+        # Stale frames are not decoded or processed, the last output frame is shown again
+        frame_time = None
+        if frame.time is not None:
+            if not age_gate.admit(frame.time, callback_start):
+                stale_metric.inc()
+                return frame_path.repeat(frame)
+            frame_time = age_gate.frame_time(frame.time)
+            frame_timing["processed"] = frame.time
+
+        new_frame, play_alarm = frame_path(frame, trip_thresholds, now=frame_time)  # Convert to RGB, process and draw
+
+        alarm_signal.publish(play_alarm)  # Update alarm state
+
+        if video_handler.row_dict:
+            metrics_bus.publish(video_handler.row_dict)  # Never waits for a consumer
+
+        callback_time = time.perf_counter() - callback_start
+        session_load.record(callback_time)
+        video_callback_metric.observe(callback_time)
+        return new_frame
     
     def audio_frame_callback(frame: av.AudioFrame):
-        with lock:  # access the current “play_alarm” state
-            play_alarm = shared_state["play_alarm"]
+        callback_start = time.perf_counter()
+        play_alarm, age = alarm_signal.read()  # access the current “play_alarm” state
+        alarm_age_metric.observe(age)
     
         new_frame: av.AudioFrame = audio_handler.process(frame, play_sound=play_alarm)
+        audio_callback_metric.observe(time.perf_counter() - callback_start)
         return new_frame
 
 
-    with shared_state["connection"].cursor():    
-        ctx = webrtc_streamer(
-            key="driver-drowsiness-detection",
-            video_frame_callback=video_frame_callback,
-            audio_frame_callback=audio_frame_callback,
-            rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
-            #media_stream_constraints={"video": {"width": True, "audio": True}},
-            video_html_attrs=VideoHTMLAttributes(autoPlay=True, controls=False, muted=False)
-        )
+    ctx = webrtc_streamer(
+        key="driver-drowsiness-detection",
+        video_frame_callback=video_frame_callback,
+        audio_frame_callback=audio_frame_callback,
+        rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
+        media_stream_constraints=capture_manager.media_stream_constraints(),
+        video_html_attrs=VideoHTMLAttributes(autoPlay=True, controls=False, muted=False)
+    )
 
 
     if st.button("End Trip") or st.session_state.p3:
-        shared_state["connection"].close()
+        release_trip_pipeline()  # Flushes the metrics bus into the trip writer first
+        trip_writer.close()
+        if landmark_recorder is not None:
+            landmark_recorder.close()
+        metrics.remove(session=session)
+        capture_manager.unregister(session)
+        write_trip_summary(st.session_state.curr_table_name, trip_thresholds, st.session_state.driver or None)
+        if calibrator is not None and calibrator.result(trip_thresholds) is not None:
+            save_driver_thresholds(st.session_state.driver, trip_thresholds, calibrator.statistics())
         st.session_state.p3 = True
         st.session_state.main_state = False
         st.session_state.p2 = False
         st.experimental_rerun()
 
     if st.button("Return Home", key="p2_to_main"):
+        release_trip_pipeline()  # Flushes the metrics bus into the trip writer first
+        trip_writer.close()
+        if landmark_recorder is not None:
+            landmark_recorder.close()
+            os.remove(landmark_recorder.path)
+        metrics.remove(session=session)
+        capture_manager.unregister(session)
         delete_table(st.session_state['curr_table_name'])
         st.session_state.p2 = False
         st.session_state.main_state = True
         st.session_state.p3 = False
         st.experimental_rerun()
 
+    # Live charts, redrawn at a low rate for as long as the stream is running
+    show_live = st.checkbox("Show live charts", value=True)
+    live_panel = st.empty()
+    live_status = st.empty()
+    while show_live and ctx.state.playing:
+        create_live_panel(live_buffer, live_panel)
+        calibration_status = ""
+        if calibrator is not None:
+            calibration_status = "calibrated" if calibrator.done else f"calibrating {calibrator.progress:.0%}"
+        live_status.caption(f"Frames skipped as stale: {age_gate.dropped} ({age_gate.drop_rate:.1%}), "
+                            f"last frame age {age_gate.last_age * 1000:.0f} ms. "
+                            f"EAR_THRESH {trip_thresholds['EAR_THRESH']}, MAR_THRESH {trip_thresholds['MAR_THRESH']} {calibration_status}")
+        time.sleep(LIVE_REFRESH_SECONDS)
+
 #page containing the interactive dashboard
 def page3():
+    import pandas as pd
+
     st.title("Trip Information")
     
-    # Fetch table names from the database
-    names_dict = get_table_names()
+    # Summarize any trip that ended without a summary, once per session
+    if not st.session_state.backfilled:
+        backfill_trip_summaries(thresholds)
+        st.session_state.backfilled = True
+
+    # Filters are applied by the database query, not to the loaded page
+    date_range = st.date_input("Trips started between:", ())
+    has_alarms = st.checkbox("Only trips with alarms")
+    start_time = end_time = None
+    if len(date_range) == 2:
+        start_time = pd.Timestamp(date_range[0], tz=DISPLAY_TZ).timestamp()
+        end_time = (pd.Timestamp(date_range[1], tz=DISPLAY_TZ) + pd.Timedelta(days=1)).timestamp()
+
+    # Start again from the newest trip whenever the filters change
+    filters = (start_time, end_time, has_alarms)
+    if st.session_state.trip_filters != filters:
+        st.session_state.trip_filters = filters
+        st.session_state.trip_cursors = [None]
+
+    # Fetch one extra trip to know whether there is an older page
+    page = get_trip_page(TRIPS_PER_PAGE + 1, st.session_state.trip_cursors[-1], start_time, end_time, has_alarms)
+    has_older = len(page) > TRIPS_PER_PAGE
+    summaries = {summary["table_name"]: summary for summary in page[:TRIPS_PER_PAGE]}
+
+    col1, col2 = st.columns(spec=[1, 1])
+    with col1:
+        if st.button("Newer trips", disabled=len(st.session_state.trip_cursors) == 1):
+            st.session_state.trip_cursors.pop()
+            st.experimental_rerun()
+    with col2:
+        if st.button("Older trips", disabled=not has_older):
+            last = page[TRIPS_PER_PAGE - 1]
+            st.session_state.trip_cursors.append((last["start_time"], last["table_name"]))
+            st.experimental_rerun()
 
-    # Display the list of available tables
-    selected_table = st.selectbox("Select a trip:", names_dict.keys())
+    # Display the current page of trips
+    selected_table = st.selectbox("Select a trip:", summaries.keys(), format_func=lambda name: trip_label(summaries[name]))
 
     if selected_table:
-        st.session_state["selected"]= names_dict[selected_table]
+        st.session_state["selected"]= selected_table
         st.session_state.p3 = True
         
-        # Load data from the selected table
-        trip_data = load_data_from_table(st.session_state["selected"])
-
-        # Create the dashboard with the data
-        if trip_data.empty == False:
-            create_dashboard(trip_data)
+        summary = summaries[selected_table]
+        overview = load_trip_overview(selected_table)
+
+        # Compacted trips only have their summary and overview left
+        if summary.get("compacted"):
+            st.caption(f"Per-frame data of trips older than {RETENTION_DAYS:g} days has been compacted, only the summary and overview are kept.")
+            if not overview.empty:
+                create_overview(overview)
+            create_trip_summary(summary)
         else:
-            st.write("No Data In Table")
+            # Trips recorded before the timestamp index and the overview existed get them when first opened
+            ensure_timestamp_index(selected_table)
+            if overview.empty:
+                write_trip_overview(selected_table, summary["start_time"], summary["end_time"])
+                overview = load_trip_overview(selected_table)
+
+            # Create the dashboard from the overview and the zoomed window
+            if overview.empty == False:
+                create_dashboard(selected_table, overview, summary)
+            else:
+                st.write("No Data In Table")
+
+            create_export(selected_table, start_time, end_time)
             
         if st.button("Delete Trip details"):
             delete_table(st.session_state["selected"])
-            names_dict = get_table_names()
             st.session_state.p3=True
             st.session_state.main_state = False
             st.session_state.p2 = False
@@ -313,6 +791,40 @@ def page3():
         st.session_state.p3 = False
         st.experimental_rerun()
 
+
+#page containing the fleet-wide analytics
+def page4():
+    import pandas as pd
+
+    st.title("Fleet Analytics")
+
+    now = pd.Timestamp.now(tz=DISPLAY_TZ)
+    date_range = st.date_input("Trips started between:", ((now - pd.Timedelta(days=30)).date(), now.date()))
+
+    # Wait until both ends of the range are picked
+    if len(date_range) == 2:
+        create_analytics(*date_range)
+
+    if st.button("Return Home", key='p4_to_main'):
+        st.session_state.p4 = False
+        st.session_state.main_state = True
+        st.experimental_rerun()
+
+
+#page containing the admin view of the hot-path metrics
+def page5():
+    st.title("Admin")
+
+    if st.button("Refresh"):
+        st.experimental_rerun()
+
+    create_admin_view()
+
+    if st.button("Return Home", key='p5_to_main'):
+        st.session_state.p5 = False
+        st.session_state.main_state = True
+        st.experimental_rerun()
+
     
 if st.session_state.main_state:
     main()
@@ -322,3 +834,9 @@ if st.session_state.p2:
 
 if st.session_state.p3:
     page3()
+
+if st.session_state.p4:
+    page4()
+
+if st.session_state.p5:
+    page5()
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app modules are flat files in D3F_Final, imported the way the app and tools import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,23 @@
+from alarm_signal import AlarmSignal
+from instrumentation import metrics
+
+
+def test_read_returns_the_latest_state():
+    signal = AlarmSignal("test-latest")
+    assert signal.read()[0] is False
+
+    signal.publish(True)
+    play_alarm, age = signal.read()
+    assert play_alarm is True
+    assert age >= 0.0
+
+
+def test_read_latency_is_recorded():
+    signal = AlarmSignal("test-read-latency")
+    for _ in range(10):
+        signal.read()
+
+    histogram = metrics.histogram("d3f_alarm_signal_read_seconds", "", session="test-read-latency")
+    if metrics.enabled:
+        assert histogram.count == 10
+        assert histogram.quantile(0.99) < 0.001
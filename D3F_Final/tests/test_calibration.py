@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from calibration import P2Quantile, ThresholdCalibrator
+
+
+def test_p2_quantile_empty():
+    assert P2Quantile(0.5).value() is None
+
+
+def test_p2_quantile_few_samples_uses_sorted_values():
+    estimator = P2Quantile(0.5)
+    for x in (3.0, 1.0, 2.0):
+        estimator.add(x)
+    assert estimator.value() == 2.0
+
+
+@pytest.mark.parametrize("p", [0.5, 0.95])
+def test_p2_quantile_uniform(p):
+    rng = random.Random(0)
+    estimator = P2Quantile(p)
+    for _ in range(20000):
+        estimator.add(rng.random())
+    assert estimator.value() == pytest.approx(p, abs=0.02)
+
+
+def test_p2_quantile_keeps_five_markers():
+    estimator = P2Quantile(0.5)
+    for i in range(10000):
+        estimator.add(float(i % 97))
+    assert len(estimator.heights) == 5
+    assert estimator.heights == sorted(estimator.heights)
+
+
+def test_calibrator_thresholds_from_baseline():
+    calibrator = ThresholdCalibrator(duration=10.0, min_samples=100)
+    rng = random.Random(0)
+    now = 0.0
+    while not calibrator.update(rng.gauss(0.30, 0.01), rng.gauss(0.40, 0.02), now):
+        now += 1 / 30
+
+    result = calibrator.result({"EAR_THRESH": 0.18, "MAR_THRESH": 0.90, "WAIT_TIME": 4.0})
+    assert result["EAR_THRESH"] == pytest.approx(0.30 * 0.65, abs=0.01)
+    assert result["WAIT_TIME"] == 4.0
+
+
+def test_calibrator_too_few_samples():
+    calibrator = ThresholdCalibrator(duration=1.0, min_samples=100)
+    calibrator.update(0.3, 0.4, 0.0)
+    calibrator.update(0.3, 0.4, 2.0)
+    assert calibrator.done
+    assert calibrator.result({"EAR_THRESH": 0.18, "MAR_THRESH": 0.90}) is None
@@ -0,0 +1,111 @@
+import pytest
+
+from drowsy_detection import DrowsinessStateMachine, FatigueWindow
+
+thresholds = {"EAR_THRESH": 0.18, "MAR_THRESH": 0.90, "WAIT_TIME": 4.0}
+
+FPS = 30
+
+
+def test_fatigue_window_blinks():
+    # A 0.1 s blink every second for a minute
+    window = FatigueWindow(window=60.0)
+    for i in range(60 * FPS):
+        window.update(i / FPS, i % FPS < 3)
+
+    assert window.perclos == pytest.approx(10.0, abs=0.5)
+    assert window.blink_rate == pytest.approx(60.0, abs=2.0)
+    assert window.blink_duration == pytest.approx(0.1, abs=0.005)
+
+
+def test_fatigue_window_slides():
+    window = FatigueWindow(window=10.0)
+    for i in range(10 * FPS):
+        window.update(i / FPS, True)
+    assert window.perclos == pytest.approx(100.0)
+
+    for i in range(10 * FPS, 25 * FPS):
+        window.update(i / FPS, False)
+    # Running sums, the closed time leaves the window up to float rounding
+    assert window.perclos == pytest.approx(0.0, abs=1e-9)
+    assert window.blink_rate == 0.0
+
+
+def test_fatigue_window_ignores_gaps():
+    window = FatigueWindow(window=60.0)
+    window.update(0.0, False)
+    window.update(1 / FPS, False)
+    window.update(5.0, True)  # No face for ~5 s before this frame
+    assert window.perclos == 0.0
+
+
+def test_fatigue_window_closure_across_a_gap_is_not_a_blink():
+    window = FatigueWindow(window=60.0)
+    window.update(0.0, False)
+    window.update(1 / FPS, True)
+    window.update(5.0, True)  # No face for ~5 s while the eyes were closed
+    window.update(5.1, False)
+    assert window.blink_duration == pytest.approx(0.1)
+
+    window.update(6.0, True)
+    window.face_lost()
+    window.update(6.1, False)
+    assert window.blink_duration == pytest.approx(0.1)
+
+
+def test_fatigue_window_long_closure_is_not_a_blink():
+    window = FatigueWindow(window=60.0)
+    for i in range(2 * FPS):
+        window.update(i / FPS, True)
+    window.update(2.0, False)
+
+    assert window.blink_duration == 0.0
+    assert window.perclos > 90.0
+
+
+def test_state_machine_alarm_after_wait_time():
+    state = DrowsinessStateMachine(start_time=0.0)
+    alarms = [state.update(0.1, 0.3, i / FPS, thresholds) for i in range(1, 5 * FPS)]
+
+    first = alarms.index(True)
+    assert first / FPS == pytest.approx(thresholds["WAIT_TIME"], abs=1 / FPS)
+    assert all(alarms[first:])
+    assert state.eye_shut_counter == 1
+    assert state.alarm_counter == 1
+
+
+def test_state_machine_eyes_open_reset():
+    state = DrowsinessStateMachine(start_time=0.0)
+    for i in range(1, 3 * FPS):
+        state.update(0.1, 0.3, i / FPS, thresholds)
+    assert state.update(0.3, 0.3, 3.0, thresholds) is False
+    assert state.drowsy_time == 0.0
+
+    # A new closure counts from zero again
+    for i in range(3 * FPS + 1, 6 * FPS):
+        assert state.update(0.1, 0.3, i / FPS, thresholds) is False
+    assert state.eye_shut_counter == 2
+
+
+def test_state_machine_no_face_reset():
+    state = DrowsinessStateMachine(start_time=0.0)
+    for i in range(1, 5 * FPS):
+        state.update(0.1, 0.3, i / FPS, thresholds)
+    assert state.play_alarm
+
+    state.reset(5.0)
+    assert not state.play_alarm
+    assert state.drowsy_time == 0.0
+
+    # The closure before the face was lost does not end as a blink
+    state.update(0.1, 0.3, 5.0 + 1 / FPS, thresholds)
+    state.update(0.3, 0.3, 5.0 + 2 / FPS, thresholds)
+    assert state.fatigue.blink_duration == pytest.approx(1 / FPS)
+
+
+def test_state_machine_counts_yawns_once():
+    state = DrowsinessStateMachine(start_time=0.0)
+    mars = [0.3] * 5 + [1.2] * 30 + [0.3] * 5 + [1.2] * 30
+    for i, mar in enumerate(mars):
+        state.update(0.3, mar, i / FPS, thresholds)
+    assert state.yawn_counter == 2
@@ -0,0 +1,59 @@
+import av
+import numpy as np
+
+from bench_pipeline import VIDEO_TIME_BASE, FixtureFaceMesh, check_frame_path, landmark_fixtures, synthetic_frames
+from drowsy_detection import VideoFrameHandler
+from frame_path import FramePath
+
+thresholds = {"EAR_THRESH": 0.18, "MAR_THRESH": 0.90, "WAIT_TIME": 4.0}
+
+
+def received_frame(pts, time_base=VIDEO_TIME_BASE, width=160, height=120):
+    frame = av.VideoFrame.from_ndarray(synthetic_frames(1, width, height, seed=pts)[0], format="rgb24").reformat(format="yuv420p")
+    frame.pts = pts
+    if time_base is not None:
+        frame.time_base = time_base
+    return frame
+
+
+def fixture_frame_path():
+    return FramePath(VideoFrameHandler(session="test", facemesh_model=FixtureFaceMesh(landmark_fixtures(4))))
+
+
+def test_single_conversion_and_no_allocations():
+    result = check_frame_path(160, 120, count=40)
+
+    assert result["conversions"] == {"to_ndarray(rgb24)": 1.0}
+    assert result["mirror_copies"] == 1.0
+    assert result["video_frames_created"] == 0
+    assert result["output_buffers"] <= 4
+    assert result["timing_mismatches"] == 0
+    assert result["passed"]
+
+
+def test_frame_without_time_base():
+    frame_path = fixture_frame_path()
+    new_frame, _ = frame_path(received_frame(7, time_base=None), thresholds)
+    assert new_frame.pts == 7
+
+
+def test_repeat_restamps_a_copy_of_the_last_output():
+    frame_path = fixture_frame_path()
+    first = received_frame(0)
+    assert frame_path.repeat(first) is first  # Nothing to show again yet
+
+    output, _ = frame_path(first, thresholds)
+    pixels = output.to_ndarray(format="rgb24")
+
+    repeated = frame_path.repeat(received_frame(3000))
+    assert repeated is not output
+    assert (repeated.pts, repeated.time_base) == (3000, VIDEO_TIME_BASE)
+    assert output.pts == 0  # The frame already sent is left alone
+    assert np.array_equal(repeated.to_ndarray(format="rgb24"), pixels)
+
+
+def test_repeat_after_resolution_change():
+    frame_path = fixture_frame_path()
+    frame_path(received_frame(0), thresholds)
+    smaller = received_frame(3000, width=80, height=60)
+    assert frame_path.repeat(smaller) is smaller
@@ -0,0 +1,36 @@
+import math
+
+import pytest
+
+from ingest import clean_row, trip_name_from_file
+
+
+def test_clean_row_converts_values():
+    row = clean_row(["1700000000.5", "0.25", "0.4", "3", "1.0", "0", "True", "12.5", "", None])
+    assert row == (1700000000.5, 0.25, 0.4, 3, 1, 0, 1, 12.5, None, None)
+
+
+@pytest.mark.parametrize("alarm_on, expected", [("True", 1), ("False", 0), ("1", 1), ("0", 0), (1, 1), (0.0, 0)])
+def test_clean_row_alarm_flag(alarm_on, expected):
+    assert clean_row([1.0, 0.25, 0.4, 0, 0, 0, alarm_on])[6] == expected
+
+
+@pytest.mark.parametrize("values", [
+    [0.0, 0.25, 0.4, 0, 0, 0, 0],  # No timestamp
+    [1.0, math.nan, 0.4, 0, 0, 0, 0],
+    [1.0, 0.25, math.inf, 0, 0, 0, 0],
+    [1.0, 0.25, 0.4, -1, 0, 0, 0],  # Negative counter
+    ["1.0", "0.3", "0.5", "inf", "0", "0", "0"],  # Infinite counter
+    [1.0, 0.25, 0.4, 0, 0, 0, 0, math.nan],
+    [1.0, "open", 0.4, 0, 0, 0, 0],
+    [1.0, 0.25, 0.4, 0, 0, 0, "yes"],
+    [1.0, 0.25, 0.4, 0, 0, 0, None],
+])
+def test_clean_row_rejects_unusable_samples(values):
+    assert clean_row(values) is None
+
+
+def test_trip_name_from_file():
+    assert trip_name_from_file("uploads/trip_20240101120000.sqlite.gz") == "trip_20240101120000"
+    assert trip_name_from_file("trip_20240101120000_2.csv") == "trip_20240101120000_2"
+    assert trip_name_from_file("spool.csv") is None
@@ -0,0 +1,62 @@
+from live_metrics import MetricsRingBuffer
+
+
+def row(i):
+    return {"timestamp": float(i), "EAR": 0.25, "MAR": 0.4, "alarm_on": i % 2 == 0}
+
+
+class CopyHook:
+    """Stands in for the buffer's array, running `during` when the reader copies it"""
+
+    def __init__(self, data, during):
+        self.data = data
+        self.during = during
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def copy(self):
+        self.during()
+        return self.data.copy()
+
+
+def test_snapshot_oldest_first():
+    buffer = MetricsRingBuffer(8)
+    for i in range(5):
+        buffer.append(row(i))
+
+    snapshot = buffer.snapshot()
+    assert list(snapshot["timestamp"]) == [0, 1, 2, 3, 4]
+    assert list(snapshot["alarm_on"]) == [1, 0, 1, 0, 1]
+
+
+def test_snapshot_after_wrap_leaves_out_the_slot_being_written():
+    buffer = MetricsRingBuffer(4)
+    for i in range(10):
+        buffer.append(row(i))
+
+    # The slot after the newest row is where the writer goes next, it is never returned
+    assert list(buffer.snapshot()["timestamp"]) == [7, 8, 9]
+
+
+def test_snapshot_since():
+    buffer = MetricsRingBuffer(8)
+    for i in range(6):
+        buffer.append(row(i))
+    assert list(buffer.snapshot(since=3.0)["timestamp"]) == [3, 4, 5]
+
+
+def test_snapshot_discards_rows_overwritten_during_copy():
+    buffer = MetricsRingBuffer(4)
+    for i in range(6):
+        buffer.append(row(i))
+
+    # One row is appended while the reader copies: it replaced row 2, and the
+    # writer may already be writing the next slot (row 3)
+    buffer._data = CopyHook(buffer._data, lambda: buffer.append(row(6)))
+    assert list(buffer.snapshot()["timestamp"]) == [4, 5]
+
+
+def test_snapshot_empty():
+    buffer = MetricsRingBuffer(4)
+    assert len(buffer.snapshot()["timestamp"]) == 0
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from metrics_bus import DROP_NEWEST, DROP_OLDEST, MetricsBus
+
+
+class BlockingHandler:
+    """Records what it receives, holding the delivery thread on the first record until released"""
+
+    def __init__(self):
+        self.received = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, record):
+        self.entered.set()
+        self.release.wait(5)
+        self.received.append(record)
+
+
+def fill_while_blocked(overflow):
+    bus = MetricsBus("test")
+    handler = BlockingHandler()
+    subscription = bus.subscribe("slow", handler, capacity=3, overflow=overflow)
+
+    bus.publish(0)
+    assert handler.entered.wait(5)
+    accepted = [subscription.offer(i) for i in range(1, 7)]
+
+    handler.release.set()
+    bus.close(5)
+    return handler.received, subscription, accepted
+
+
+def test_drop_oldest_keeps_the_freshest_records():
+    received, subscription, accepted = fill_while_blocked(DROP_OLDEST)
+    assert received == [0, 4, 5, 6]
+    assert subscription.dropped == 3
+    assert accepted == [True, True, True, False, False, False]
+
+
+def test_drop_newest_keeps_the_queued_backlog():
+    received, subscription, accepted = fill_while_blocked(DROP_NEWEST)
+    assert received == [0, 1, 2, 3]
+    assert subscription.dropped == 3
+    assert accepted == [True, True, True, False, False, False]
+
+
+def test_every_subscriber_gets_every_record():
+    bus = MetricsBus("test")
+    first, second = [], []
+    bus.subscribe("first", first.append)
+    bus.subscribe("second", second.append)
+    for i in range(100):
+        bus.publish(i)
+    bus.close(5)
+
+    assert first == second == list(range(100))
+    assert bus.published == 100
+
+
+def test_failing_handler_is_counted_and_keeps_running():
+    bus = MetricsBus("test")
+    received = []
+
+    def handler(record):
+        if record == 1:
+            raise ValueError("bad record")
+        received.append(record)
+
+    subscription = bus.subscribe("flaky", handler)
+    for i in range(3):
+        bus.publish(i)
+    bus.close(5)
+
+    assert received == [0, 2]
+    assert subscription.failed == 1
+    assert subscription.delivered == 2
+
+
+def test_unsubscribe_stops_delivery():
+    bus = MetricsBus("test")
+    received = []
+    subscription = bus.subscribe("gone", received.append)
+    bus.publish(0)
+    bus.unsubscribe(subscription)
+    bus.publish(1)
+
+    assert received == [0]
+    assert bus.subscriptions == ()
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        MetricsBus("test").subscribe("bad", print, overflow="drop_all")
@@ -0,0 +1,11 @@
+from bench_pipeline import HEAVY_MODULES, check_startup
+
+#Allowed app import time in seconds beyond streamlit itself, as bench_pipeline.py --startup-budget
+STARTUP_BUDGET = 1.0
+
+
+def test_app_startup_is_light():
+    result = check_startup(STARTUP_BUDGET)
+
+    assert result["heavy_modules"] == [], f"imported at startup: {', '.join(result['heavy_modules'])} (lazily imported: {HEAVY_MODULES})"
+    assert result["seconds"] <= STARTUP_BUDGET
@@ -0,0 +1,202 @@
+"""
+Streaming export of raw trip samples to CSV or Parquet.
+
+Trips are read from the database with an unbuffered cursor, CHUNK_SIZE rows
+at a time, and every chunk is written out before the next is fetched, so
+memory stays flat however long the trips are. CSV is gzip-compressed on the
+fly; Parquet (needs pyarrow) is written one zstd-compressed row group per
+chunk. Every row carries the trip it belongs to, and trips recorded before a
+column existed get empty values for it so all rows share one schema.
+
+Usage:
+    python trip_export.py trip_20240101120000 --output trip.csv.gz
+    python trip_export.py --from 2024-01-01 --to 2024-01-31 --format parquet --output january.parquet
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import io
+import sys
+from zoneinfo import ZoneInfo
+
+from trip_storage import DISPLAY_TZ, SUMMARY_TABLE, TRIP_COLUMNS, connect, db_credentials
+
+#Rows fetched from the database and written out at a time
+CHUNK_SIZE = 10000
+
+#Columns of the exported rows
+EXPORT_COLUMNS = ("trip",) + TRIP_COLUMNS
+
+FORMATS = ("csv", "parquet")
+
+
+#function to list the trips started between two epoch times that still have their raw samples
+def get_trips_in_range(start_time, end_time):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT s.table_name AS table_name FROM {SUMMARY_TABLE} s JOIN information_schema.tables t
+                ON t.table_schema = %s AND t.table_name = s.table_name
+            WHERE s.start_time >= %s AND s.start_time < %s
+            ORDER BY s.start_time
+            """
+            cursor.execute(sql, (db_credentials["database"], start_time, end_time))
+            trips = [row["table_name"] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+    return trips
+
+
+def _select_list(cursor, table_name):
+    """TRIP_COLUMNS of a table, NULL for columns it was created without"""
+    sql = "SELECT column_name AS column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s"
+    cursor.execute(sql, (db_credentials["database"], table_name))
+    existing = {row["column_name"].lower() for row in cursor.fetchall()}
+    return ", ".join(column if column.lower() in existing else f"NULL AS {column}" for column in TRIP_COLUMNS)
+
+
+def iter_trip_chunks(table_names, chunk_size=CHUNK_SIZE):
+    """
+    Stream the samples of trips in timestamp order.
+
+    Yields:
+        chunk: (list) Up to chunk_size tuples in EXPORT_COLUMNS order.
+    """
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            select_lists = {table_name: _select_list(cursor, table_name) for table_name in table_names}
+    finally:
+        connection.close()
+
+    for table_name in table_names:
+        # The unbuffered cursor fetches from the server as rows are consumed
+        connection = connect(unbuffered=True)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT %s, {select_lists[table_name]} FROM {table_name} ORDER BY timestamp", (table_name,))
+                while True:
+                    chunk = cursor.fetchmany(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            connection.close()
+
+
+class CsvSink:
+    """Gzip-compressed CSV written chunk by chunk"""
+
+    def __init__(self, fileobj):
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode="wb")
+        self._text = io.TextIOWrapper(self._gzip, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, chunk):
+        self._writer.writerows(chunk)
+
+    def close(self):
+        self._text.flush()
+        self._text.detach()
+        self._gzip.close()
+
+
+class ParquetSink:
+    """Parquet file with one row group per chunk"""
+
+    def __init__(self, fileobj):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), or export to csv") from None
+
+        self._pa = pa
+        types = {"trip": pa.string(), "eye_shut_counter": pa.int32(), "yawn_counter": pa.int32(),
+                 "alarm_counter": pa.int32(), "alarm_on": pa.int8()}
+        self._schema = pa.schema([(column, types.get(column, pa.float64())) for column in EXPORT_COLUMNS])
+        self._writer = pq.ParquetWriter(fileobj, self._schema, compression="zstd")
+
+    def write(self, chunk):
+        columns = list(zip(*chunk))
+        arrays = [self._pa.array(values, type=field.type) for values, field in zip(columns, self._schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def export_trips(table_names, fileobj, fmt="csv", chunk_size=CHUNK_SIZE):
+    """
+    Write the samples of trips to a binary file object.
+
+    Args:
+        table_names: (list) Trips to export, in output order.
+        fileobj: Writable binary file object.
+        fmt: (str) "csv" (gzip-compressed) or "parquet".
+        chunk_size: (int) Rows held in memory at a time.
+
+    Returns:
+        rows: (int) Number of samples exported.
+    """
+    sink = ParquetSink(fileobj) if fmt == "parquet" else CsvSink(fileobj)
+    rows = 0
+    try:
+        for chunk in iter_trip_chunks(table_names, chunk_size):
+            sink.write(chunk)
+            rows += len(chunk)
+    finally:
+        sink.close()
+
+    return rows
+
+
+def export_file_name(table_names, fmt):
+    stem = table_names[0] if len(table_names) == 1 else f"{table_names[0]}-{table_names[-1]}"
+    return f"{stem}.csv.gz" if fmt == "csv" else f"{stem}.parquet"
+
+
+def date_range_epochs(start_date, end_date):
+    """Epoch times from the start of start_date to the end of end_date (YYYY-mm-dd) in DISPLAY_TZ"""
+    tz = ZoneInfo(DISPLAY_TZ)
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=tz)
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=tz) + datetime.timedelta(days=1)
+    return start.timestamp(), end.timestamp()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export raw trip samples to CSV or Parquet")
+    parser.add_argument("trips", nargs="*", help="trip tables to export")
+    parser.add_argument("--from", dest="start_date", help=f"export the trips started on or after this date (YYYY-mm-dd, {DISPLAY_TZ})")
+    parser.add_argument("--to", dest="end_date", help="... and on or before this date (default: same as --from)")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="csv (gzip-compressed) or parquet (default: csv)")
+    parser.add_argument("--output", help="output file, - for stdout (default: named after the trips)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=f"rows fetched and written at a time (default: {CHUNK_SIZE})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    table_names = list(args.trips)
+    if args.start_date:
+        table_names += get_trips_in_range(*date_range_epochs(args.start_date, args.end_date or args.start_date))
+    if not table_names:
+        sys.exit("No trips to export, give trip names or a date range with raw samples left")
+
+    output = args.output or export_file_name(table_names, args.format)
+    if output == "-":
+        rows = export_trips(table_names, sys.stdout.buffer, args.format, args.chunk_size)
+    else:
+        with open(output, "wb") as f:
+            rows = export_trips(table_names, f, args.format, args.chunk_size)
+
+    print(f"Exported {rows} samples of {len(table_names)} trips to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
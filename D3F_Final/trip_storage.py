@@ -0,0 +1,759 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from instrumentation import metrics
+
+# pandas and pymysql are imported by the functions that use them, so pages
+# and tools that never touch the database do not pay for loading them.
+
+# Add your database credentials here
+db_credentials = {
+    "host": "localhost",
+    "user": "root",
+    "password": "mysql",
+    "database": "d3f",
+}
+
+# Name of the table holding one summary record per trip
+SUMMARY_TABLE = "trip_summary"
+
+# Name of the table holding the per-trip EAR distribution by hour of day
+ROLLUP_TABLE = "trip_rollup"
+
+# Name of the table holding the calibrated thresholds of each driver
+THRESHOLDS_TABLE = "driver_thresholds"
+
+# Name of the table holding the downsampled overview of each trip
+OVERVIEW_TABLE = "trip_overview"
+
+# Most buckets in the overview of a trip, and the shortest bucket in seconds
+OVERVIEW_POINTS = 2000
+OVERVIEW_MIN_BUCKET = 1.0
+
+# Name of the index on the sample timestamp of a raw trip table
+TIMESTAMP_INDEX = "idx_timestamp"
+
+# Width of the EAR histogram bins kept in the rollup table
+EAR_BIN_WIDTH = 0.02
+EAR_BINS = 25
+
+# Timezone used for hour-of-day analytics and when displaying trip timestamps
+# (timestamps are stored as UTC epoch seconds)
+DISPLAY_TZ = "US/Eastern"
+
+# Columns of a raw trip table, in the order rows are inserted
+TRIP_COLUMNS = ("timestamp", "EAR", "MAR", "eye_shut_counter", "yawn_counter", "alarm_counter", "alarm_on", "perclos", "blink_rate", "blink_duration")
+
+# Raw trip tables are named trip_YYYYmmddHHMMSS, with a _N suffix for trips started in the same second
+TRIP_TABLE_PATTERN = "^trip_[0-9]{14}(_[0-9]+)?$"
+
+# Samples further apart than this (in seconds) are treated as a gap in the
+# recording (e.g. no face detected) and do not count towards any duration.
+MAX_SAMPLE_GAP = 1.0
+
+logger = logging.getLogger("d3f.trip_storage")
+
+
+def connect(unbuffered=False):
+    """Open a connection to the trip database, rows are returned as dicts unless unbuffered"""
+    import pymysql
+    from pymysql.cursors import DictCursor, SSCursor
+
+    return pymysql.connect(**db_credentials, cursorclass=SSCursor if unbuffered else DictCursor)
+
+
+def format_trip_name(table_name):
+    """Turn a trip_YYYYmmddHHMMSS table name into a readable label"""
+    year = table_name[5:9]
+    month = table_name[9:11]
+    day = table_name[11:13]
+    hour = table_name[13:15]
+    minute = table_name[15:17]
+    second = table_name[17:19]
+    return f"Trip {month}/{day}/{year} {hour}:{minute}:{second}"
+
+
+def trip_creation_time(table_name):
+    """Epoch time encoded in a trip_YYYYmmddHHMMSS table name (server local time)"""
+    return datetime.datetime.strptime(table_name[5:19], "%Y%m%d%H%M%S").timestamp()
+
+
+#function for creating a backend database based on the credentials in the db_credentials dictionary
+def create_database(db_name):
+    import pymysql
+
+    credentials= {"host": db_credentials["host"], "user": db_credentials["user"], "password": db_credentials["password"]}
+    connection = pymysql.connect(**credentials)
+    try:
+        with connection.cursor() as cursor:
+            sql= f"CREATE DATABASE IF NOT EXISTS {db_name}"
+            cursor.execute(sql)
+            connection.commit()
+    finally:
+        connection.close()
+
+
+#function for creating the tables that store one summary record and the EAR rollup per trip, and the driver thresholds
+def create_summary_table():
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+                table_name VARCHAR(64) PRIMARY KEY,
+                start_time DOUBLE,
+                end_time DOUBLE,
+                duration DOUBLE,
+                samples INT,
+                eye_shut_counter INT,
+                yawn_counter INT,
+                alarm_counter INT,
+                alarm_time DOUBLE,
+                longest_eye_closure DOUBLE,
+                perclos DOUBLE,
+                mean_ear DOUBLE,
+                driver VARCHAR(64),
+                compacted BOOLEAN NOT NULL DEFAULT FALSE,
+                INDEX (start_time),
+                INDEX (driver, start_time)
+            )
+            """
+            cursor.execute(sql)
+            sql = f"""
+            CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+                table_name VARCHAR(64),
+                hour_of_day TINYINT,
+                ear_bin SMALLINT,
+                samples INT,
+                PRIMARY KEY (table_name, hour_of_day, ear_bin)
+            )
+            """
+            cursor.execute(sql)
+            sql = f"""
+            CREATE TABLE IF NOT EXISTS {OVERVIEW_TABLE} (
+                table_name VARCHAR(64),
+                timestamp DOUBLE,
+                samples INT,
+                EAR DOUBLE,
+                EAR_min DOUBLE,
+                MAR DOUBLE,
+                MAR_max DOUBLE,
+                perclos DOUBLE,
+                alarm_on BOOLEAN,
+                PRIMARY KEY (table_name, timestamp)
+            )
+            """
+            cursor.execute(sql)
+            sql = f"""
+            CREATE TABLE IF NOT EXISTS {THRESHOLDS_TABLE} (
+                driver VARCHAR(64) PRIMARY KEY,
+                ear_thresh DOUBLE,
+                mar_thresh DOUBLE,
+                ear_baseline DOUBLE,
+                mar_median DOUBLE,
+                mar_p95 DOUBLE,
+                samples INT,
+                calibrated_at DOUBLE
+            )
+            """
+            cursor.execute(sql)
+            connection.commit()
+    finally:
+        connection.close()
+
+
+#Function for creating a new table to collect trip data, returns the table name
+def create_table(table_name=None, if_not_exists=False):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            # Create a unique table name
+            if table_name is None:
+                table_name = f"trip_{time.strftime('%Y%m%d%H%M%S')}"
+            # Create the table
+            sql_create = f"""
+            CREATE TABLE {"IF NOT EXISTS " if if_not_exists else ""}{table_name} (
+                timestamp DOUBLE,
+                EAR DOUBLE,
+                MAR DOUBLE,
+                eye_shut_counter INT,
+                yawn_counter INT,
+                alarm_counter INT,
+                alarm_on BOOLEAN,
+                perclos DOUBLE,
+                blink_rate DOUBLE,
+                blink_duration DOUBLE,
+                INDEX {TIMESTAMP_INDEX} (timestamp)
+            )
+            """
+            cursor.execute(sql_create)
+            connection.commit()
+
+    finally:
+        connection.close()
+
+    return table_name
+
+
+#function to insert many trip samples at once, with one commit per batch
+def insert_samples(table_name, rows, batch_size=5000):
+    sql_insert = f"""
+        INSERT INTO {table_name}
+        ({", ".join(TRIP_COLUMNS)})
+        VALUES ({", ".join(["%s"] * len(TRIP_COLUMNS))})
+        """
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(sql_insert, rows[start:start + batch_size])
+                connection.commit()
+    finally:
+        connection.close()
+
+
+class TripWriter:
+    """
+    Writes trip samples to the database from a background thread.
+
+    The video callback only appends to an in-memory queue; rows are inserted
+    in batches with one commit per batch on the writer's own connection, so
+    a slow database never holds up frame processing or the alarm.
+
+    A failed batch is logged and retried on a new connection up to
+    max_retries times before its samples are given up; errors and lost
+    count the failures and the samples lost to them. With max_queue set,
+    samples arriving while that many are waiting are dropped and counted
+    in dropped, so a stalled database cannot grow memory without limit.
+    """
+
+    def __init__(self, table_name: str, batch_size: int = 200, flush_interval: float = 1.0, max_retries: int = 5, retry_interval: float = 2.0,
+                 max_queue: int = 0):
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.errors = 0
+        self.lost = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue(max_queue)  # Unbounded when max_queue is 0
+        self._write_metric = metrics.histogram("d3f_db_write_seconds", "Trip sample batch insert and commit time", session=table_name)
+        self._rows_metric = metrics.counter("d3f_db_rows_written_total", "Trip samples written to the database", session=table_name)
+        self._errors_metric = metrics.counter("d3f_db_write_errors_total", "Failed trip sample batch inserts", session=table_name)
+        self._lost_metric = metrics.counter("d3f_db_rows_lost_total", "Trip samples given up after failed inserts", session=table_name)
+        self._dropped_metric = metrics.counter("d3f_db_rows_dropped_total", "Trip samples dropped by a full write queue", session=table_name)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"TripWriter-{table_name}", daemon=True)
+        self._thread.start()
+
+    def write(self, row_dict: dict):
+        """
+        Queue one sample for insertion, never blocks.
+
+        Returns:
+            False if the queue was full and the sample was dropped, True otherwise.
+        """
+        try:
+            self._queue.put_nowait([row_dict[column] for column in TRIP_COLUMNS])
+        except queue.Full:
+            self.dropped += 1
+            self._dropped_metric.inc()
+            return False
+        return True
+
+    def close(self):
+        """Flush the queued samples and stop the writer thread"""
+        self._closed.set()
+        self._thread.join()
+
+    def _run(self):
+        sql_insert = f"""
+            INSERT INTO {self.table_name}
+            ({", ".join(TRIP_COLUMNS)})
+            VALUES ({", ".join(["%s"] * len(TRIP_COLUMNS))})
+            """
+        connection = None
+        try:
+            while not (self._closed.is_set() and self._queue.empty()):
+                batch = []
+                try:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+                    while len(batch) < self.batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                if batch:
+                    connection = self._insert(connection, sql_insert, batch)
+                    if connection is None and self._closed.is_set():
+                        # The database is still unreachable at the end of the trip, give up the rest instead of retrying every batch
+                        self._drop_queued()
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _insert(self, connection, sql_insert, batch):
+        """Insert one batch, reconnecting and retrying after errors; returns the connection to reuse, None if the batch was lost"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if connection is None:
+                    connection = connect()
+                write_start = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql_insert, batch)
+                connection.commit()
+                self._write_metric.observe(time.perf_counter() - write_start)
+                self._rows_metric.inc(len(batch))
+                return connection
+            except Exception:
+                self.errors += 1
+                self._errors_metric.inc()
+                logger.exception("Writing %d samples to %s failed (attempt %d of %d)", len(batch), self.table_name, attempt + 1, self.max_retries + 1)
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    connection = None
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_interval)
+
+        self.lost += len(batch)
+        self._lost_metric.inc(len(batch))
+        logger.error("Gave up %d samples of %s, %d lost so far", len(batch), self.table_name, self.lost)
+        return None
+
+    def _drop_queued(self):
+        dropped = 0
+        try:
+            while True:
+                self._queue.get_nowait()
+                dropped += 1
+        except queue.Empty:
+            pass
+        if dropped:
+            self.lost += dropped
+            self._lost_metric.inc(dropped)
+            logger.error("Gave up %d queued samples of %s at the end of the trip", dropped, self.table_name)
+
+
+#function to load data from table elected from the drop down menu
+def load_data_from_table(table_name):
+    import pandas as pd
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"SELECT * FROM {table_name}"
+            cursor.execute(sql)
+            data = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return pd.DataFrame(data)
+
+
+#function to add the timestamp index to trip tables created before it existed
+def ensure_timestamp_index(table_name):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            # Any index starting with the timestamp serves range queries (ingested trips have a unique one)
+            sql = """
+            SELECT COUNT(*) AS found FROM information_schema.statistics
+            WHERE table_schema = %s AND table_name = %s AND column_name = 'timestamp' AND seq_in_index = 1
+            """
+            cursor.execute(sql, (db_credentials["database"], table_name))
+            if not cursor.fetchone()["found"]:
+                cursor.execute(f"ALTER TABLE {table_name} ADD INDEX {TIMESTAMP_INDEX} (timestamp)")
+                connection.commit()
+    finally:
+        connection.close()
+
+
+#function to load the samples of a trip between two epoch times at full resolution, through the timestamp index
+def load_trip_window(table_name, start_time, end_time):
+    import pandas as pd
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"SELECT * FROM {table_name} WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp"
+            cursor.execute(sql, (start_time, end_time))
+            data = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return pd.DataFrame(data)
+
+
+#function to rebuild the downsampled overview of a trip, at most OVERVIEW_POINTS buckets between its start and end time
+def write_trip_overview(table_name, start_time, end_time):
+    bucket = max(OVERVIEW_MIN_BUCKET, (end_time - start_time) / OVERVIEW_POINTS)
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            # Trips recorded before PERCLOS was stored have no such column
+            sql = """
+            SELECT COUNT(*) AS found FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s AND column_name = 'perclos'
+            """
+            cursor.execute(sql, (db_credentials["database"], table_name))
+            perclos = "AVG(perclos)" if cursor.fetchone()["found"] else "NULL"
+
+            cursor.execute(f"DELETE FROM {OVERVIEW_TABLE} WHERE table_name = %s", (table_name,))
+            sql = f"""
+            INSERT INTO {OVERVIEW_TABLE} (table_name, timestamp, samples, EAR, EAR_min, MAR, MAR_max, perclos, alarm_on)
+            SELECT %s, %s + FLOOR((timestamp - %s) / %s) * %s AS bucket,
+                COUNT(*), AVG(EAR), MIN(EAR), AVG(MAR), MAX(MAR), {perclos}, MAX(alarm_on)
+            FROM {table_name}
+            GROUP BY bucket
+            """
+            cursor.execute(sql, (table_name, start_time, start_time, bucket, bucket))
+            connection.commit()
+    finally:
+        connection.close()
+
+
+#function to load the downsampled overview of a trip, oldest bucket first
+def load_trip_overview(table_name):
+    import pandas as pd
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT timestamp, samples, EAR, EAR_min, MAR, MAR_max, perclos, alarm_on
+            FROM {OVERVIEW_TABLE} WHERE table_name = %s ORDER BY timestamp
+            """
+            cursor.execute(sql, (table_name,))
+            data = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return pd.DataFrame(data)
+
+
+#function to delete a trip (raw table and summary) from backend database
+def delete_table(table_name):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"DROP TABLE IF EXISTS {table_name}"
+            cursor.execute(sql)
+            sql = f"DELETE FROM {SUMMARY_TABLE} WHERE table_name = %s"
+            cursor.execute(sql, (table_name,))
+            sql = f"DELETE FROM {ROLLUP_TABLE} WHERE table_name = %s"
+            cursor.execute(sql, (table_name,))
+            sql = f"DELETE FROM {OVERVIEW_TABLE} WHERE table_name = %s"
+            cursor.execute(sql, (table_name,))
+            connection.commit()
+    finally:
+        connection.close()
+
+
+def summarize_samples(rows, ear_thresh, rollup=None):
+    """
+    Compute the trip summary in a single pass over time-ordered samples.
+
+    Args:
+        rows: (iterable) Tuples of (timestamp, EAR, eye_shut_counter,
+                         yawn_counter, alarm_counter, alarm_on)
+                         ordered by timestamp.
+        ear_thresh: (float) EAR value below which the eyes count as closed.
+        rollup: (dict) Optional, filled with sample counts keyed by
+                       (hour_of_day, ear_bin) in DISPLAY_TZ.
+
+    Returns:
+        summary: (dict) Duration, counters, alarm time, longest eye closure,
+                        PERCLOS (in %) and mean EAR of the trip.
+    """
+    summary = {
+        "start_time": None,
+        "end_time": None,
+        "duration": 0.0,
+        "samples": 0,
+        "eye_shut_counter": 0,
+        "yawn_counter": 0,
+        "alarm_counter": 0,
+        "alarm_time": 0.0,
+        "longest_eye_closure": 0.0,
+        "perclos": 0.0,
+        "mean_ear": 0.0,
+    }
+
+    ear_sum = 0.0
+    covered_time = 0.0
+    closed_time = 0.0
+    closure = 0.0
+    prev = None
+    tz = ZoneInfo(DISPLAY_TZ)
+    hour_start = hour_end = None
+
+    for timestamp, ear, eye_shut_counter, yawn_counter, alarm_counter, alarm_on in rows:
+        if rollup is not None:
+            # The local hour only has to be looked up again once the samples leave it
+            if hour_start is None or not hour_start <= timestamp < hour_end:
+                local = datetime.datetime.fromtimestamp(timestamp, tz)
+                hour = local.hour
+                hour_start = timestamp - (local.minute * 60 + local.second + local.microsecond / 1e6)
+                hour_end = hour_start + 3600
+            key = (hour, min(int(ear / EAR_BIN_WIDTH), EAR_BINS - 1))
+            rollup[key] = rollup.get(key, 0) + 1
+
+        if prev is None:
+            summary["start_time"] = timestamp
+        else:
+            # The interval up to this sample is attributed to the previous sample's state
+            prev_timestamp, prev_ear, prev_alarm_on = prev
+            dt = timestamp - prev_timestamp
+            if dt > MAX_SAMPLE_GAP:
+                closure = 0.0
+            else:
+                covered_time += dt
+                if prev_alarm_on:
+                    summary["alarm_time"] += dt
+                if prev_ear < ear_thresh:
+                    closed_time += dt
+                    closure += dt
+                    summary["longest_eye_closure"] = max(summary["longest_eye_closure"], closure)
+                else:
+                    closure = 0.0
+
+        summary["samples"] += 1
+        ear_sum += ear
+        # Counters only ever increase during a trip, so the last sample holds the totals
+        summary["eye_shut_counter"] = eye_shut_counter
+        summary["yawn_counter"] = yawn_counter
+        summary["alarm_counter"] = alarm_counter
+        prev = (timestamp, ear, alarm_on)
+
+    if prev is not None:
+        summary["end_time"] = prev[0]
+        summary["duration"] = prev[0] - summary["start_time"]
+        summary["mean_ear"] = ear_sum / summary["samples"]
+    if covered_time > 0:
+        summary["perclos"] = 100.0 * closed_time / covered_time
+
+    return summary
+
+
+#function to compute and store the summary record and EAR rollup of a trip, called when the trip ends
+def write_trip_summary(table_name, thresholds, driver=None):
+    # Stream the samples with an unbuffered cursor so memory stays flat for long trips
+    connection = connect(unbuffered=True)
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT timestamp, EAR, eye_shut_counter, yawn_counter, alarm_counter, alarm_on
+            FROM {table_name} ORDER BY timestamp
+            """
+            cursor.execute(sql)
+            rollup = {}
+            summary = summarize_samples(cursor, thresholds["EAR_THRESH"], rollup)
+    finally:
+        connection.close()
+
+    # Trips without samples are still listed, at the time they were created
+    if summary["start_time"] is None:
+        summary["start_time"] = summary["end_time"] = trip_creation_time(table_name)
+
+    summary = {"table_name": table_name, **summary, "driver": driver}
+    columns = ", ".join(summary.keys())
+    placeholders = ", ".join(["%s"] * len(summary))
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"REPLACE INTO {SUMMARY_TABLE} ({columns}) VALUES ({placeholders})"
+            cursor.execute(sql, list(summary.values()))
+            sql = f"DELETE FROM {ROLLUP_TABLE} WHERE table_name = %s"
+            cursor.execute(sql, (table_name,))
+            sql = f"INSERT INTO {ROLLUP_TABLE} (table_name, hour_of_day, ear_bin, samples) VALUES (%s, %s, %s, %s)"
+            cursor.executemany(sql, [(table_name, hour, ear_bin, count) for (hour, ear_bin), count in rollup.items()])
+            connection.commit()
+    finally:
+        connection.close()
+
+    # The dashboard draws the whole trip from the overview and only queries the zoomed window
+    write_trip_overview(table_name, summary["start_time"], summary["end_time"])
+
+    return summary
+
+
+#function to summarize trips recorded before summaries existed (or never ended properly), and date summaries of empty trips written without a start time
+def backfill_trip_summaries(thresholds):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+            SELECT table_name AS table_name FROM information_schema.tables
+            WHERE table_type = 'BASE TABLE' AND table_schema = %s AND table_name REGEXP %s
+            """
+            cursor.execute(sql, (db_credentials["database"], TRIP_TABLE_PATTERN))
+            tables = {row["table_name"] for row in cursor.fetchall()}
+
+            cursor.execute(f"SELECT table_name FROM {SUMMARY_TABLE}")
+            summarized = {row["table_name"] for row in cursor.fetchall()}
+
+            # The trip listing pages by start time, a NULL one would never be reached after the first page
+            cursor.execute(f"SELECT table_name FROM {SUMMARY_TABLE} WHERE start_time IS NULL")
+            undated = [row["table_name"] for row in cursor.fetchall()]
+            if undated:
+                sql = f"UPDATE {SUMMARY_TABLE} SET start_time = %s, end_time = COALESCE(end_time, %s) WHERE table_name = %s"
+                cursor.executemany(sql, [(trip_creation_time(name), trip_creation_time(name), name) for name in undated])
+                connection.commit()
+    finally:
+        connection.close()
+
+    missing = sorted(tables - summarized)
+    for table_name in missing:
+        write_trip_summary(table_name, thresholds)
+
+    return missing
+
+
+#function to get one page of trip summaries for the drop down menu, newest trip first
+def get_trip_page(limit, cursor_key=None, start_time=None, end_time=None, has_alarms=False):
+    """
+    Keyset-paginated trip listing with the filters applied by the database.
+
+    Args:
+        limit: (int) Maximum number of trips to return.
+        cursor_key: (tuple) (start_time, table_name) of the last trip on the
+                            previous page, None for the first page.
+        start_time: (float) Only trips started at or after this epoch time.
+        end_time: (float) Only trips started before this epoch time.
+        has_alarms: (bool) Only trips in which the alarm was triggered.
+
+    Returns:
+        summaries: (list) Summary records of the trips on the page.
+    """
+    conditions = []
+    params = []
+    if cursor_key is not None:
+        conditions.append("(start_time < %s OR (start_time = %s AND table_name < %s))")
+        params += [cursor_key[0], cursor_key[0], cursor_key[1]]
+    if start_time is not None:
+        conditions.append("start_time >= %s")
+        params.append(start_time)
+    if end_time is not None:
+        conditions.append("start_time < %s")
+        params.append(end_time)
+    if has_alarms:
+        conditions.append("alarm_counter > 0")
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT * FROM {SUMMARY_TABLE} {where}
+            ORDER BY start_time DESC, table_name DESC
+            LIMIT %s
+            """
+            cursor.execute(sql, params + [limit])
+            summaries = cursor.fetchall()
+    finally:
+        connection.close()
+
+    return summaries
+
+
+#function to get the calibrated thresholds of a driver applied on top of the defaults, None if never calibrated
+def get_driver_thresholds(driver, thresholds):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"SELECT ear_thresh, mar_thresh FROM {THRESHOLDS_TABLE} WHERE driver = %s"
+            cursor.execute(sql, (driver,))
+            row = cursor.fetchone()
+    finally:
+        connection.close()
+
+    if row is None:
+        return None
+    return {**thresholds, "EAR_THRESH": row["ear_thresh"], "MAR_THRESH": row["mar_thresh"]}
+
+
+#function to store the thresholds and baseline statistics of a driver from a finished calibration
+def save_driver_thresholds(driver, thresholds, statistics):
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            REPLACE INTO {THRESHOLDS_TABLE}
+                (driver, ear_thresh, mar_thresh, ear_baseline, mar_median, mar_p95, samples, calibrated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.execute(sql, (driver, thresholds["EAR_THRESH"], thresholds["MAR_THRESH"], statistics["ear_baseline"],
+                                 statistics["mar_median"], statistics["mar_p95"], statistics["samples"], time.time()))
+            connection.commit()
+    finally:
+        connection.close()
+
+
+#function to get per-driver alarm and yawn rates for trips started between two epoch times
+def get_driver_statistics(start_time, end_time):
+    import pandas as pd
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT COALESCE(driver, 'Unknown') AS driver,
+                COUNT(*) AS trips,
+                SUM(duration) / 3600 AS hours,
+                SUM(alarm_counter) * 3600 / NULLIF(SUM(duration), 0) AS alarms_per_hour,
+                SUM(yawn_counter) * 3600 / NULLIF(SUM(duration), 0) AS yawns_per_hour,
+                SUM(perclos * duration) / NULLIF(SUM(duration), 0) AS perclos,
+                SUM(mean_ear * samples) / NULLIF(SUM(samples), 0) AS mean_ear
+            FROM {SUMMARY_TABLE}
+            WHERE start_time >= %s AND start_time < %s
+            GROUP BY COALESCE(driver, 'Unknown')
+            ORDER BY alarms_per_hour DESC
+            """
+            cursor.execute(sql, (start_time, end_time))
+            statistics = pd.DataFrame(cursor.fetchall(), columns=["driver", "trips", "hours", "alarms_per_hour", "yawns_per_hour", "perclos", "mean_ear"])
+    finally:
+        connection.close()
+
+    # MySQL returns the aggregates as DECIMAL
+    numeric = ["hours", "alarms_per_hour", "yawns_per_hour", "perclos", "mean_ear"]
+    statistics[numeric] = statistics[numeric].astype(float)
+    return statistics
+
+
+#function to get the EAR distribution by hour of day for trips started between two epoch times
+def get_ear_distribution(start_time, end_time, driver=None):
+    import pandas as pd
+
+    connection = connect()
+    try:
+        with connection.cursor() as cursor:
+            sql = f"""
+            SELECT r.hour_of_day AS hour_of_day, r.ear_bin AS ear_bin, SUM(r.samples) AS samples
+            FROM {ROLLUP_TABLE} r JOIN {SUMMARY_TABLE} s ON s.table_name = r.table_name
+            WHERE s.start_time >= %s AND s.start_time < %s
+            """
+            params = [start_time, end_time]
+            if driver is not None:
+                sql += " AND COALESCE(s.driver, 'Unknown') = %s"
+                params.append(driver)
+            sql += " GROUP BY r.hour_of_day, r.ear_bin"
+            cursor.execute(sql, params)
+            distribution = pd.DataFrame(cursor.fetchall(), columns=["hour_of_day", "ear_bin", "samples"])
+    finally:
+        connection.close()
+
+    distribution["samples"] = distribution["samples"].astype(int)
+    distribution["EAR"] = (distribution["ear_bin"] + 0.5) * EAR_BIN_WIDTH
+    return distribution
@@ -0,0 +1,67 @@
+import queue
+import threading
+
+# FaceMesh graphs built ahead of time, handed out to new sessions
+_models = queue.SimpleQueue()
+_refill = threading.Event()
+_ready = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def start(alarm_file_path: str, pool_size: int = 1):
+    """
+    Warm up the detection pipeline on a background thread.
+
+    Imports the media and model libraries, decodes the alarm sound and keeps
+    pool_size FaceMesh graphs ready so starting a trip does not block the
+    page on model initialisation. Safe to call more than once.
+    """
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    threading.Thread(target=_run, args=(alarm_file_path, pool_size), name="Warmup", daemon=True).start()
+
+
+def _run(alarm_file_path, pool_size):
+    # Importing here pays the import cost off the page's critical path
+    import av  # noqa: F401
+    import streamlit_webrtc  # noqa: F401
+    from audio_handling import load_sound
+    from drowsy_detection import get_mediapipe_app
+
+    load_sound(alarm_file_path)
+
+    while True:
+        while _models.qsize() < pool_size:
+            _models.put(get_mediapipe_app())
+        _ready.set()
+
+        _refill.wait()
+        _refill.clear()
+
+
+def take_facemesh(timeout: float = 0.0):
+    """
+    Take a prebuilt FaceMesh graph from the pool.
+
+    Args:
+        timeout: (float) Seconds to wait for the warm-up to provide one.
+
+    Returns:
+        A FaceMesh graph, or None if none is ready (the caller builds its own).
+    """
+    try:
+        model = _models.get(timeout=timeout) if timeout else _models.get_nowait()
+    except queue.Empty:
+        return None
+
+    _refill.set()
+    return model
+
+
+def is_ready():
+    return _ready.is_set()
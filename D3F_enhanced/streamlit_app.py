@@ -1,5 +1,6 @@
 import os
 import av
+import time
 import pandas as pd
 import threading
 import streamlit as st
@@ -9,6 +10,7 @@ from streamlit_webrtc import VideoHTMLAttributes, webrtc_streamer
 from pymysql.cursors import DictCursor
 from audio_handling import AudioFrameHandler
 from drowsy_detection import VideoFrameHandler
+from trip_recorder import TRIP_DTYPES, TripRecorder
 import plotly.express as px
 
 # Add your database credentials here
@@ -66,7 +68,7 @@ def create_dashboard(data):
     st.write(f"Alarm triggered {alarm_count} times during the trip")
 
 
-def create_table_and_insert_data(df):
+def create_table_and_insert_data(recorder, batch_size=5000):
     connection = pymysql.connect(**db_credentials, cursorclass=DictCursor)
     try:
         with connection.cursor() as cursor:
@@ -86,14 +88,14 @@ def create_table_and_insert_data(df):
             cursor.execute(sql_create)
             connection.commit()
 
-            # Insert data from the DataFrame into the table
-            for _, row in df.iterrows():
-                sql_insert = f"""
-                INSERT INTO {table_name}
-                (timestamp, EAR, MAR, eye_shut_counter, yawn_counter, alarm_on)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(sql_insert, row.to_list())
+            # Insert the recorded rows in batches, with one commit per batch
+            sql_insert = f"""
+            INSERT INTO {table_name}
+            ({", ".join(TRIP_DTYPES)})
+            VALUES ({", ".join(["%s"] * len(TRIP_DTYPES))})
+            """
+            for batch in recorder.iter_batches(batch_size):
+                cursor.executemany(sql_insert, batch)
                 connection.commit()
     finally:
         connection.close()
@@ -131,7 +133,7 @@ def main():
     st.title("Drowsiness Detection")
     
     if 'drwsy' not in st.session_state:
-        st.session_state['drwsy'] = pd.DataFrame(columns=['timestamp', 'EAR', 'MAR', 'eye_shut_counter', 'yawn_counter', 'alarm_on'])
+        st.session_state['drwsy'] = TripRecorder()
     
     # col1, col2 = st.columns(spec=[1, 1])
     
@@ -190,9 +192,9 @@ def main():
     while ctx.state.playing:
         with lock:
             row_dict = video_handler.row_dict
-        if row_dict is None:
-            continue
-        st.session_state['drwsy'] = pd.concat([st.session_state['drwsy'], pd.DataFrame.from_records([row_dict])], ignore_index=True)
+        # Only rows of new frames are recorded, then wait for the next frame
+        st.session_state['drwsy'].append(row_dict)
+        time.sleep(0.01)
 
     if st.button("End Trip"):
         # Send the data in the dataframe df to the MySQL database
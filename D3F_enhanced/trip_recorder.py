@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Columns of a trip and the NumPy type each one is stored as.
+TRIP_DTYPES = {
+    "timestamp": "datetime64[us]",
+    "EAR": np.float64,
+    "MAR": np.float64,
+    "eye_shut_counter": np.int32,
+    "yawn_counter": np.int32,
+    "alarm_on": np.bool_,
+}
+
+
+class TripRecorder:
+    """
+    Collects the per-frame rows of a trip in typed NumPy columns.
+
+    Columns are preallocated and doubled in size when full, so appending a
+    row is O(1) amortised and a trip of any length costs about 33 bytes per
+    row instead of one DataFrame per row.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in TRIP_DTYPES.items()}
+        self._size = 0
+        self._last_row = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._columns["EAR"])
+
+    def append(self, row_dict: dict):
+        """
+        Add one row, given as the row_dict of VideoFrameHandler.
+
+        Returns:
+            False if row_dict is the row appended last (no new frame since), True otherwise.
+        """
+        if not row_dict or row_dict is self._last_row:
+            return False
+
+        if self._size == self.capacity:
+            self._grow(2 * self.capacity)
+
+        for name, column in self._columns.items():
+            column[self._size] = row_dict[name]
+        self._size += 1
+        self._last_row = row_dict
+        return True
+
+    def _grow(self, capacity):
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def columns(self):
+        """Views of the recorded part of each column, no copy"""
+        return {name: column[:self._size] for name, column in self._columns.items()}
+
+    def to_dataframe(self):
+        """DataFrame backed by the recorded columns (no copy where pandas allows it)"""
+        return pd.DataFrame(self.columns(), copy=False)
+
+    def iter_batches(self, batch_size: int = 5000):
+        """
+        Yield the rows as lists of tuples in TRIP_DTYPES column order, ready for executemany.
+
+        Timestamps are converted to datetime objects one batch at a time.
+        """
+        columns = self.columns()
+        for start in range(0, self._size, batch_size):
+            stop = min(start + batch_size, self._size)
+            yield list(zip(*(column[start:stop].tolist() for column in columns.values())))